@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Compares the random string generation in oidcservice with the earlier
+implementation, that picked one character at the time with random.choice.
+
+Usage: python benchmarks/bench_rndstr.py [number of iterations]
+"""
+import random
+import sys
+import timeit
+
+from oidcservice import BASECH
+from oidcservice import BASECHR
+from oidcservice import rndstr
+from oidcservice import unreserved
+
+_system_random = random.SystemRandom()
+
+
+def rndstr_choice(size=16, rnd=random):
+    return "".join([rnd.choice(BASECHR) for _ in range(size)])
+
+
+def unreserved_choice(size=64, rnd=random):
+    return "".join([rnd.choice(BASECH) for _ in range(size)])
+
+
+CASES = [
+    ('rndstr(32), random.choice', lambda: rndstr_choice(32)),
+    ('rndstr(32), SystemRandom.choice',
+     lambda: rndstr_choice(32, _system_random)),
+    ('rndstr(32)', lambda: rndstr(32)),
+    ('unreserved(64), random.choice', lambda: unreserved_choice(64)),
+    ('unreserved(64), SystemRandom.choice',
+     lambda: unreserved_choice(64, _system_random)),
+    ('unreserved(64)', lambda: unreserved(64)),
+]
+
+
+def main(number=100000):
+    for _name, _func in CASES:
+        _best = min(timeit.repeat(_func, number=number, repeat=3))
+        print('{:40} {:8.3f} us/call'.format(_name, _best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
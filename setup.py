@@ -69,7 +69,14 @@ setup(
     install_requires=[
         "pyyaml>=5.1.0",
         'oidcmsg>=1.1.0',
+        'filelock>=3.0.0',
+        'requests>=2.25.0',
+        # Retry(allowed_methods=...)
+        'urllib3>=1.26.0',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+    },
     tests_require=[
         "responses",
         "testfixtures",
@@ -1,11 +1,11 @@
 import hashlib
+import os
 import string
+import threading
+from functools import lru_cache
+from random import SystemRandom
 
-# Since SystemRandom is not available on all systems
-try:
-    import SystemRandom as rnd
-except ImportError:
-    import random as rnd
+rnd = SystemRandom()
 
 __author__ = 'Roland Hedberg'
 __version__ = '1.1.1'
@@ -32,6 +32,66 @@ SAML2_BEARER_GRANT_TYPE = "urn:ietf:params:oauth:grant-type:saml2-bearer"
 BASECHR = string.ascii_letters + string.digits
 
 
+# Number of random bytes fetched from the OS at the time
+RANDOM_BUFFER_SIZE = 4096
+
+_random = threading.local()
+
+
+def _random_bytes(size):
+    """
+    Bytes from the OS CSPRNG. They are fetched in bulk and kept in a per
+    thread buffer. A buffer is never used in another process than the one it
+    was filled in, so a forked child doesn't produce the same strings as its
+    parent.
+    """
+    _pid = os.getpid()
+    if getattr(_random, 'pid', None) != _pid:
+        _random.pid = _pid
+        _random.buf = b''
+        _random.pos = 0
+
+    if _random.pos + size > len(_random.buf):
+        _random.buf = os.urandom(max(size, RANDOM_BUFFER_SIZE))
+        _random.pos = 0
+
+    _start = _random.pos
+    _random.pos += size
+    return _random.buf[_start:_random.pos]
+
+
+@lru_cache(maxsize=8)
+def _translation(alphabet):
+    _len = len(alphabet)
+    # Bytes at or above the limit would make some characters more likely
+    # than others, they are thrown away.
+    _limit = 256 - 256 % _len
+    _table = bytes(ord(alphabet[b % _len]) if b < _limit else 0
+                   for b in range(256))
+    return _table, bytes(range(_limit, 256))
+
+
+def random_string(size, alphabet):
+    """
+    Returns a random string of characters from an alphabet, using the OS
+    CSPRNG. Random bytes are mapped to characters using rejection sampling
+    so that all characters are equally likely.
+
+    :param size: The length of the string
+    :param alphabet: The characters to choose from, at most 256 ASCII
+        characters.
+    :return: string
+    """
+    _table, _delete = _translation(alphabet)
+    _res = b''
+    while len(_res) < size:
+        _need = size - len(_res)
+        # Fetch a few more than needed to make another round unlikely
+        _res += _random_bytes(_need + _need // 4 + 8).translate(_table,
+                                                                 _delete)
+    return _res[:size].decode('ascii')
+
+
 def rndstr(size=16):
     """
     Returns a string of random ascii characters or digits
@@ -39,7 +99,7 @@ def rndstr(size=16):
     :param size: The length of the string
     :return: string
     """
-    return "".join([rnd.choice(BASECHR) for _ in range(size)])
+    return random_string(size, BASECHR)
 
 
 BASECH = string.ascii_letters + string.digits + '-._~'
@@ -53,8 +113,7 @@ def unreserved(size=64):
     :param size: The length of the string
     :return: string
     """
-
-    return "".join([rnd.choice(BASECH) for _ in range(size)])
+    return random_string(size, BASECH)
 
 
 def sanitize(str):
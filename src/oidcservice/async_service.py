@@ -0,0 +1,200 @@
+"""
+An asyncio counterpart to :py:meth:`oidcservice.service.Service.do_request`.
+Requests are sent through a transport, anything that implements the
+:py:class:`AsyncTransport` interface.
+"""
+import asyncio
+import logging
+from functools import partial
+
+from oidcmsg.oauth2 import is_error_message
+
+import requests
+from oidcservice.service import REQUEST_INFO
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+class HTTPResponse:
+    """The parts of a HTTP response a service needs"""
+
+    def __init__(self, status_code, text, headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+class AsyncTransport:
+    """
+    Sends HTTP requests. The response must have the attributes status_code,
+    text and headers, like :py:class:`HTTPResponse`.
+    """
+
+    async def request(self, method, url, data=None, headers=None):
+        """
+        :param method: HTTP method
+        :param url: Where to send the request
+        :param data: The request body
+        :param headers: HTTP headers
+        :return: The response
+        """
+        raise NotImplementedError()
+
+    async def close(self):
+        """Release any resources held by the transport"""
+
+
+class ThreadedTransport(AsyncTransport):
+    """
+    Uses a synchronous HTTP client, by default a pooled
+    :py:class:`requests.Session`, from worker threads.
+    """
+
+    def __init__(self, httpc=None, executor=None, timeout=10):
+        """
+        :param httpc: A callable with the same signature as
+            :py:func:`requests.request`
+        :param executor: A :py:class:`concurrent.futures.Executor`. Default is
+            the event loop's default executor.
+        :param timeout: Request timeout in seconds, only used with the
+            default HTTP client.
+        """
+        self._session = None
+        if httpc is None:
+            self._session = requests.Session()
+            httpc = partial(self._session.request, timeout=timeout)
+        self.httpc = httpc
+        self.executor = executor
+
+    async def request(self, method, url, data=None, headers=None):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            partial(self.httpc, method, url, data=data, headers=headers))
+
+    async def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class AIOHTTPTransport(AsyncTransport):
+    """
+    Sends requests with a :py:class:`aiohttp.ClientSession`, which keeps a
+    pool of connections. Requires aiohttp.
+    """
+
+    def __init__(self, limit=100, limit_per_host=0, timeout=10, session=None):
+        """
+        :param limit: Max number of connections in all
+        :param limit_per_host: Max number of connections per host, 0 means
+            no limit.
+        :param timeout: Request timeout in seconds
+        :param session: A :py:class:`aiohttp.ClientSession` to use instead
+            of creating one.
+        """
+        if aiohttp is None:
+            raise ImportError('AIOHTTPTransport requires aiohttp')
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.session = session
+
+    def _session(self):
+        # Created on first use since it must be bound to a running loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self.session
+
+    async def request(self, method, url, data=None, headers=None):
+        async with self._session().request(method, url, data=data,
+                                           headers=headers) as resp:
+            return HTTPResponse(resp.status, await resp.text(),
+                                dict(resp.headers))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def default_transport():
+    """
+    :return: A :py:class:`AIOHTTPTransport` if aiohttp is installed otherwise
+        a :py:class:`ThreadedTransport`.
+    """
+    if aiohttp is None:
+        return ThreadedTransport()
+    return AIOHTTPTransport()
+
+
+class AsyncService:
+    """
+    Wraps a service and adds an awaitable do_request. Everything else is
+    delegated to the service.
+
+    Note that a service's own do_request, with the caching some services
+    do there, isn't used.
+    """
+
+    def __init__(self, service, transport=None):
+        """
+        :param service: A :py:class:`oidcservice.service.Service` instance
+        :param transport: A :py:class:`AsyncTransport` instance
+        """
+        self.service = service
+        if transport is None:
+            transport = default_transport()
+        self.transport = transport
+
+    def __getattr__(self, item):
+        return getattr(self.__dict__['service'], item)
+
+    async def do_request(self, request_args=None, response_body_type='',
+                         **kwargs):
+        """
+        Constructs the request, sends it, parses the response and if it
+        wasn't an error response updates the service context.
+
+        :param request_args: Message arguments
+        :param response_body_type: Expected serialization of the response
+        :param kwargs: Extra keyword arguments, passed on to
+            get_request_parameters.
+        :return: The parsed response
+        """
+        _state = kwargs.get('state', '')
+        _info = self.service.get_request_parameters(request_args=request_args,
+                                                    **kwargs)
+        LOGGER.debug(REQUEST_INFO.format(_info['url'], _info['method'],
+                                         _info.get('body'),
+                                         _info.get('headers')))
+
+        reqresp = await self.transport.request(_info['method'], _info['url'],
+                                               data=_info.get('body'),
+                                               headers=_info.get('headers'))
+
+        response = self.service.parse_request_response(
+            reqresp, response_body_type, state=_state)
+        if not is_error_message(response):
+            self.service.update_service_context(response, key=_state)
+        return response
+
+
+def async_services(services, transport=None):
+    """
+    Wrap a set of services so they all share one transport.
+
+    :param services: A dictionary with services
+    :param transport: A :py:class:`AsyncTransport` instance
+    :return: A dictionary with :py:class:`AsyncService` instances
+    """
+    if transport is None:
+        transport = default_transport()
+    return {name: AsyncService(srv, transport) for name, srv in
+            services.items()}
@@ -0,0 +1,192 @@
+"""
+Refreshing access tokens for a large number of states.
+"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from oidcmsg.oauth2 import is_error_message
+
+LOGGER = logging.getLogger(__name__)
+
+
+class BatchResult:
+    """Progress and outcome of a batch refresh."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.finished = 0
+        self.total = 0
+        self.succeeded = 0
+        self.failed = 0
+        # state key -> error description
+        self.errors = {}
+
+    def add_error(self, state, error):
+        """
+        Record that refreshing the token for a state failed.
+
+        :param state: Key to the state
+        :param error: Description of the error
+        """
+        self.failed += 1
+        self.errors[state] = str(error)
+
+    @property
+    def done(self):
+        """Number of states that have been dealt with so far."""
+        return self.succeeded + self.failed
+
+    @property
+    def elapsed(self):
+        """Number of seconds the batch refresh has been running."""
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """Number of states dealt with per second."""
+        _elapsed = self.elapsed
+        if not _elapsed:
+            return 0.0
+        return self.done / _elapsed
+
+    def to_dict(self):
+        return {
+            'total': self.total, 'succeeded': self.succeeded,
+            'failed': self.failed, 'elapsed': self.elapsed,
+            'throughput': self.throughput
+        }
+
+
+class BatchRefresh:
+    """
+    Streams a set of state keys through request construction, concurrent
+    sending, response parsing and writing the result back to the state
+    database.
+    Responses are collected and written batch_size at the time, from the
+    calling thread, with one write per state. The state database interface
+    has no multi-state write, and going through the service's
+    update_service_context keeps what the service does besides storing the
+    token, like invalidating cached userinfo.
+    A failure for one state does not affect the others, it's recorded in the
+    result.
+    """
+
+    def __init__(self, service, httpc=None, max_concurrency=8, batch_size=100,
+                 progress=None):
+        """
+        :param service: The refresh_token service instance
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. Default is the service context's
+            :py:class:`oidcservice.http_transport.HTTPTransport`.
+        :param max_concurrency: Max number of requests in flight
+        :param batch_size: Number of results collected before they are
+            written to the state database and progress is reported.
+        :param progress: A callable that is called with the
+            :py:class:`BatchResult` instance after each written batch.
+        """
+        self.service = service
+        self.httpc = httpc or service.service_context.get_http_transport()
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.progress = progress
+
+    def construct(self, state):
+        """
+        Construct the refresh request for a state.
+
+        :param state: Key to the state
+        :return: Dictionary with the information needed to send the request
+        """
+        return self.service.get_request_parameters(state=state)
+
+    def send(self, state, info):
+        """
+        Send a refresh request and parse the response.
+
+        :param state: Key to the state
+        :param info: What :py:meth:`construct` returned
+        :return: The parsed response
+        """
+        _resp = self.httpc(info['method'], info['url'], data=info.get('body'),
+                           headers=info.get('headers'))
+        return self.service.parse_request_response(_resp, state=state)
+
+    def write_batch(self, batch, result):
+        """
+        Write a batch of responses to the state database, one write per
+        state.
+
+        :param batch: List of (state key, response) tuples
+        :param result: A :py:class:`BatchResult` instance
+        """
+        for _state, _resp in batch:
+            try:
+                self.service.update_service_context(_resp, key=_state)
+            except Exception as err:
+                LOGGER.error('Could not store refreshed token for %s: %s',
+                             _state, err)
+                result.add_error(_state, err)
+            else:
+                result.succeeded += 1
+
+    @staticmethod
+    def _collect(done, in_flight, batch, result):
+        for _fut in done:
+            _state = in_flight.pop(_fut)
+            try:
+                _resp = _fut.result()
+            except Exception as err:
+                LOGGER.warning('Refresh failed for %s: %s', _state, err)
+                result.add_error(_state, err)
+                continue
+
+            if is_error_message(_resp):
+                result.add_error(_state, _resp.to_json())
+            else:
+                batch.append((_state, _resp))
+
+    def _flush(self, batch, result):
+        self.write_batch(batch, result)
+        del batch[:]
+        if self.progress:
+            self.progress(result)
+
+    def run(self, states):
+        """
+        Refresh the access tokens bound to a set of states.
+
+        :param states: An iterable of state keys
+        :return: A :py:class:`BatchResult` instance
+        """
+        result = BatchResult()
+        batch = []
+        # future -> state key
+        _in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as _pool:
+            for _state in states:
+                result.total += 1
+                try:
+                    _info = self.construct(_state)
+                except Exception as err:
+                    LOGGER.warning('Could not construct refresh request for '
+                                   '%s: %s', _state, err)
+                    result.add_error(_state, err)
+                    continue
+
+                _in_flight[_pool.submit(self.send, _state, _info)] = _state
+
+                if len(_in_flight) >= self.max_concurrency:
+                    _done, _ = wait(_in_flight, return_when=FIRST_COMPLETED)
+                    self._collect(_done, _in_flight, batch, result)
+                    if len(batch) >= self.batch_size:
+                        self._flush(batch, result)
+
+            _done, _ = wait(_in_flight)
+            self._collect(_done, _in_flight, batch, result)
+
+        self._flush(batch, result)
+        result.finished = time.time()
+        LOGGER.info('Batch refresh done: %s', result.to_dict())
+        return result
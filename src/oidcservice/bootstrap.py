@@ -0,0 +1,235 @@
+"""
+Bootstrapping many OPs concurrently. For each OP the pipeline WebFinger (if
+needed), provider info discovery, JWKS fetch and dynamic client registration
+(if needed) is run.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from cryptojwt.key_jar import KeyJar
+from oidcmsg.oauth2 import is_error_message
+
+import requests
+from oidcservice.exception import OidcServiceError, ResponseError, ServerError
+from oidcservice.http_transport import HTTPTransport
+from oidcservice.oidc import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+
+LOGGER = logging.getLogger(__name__)
+
+WEBFINGER_SERVICE = {
+    'webfinger': {'class': 'oidcservice.oidc.webfinger.WebFinger'}
+}
+
+# Errors that are worth retrying: no connection, no answer in time or a 5xx
+# response. A 4xx response will be the same the next time.
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout, ServerError)
+
+# Errors after which a request that isn't idempotent can be sent again. A
+# registration that timed out waiting for the answer may have been done by
+# the OP, sending it again would register one more client.
+CONNECT_ERRORS = (requests.exceptions.ConnectionError,
+                  requests.exceptions.ConnectTimeout)
+
+
+class HostLimitedTransport:
+    """
+    Wraps a HTTP client and limits the number of concurrent requests to each
+    host. Also adds a default timeout to every request.
+    """
+
+    def __init__(self, httpc=None, per_host=2, timeout=10):
+        """
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. Default is a
+            :py:class:`oidcservice.http_transport.HTTPTransport` that
+            doesn't retry, retrying is left to :py:class:`Bootstrap`.
+        :param per_host: Max number of concurrent requests to one host
+        :param timeout: Timeout in seconds passed on to the HTTP client
+        """
+        self.httpc = httpc or HTTPTransport(retries=0)
+        self.per_host = per_host
+        self.timeout = timeout
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host):
+        with self._lock:
+            try:
+                return self._semaphores[host]
+            except KeyError:
+                _sem = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = _sem
+                return _sem
+
+    def __call__(self, method, url, **kwargs):
+        if self.timeout:
+            kwargs.setdefault('timeout', self.timeout)
+        with self._semaphore(urlsplit(url).netloc):
+            return self.httpc(method, url, **kwargs)
+
+
+class BootstrapResult:
+    """The outcome of bootstrapping one OP."""
+
+    def __init__(self, name):
+        self.name = name
+        self.service_context = None
+        self.services = None
+        self.error = ''
+        # step -> seconds
+        self.timing = {}
+        # step -> number of attempts
+        self.attempts = {}
+        self.elapsed = 0
+
+    @property
+    def ok(self):
+        return not self.error
+
+    def to_dict(self):
+        return {
+            'issuer': self.service_context.get('issuer') if
+            self.service_context else '',
+            'ok': self.ok, 'error': self.error, 'timing': self.timing,
+            'attempts': self.attempts, 'elapsed': self.elapsed
+        }
+
+
+class Bootstrap:
+    """
+    Runs the bootstrap pipelines of many OPs concurrently.
+
+    Each OP is described by a client configuration, the same as is used to
+    initiate a :py:class:`oidcservice.service_context.ServiceContext`.
+    If the configuration has a 'resource' but no 'issuer', WebFinger is used
+    to find the issuer. Dynamic client registration is done if the
+    configuration has no client_id and the OP has a registration endpoint.
+    """
+
+    def __init__(self, httpc=None, max_workers=16, per_host=2, timeout=10,
+                 retries=2, backoff=0.5, service_definitions=None):
+        """
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. It shouldn't retry by itself, the
+            retries would add up with the ones done here.
+        :param max_workers: Number of OPs that are bootstrapped concurrently
+        :param per_host: Max number of concurrent requests to one host
+        :param timeout: Timeout in seconds for each request
+        :param retries: Number of times a step is retried after a transient
+            error.
+        :param backoff: Seconds to wait before the first retry, doubled for
+            every retry.
+        :param service_definitions: The services to initiate for each OP.
+            Default is :py:data:`oidcservice.oidc.DEFAULT_SERVICES`.
+        """
+        self.transport = HostLimitedTransport(httpc, per_host=per_host,
+                                              timeout=timeout)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.service_definitions = service_definitions or DEFAULT_SERVICES
+
+    def _step(self, result, name, func, *args, retry_on=TRANSIENT_ERRORS,
+              **kwargs):
+        _start = time.time()
+        _attempt = 0
+        try:
+            while True:
+                _attempt += 1
+                try:
+                    return func(*args, **kwargs)
+                except retry_on as err:
+                    if _attempt > self.retries:
+                        raise
+                    LOGGER.info('%s for %s failed, retrying: %s', name,
+                                result.name, err)
+                    time.sleep(self.backoff * 2 ** (_attempt - 1))
+        finally:
+            result.attempts[name] = _attempt
+            result.timing[name] = time.time() - _start
+
+    def _request(self, service, **kwargs):
+        _resp = service.do_request(self.transport, **kwargs)
+        if is_error_message(_resp):
+            raise OidcServiceError('{} failed: {}'.format(service.service_name,
+                                                          _resp.to_json()))
+        return _resp
+
+    def _fetch_keys(self, service_context):
+        _issuer = service_context.get('issuer')
+        if 'jwks_uri' not in service_context.get('provider_info'):
+            return []
+        _keys = service_context.keyjar.get_issuer_keys(_issuer)
+        if not _keys:
+            raise ResponseError('No keys found for {}'.format(_issuer))
+        return _keys
+
+    def setup(self, config):
+        """
+        Initiate a service context and the services for an OP.
+
+        :param config: Client configuration
+        :return: Tuple of service context and services
+        """
+        _keyjar = KeyJar(httpc=self.transport)
+        _context = ServiceContext(config=config, keyjar=_keyjar)
+        _definitions = dict(self.service_definitions)
+        if 'resource' in config and 'webfinger' not in _definitions:
+            _definitions.update(WEBFINGER_SERVICE)
+        _services = init_services(_definitions, _context)
+        _context.service = _services
+        return _context, _services
+
+    def bootstrap(self, config):
+        """
+        Run the bootstrap pipeline for one OP.
+
+        :param config: Client configuration
+        :return: A :py:class:`BootstrapResult` instance
+        """
+        _start = time.time()
+        result = BootstrapResult(config.get('issuer') or
+                                 config.get('resource', ''))
+        try:
+            _context, _services = self.setup(config)
+            result.service_context = _context
+            result.services = _services
+
+            if not _context.get('issuer'):
+                self._step(result, 'webfinger', self._request,
+                           _services['webfinger'],
+                           resource=config['resource'])
+
+            self._step(result, 'provider_info', self._request,
+                       _services['provider_info'])
+            self._step(result, 'jwks', self._fetch_keys, _context)
+
+            if not _context.get('client_id') and \
+                    'registration_endpoint' in _context.get('provider_info'):
+                self._step(result, 'registration', self._request,
+                           _services['registration'],
+                           retry_on=CONNECT_ERRORS)
+        except Exception as err:
+            LOGGER.error('Bootstrap of %s failed: %s', result.name, err)
+            result.error = '{}: {}'.format(err.__class__.__name__, err)
+
+        result.elapsed = time.time() - _start
+        LOGGER.info('Bootstrap of %s: %s', result.name, result.to_dict())
+        return result
+
+    def run(self, configs):
+        """
+        Bootstrap a number of OPs concurrently.
+
+        :param configs: An iterable of client configurations
+        :return: A list of :py:class:`BootstrapResult` instances, in the
+            same order as the configurations.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as _pool:
+            return list(_pool.map(self.bootstrap, configs))
@@ -21,6 +21,11 @@ class ResponseError(OidcServiceError):
     pass
 
 
+# The server responded with a 5xx status code
+class ServerError(ResponseError):
+    pass
+
+
 class TimeFormatError(OidcServiceError):
     pass
 
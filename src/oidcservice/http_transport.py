@@ -0,0 +1,132 @@
+"""
+A synchronous HTTP transport that keeps connections to each issuer alive
+between requests.
+"""
+import logging
+import threading
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import requests
+
+LOGGER = logging.getLogger(__name__)
+
+# Response status codes that are worth retrying
+RETRY_STATUS = [502, 503, 504]
+
+
+class HTTPTransport:
+    """
+    A callable with the same signature as :py:func:`requests.request`.
+
+    There is one :py:class:`requests.Session`, with its own connection
+    pool, per origin (scheme, host and port), so connections to an OP are
+    kept alive and reused. Idempotent requests are retried, with backoff,
+    after a read error or a 502, 503 or 504 response. Requests that
+    couldn't connect are retried whatever the method.
+    """
+
+    def __init__(self, httpc_params=None, pool_size=10, retries=2,
+                 backoff=0.5, timeout=10):
+        """
+        :param httpc_params: Default keyword arguments for each request,
+            for instance 'verify', 'cert', 'proxies' and 'timeout'. Usually
+            :py:attr:`oidcservice.service_context.ServiceContext.httpc_params`.
+        :param pool_size: Max number of connections kept per origin
+        :param retries: Max number of times a request is retried
+        :param backoff: Backoff factor between retries, in seconds
+        :param timeout: Request timeout in seconds, unless httpc_params
+            says otherwise.
+        """
+        self.httpc_params = httpc_params if httpc_params is not None else {}
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._retries = 0
+        self._errors = 0
+
+    def session(self, url):
+        """
+        :param url: A URL
+        :return: The :py:class:`requests.Session` used for the URL's origin
+        """
+        _parts = urlsplit(url)
+        _origin = '{}://{}'.format(_parts.scheme, _parts.netloc)
+        with self._lock:
+            try:
+                return self._sessions[_origin]
+            except KeyError:
+                pass
+
+            _retry = Retry(total=self.retries, backoff_factor=self.backoff,
+                           status_forcelist=RETRY_STATUS,
+                           allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+                           raise_on_status=False)
+            _adapter = HTTPAdapter(pool_maxsize=self.pool_size,
+                                   max_retries=_retry)
+            _session = requests.Session()
+            _session.mount('{}://'.format(_parts.scheme), _adapter)
+            self._sessions[_origin] = _session
+            return _session
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        _kwargs = {'timeout': self.timeout}
+        _kwargs.update(self.httpc_params)
+        _kwargs.update(kwargs)
+
+        try:
+            _resp = self.session(url).request(method, url, data=data,
+                                              headers=headers, **_kwargs)
+        except requests.RequestException:
+            with self._lock:
+                self._requests += 1
+                self._errors += 1
+            raise
+
+        _retry = getattr(_resp.raw, 'retries', None)
+        with self._lock:
+            self._requests += 1
+            if _retry is not None:
+                self._retries += len(_retry.history)
+        return _resp
+
+    request = __call__
+
+    def metrics(self):
+        """
+        :return: A dictionary with the number of requests made, requests
+            that failed, retries done, connections opened and the number of
+            requests that reused a connection.
+        """
+        _opened = 0
+        _sent = 0
+        with self._lock:
+            for _session in self._sessions.values():
+                for _adapter in set(_session.adapters.values()):
+                    _pools = _adapter.poolmanager.pools
+                    for _key in _pools.keys():
+                        _pool = _pools.get(_key)
+                        if _pool is None:
+                            continue
+                        _opened += _pool.num_connections
+                        _sent += _pool.num_requests
+            return {
+                'requests': self._requests,
+                'errors': self._errors,
+                'retries': self._retries,
+                'connections_opened': _opened,
+                'connections_reused': max(_sent - _opened, 0)
+            }
+
+    def close(self):
+        """Close all sessions and their connections"""
+        with self._lock:
+            for _session in self._sessions.values():
+                _session.close()
+            self._sessions = {}
@@ -0,0 +1,218 @@
+"""
+Keeps the keys of other entities, fetched from their jwks_uri, fresh by
+refreshing them in the background ahead of expiry.
+"""
+import logging
+import random
+
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.scheduler import RefreshScheduler
+from oidcservice.single_flight import SingleFlight
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _remote_bundles(keyjar, issuer):
+    if issuer not in keyjar:
+        return []
+    return [kb for kb in keyjar[issuer] if kb.remote]
+
+
+class KeyRefreshScheduler(RefreshScheduler):
+    """
+    Keeps track of when the remote key bundles belonging to an issuer have to
+    be refreshed and refreshes them, in a pool of worker threads, before the
+    key jar would do it itself while a signature is being verified.
+
+    A refreshed bundle is fetched into a copy and the keys are then swapped
+    in, so a verification going on at the same time never sees an empty
+    bundle. If a refresh fails the old keys are kept and the refresh is
+    retried later.
+
+    One scheduler can serve many key jars, an issuer is tracked per key jar.
+    """
+    thread_name = 'key-refresh'
+
+    def __init__(self, lead_time=60, jitter=10, min_interval=30,
+                 retry_interval=60, max_workers=4, single_flight=None):
+        """
+        :param lead_time: How many seconds before expiry the keys should be
+            refreshed.
+        :param jitter: Upper bound, in seconds, of a random amount of time
+            that is subtracted from the refresh time.
+        :param min_interval: Least number of seconds between two refreshes
+            triggered by an unknown key.
+        :param retry_interval: Seconds to wait before retrying a failed
+            refresh. The old keys are used until then.
+        :param max_workers: Size of the worker pool that does the refreshing.
+        :param single_flight: A :py:class:`oidcservice.single_flight.SingleFlight`
+            instance.
+        """
+        RefreshScheduler.__init__(self, max_workers=max_workers)
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.min_interval = min_interval
+        self.retry_interval = retry_interval
+        self.single_flight = single_flight or SingleFlight()
+        # key -> time of last refresh
+        self._last_refresh = {}
+
+    @staticmethod
+    def _key(keyjar, issuer):
+        return id(keyjar), issuer
+
+    def refresh_time(self, keyjar, issuer):
+        """
+        When the keys of an issuer should be refreshed.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        :return: Refresh time as seconds since epoch or 0 if the issuer has
+            no remote key bundles.
+        """
+        _bundles = _remote_bundles(keyjar, issuer)
+        if not _bundles:
+            return 0
+
+        _jitter = random.uniform(0, self.jitter) if self.jitter else 0
+        return min(kb.time_out for kb in _bundles) - self.lead_time - _jitter
+
+    def track(self, keyjar, issuer, when=0):
+        """
+        Start keeping the keys of an issuer fresh.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        :param when: When to refresh. Default is decided by when the
+            bundles expire.
+        :return: The time the keys will be refreshed or 0 if not tracked.
+        """
+        _when = when or self.refresh_time(keyjar, issuer)
+        if not _when:
+            return 0
+
+        self.schedule(self._key(keyjar, issuer), _when, (keyjar, issuer))
+        return _when
+
+    def untrack(self, keyjar, issuer):
+        """
+        Stop keeping the keys of an issuer fresh.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        """
+        _key = self._key(keyjar, issuer)
+        self.unschedule(_key)
+        with self._cond:
+            self._last_refresh.pop(_key, None)
+
+    def _refresh_bundle(self, bundle, now):
+        _copy = bundle.copy()
+        _copy.httpc = bundle.httpc
+        _copy.last_remote = bundle.last_remote
+        if not _copy.update():
+            # Keep using what we have, the key jar shouldn't try on its own
+            # before the retry.
+            bundle.time_out = now + self.retry_interval + self.lead_time
+            return False
+
+        bundle.set(_copy.keys())
+        for attr in ['time_out', 'last_updated', 'last_remote', 'etag',
+                     'imp_jwks']:
+            setattr(bundle, attr, getattr(_copy, attr))
+        return True
+
+    def _do_refresh(self, keyjar, issuer):
+        LOGGER.debug('Refreshing keys for %s', issuer)
+        _now = time_sans_frac()
+        _key = self._key(keyjar, issuer)
+        with self._cond:
+            self._last_refresh[_key] = _now
+
+        _res = True
+        for _bundle in _remote_bundles(keyjar, issuer):
+            if not self._refresh_bundle(_bundle, _now):
+                LOGGER.warning('Failed to refresh keys from %s',
+                               _bundle.source)
+                _res = False
+
+        if _res:
+            self.track(keyjar, issuer)
+        else:
+            self.track(keyjar, issuer, when=_now + self.retry_interval)
+        return _res
+
+    def refresh(self, keyjar, issuer):
+        """
+        Refresh the remote key bundles of an issuer. Concurrent refreshes of
+        the same keys are coalesced into one.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        :return: True if all bundles were refreshed
+        """
+        return self.single_flight.do(self._key(keyjar, issuer),
+                                     self._do_refresh, keyjar, issuer)
+
+    def refresh_due(self, item):
+        """
+        Refresh keys that are due to be refreshed.
+
+        :param item: A (key jar, issuer ID) tuple
+        :return: True if all bundles were refreshed
+        """
+        keyjar, issuer = item
+        try:
+            return self.refresh(keyjar, issuer)
+        except Exception as err:
+            LOGGER.error('Error while refreshing keys for %s: %s', issuer, err)
+            raise
+
+    def prefetch(self, keyjar, issuer):
+        """
+        Fetch the keys of an issuer in the background and from then on keep
+        them fresh. Typically done right after provider info discovery.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        :return: A future
+        """
+        return self._executor_pool().submit(self.refresh_due,
+                                            (keyjar, issuer))
+
+    def unknown_key(self, keyjar, issuer, kid=''):
+        """
+        A signature couldn't be verified because no matching key was found.
+        The issuer may have rotated its keys so refresh them now, unless
+        that was done less than min_interval seconds ago.
+
+        :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+        :param issuer: Issuer ID
+        :param kid: The key ID that wasn't found, if known.
+        :return: True if the keys were refreshed and it's worth trying again.
+        """
+        if not _remote_bundles(keyjar, issuer):
+            return False
+
+        if kid and keyjar.get('sig', issuer_id=issuer, kid=kid):
+            return False
+
+        _key = self._key(keyjar, issuer)
+        with self._cond:
+            _last = self._last_refresh.get(_key, 0)
+        if _last + self.min_interval > time_sans_frac():
+            LOGGER.debug('Keys for %s refreshed recently, not again', issuer)
+            return False
+
+        return self.refresh(keyjar, issuer)
+
+    def run_pending(self, now=0):
+        """
+        Hand all refreshes that are due over to the worker pool.
+
+        :param now: Current time, seconds since epoch
+        :return: Dictionary with issuer IDs as keys and futures as values
+        """
+        return {_key[1]: _future for _key, _future
+                in RefreshScheduler.run_pending(self, now).items()}
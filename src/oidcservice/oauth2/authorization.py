@@ -35,9 +35,15 @@ class Authorization(Service):
         self.store_item(resp, 'auth_response', key)
 
     def store_auth_request(self, request_args=None, **kwargs):
-        """Store the authorization request in the state DB."""
+        """
+        Store the authorization request in the state DB, together with the
+        PKCE information if there is any.
+        """
         _key = get_state_parameter(request_args, kwargs)
-        self.store_item(request_args, 'auth_request', _key)
+        _items = {'auth_request': request_args}
+        if 'pkce' in kwargs:
+            _items['pkce'] = kwargs['pkce']
+        self.store_items(_items, _key)
         return request_args
 
     def gather_request_args(self, **kwargs):
@@ -0,0 +1,175 @@
+"""
+Client credentials access tokens cached in a store that can be shared by
+several processes.
+"""
+import logging
+import os
+import tempfile
+
+from filelock import FileLock
+from oidcmsg.oauth2 import is_error_message
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.exception import TokenError
+from oidcservice.oauth2.client_credentials.cc_token_store import (
+    CCTokenStore, normalize_resource, normalize_scope)
+from oidcservice.single_flight import SingleFlight
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CCTokenManager:
+    """
+    Caches client credentials access tokens per (issuer, client_id, scope set,
+    resource) in a :py:class:`oidcservice.oauth2.client_credentials.cc_token_store.CCTokenStore`.
+    A cached token issued for a superset of the wanted scopes is used if there
+    is one.
+    The cache can be any storage with a dictionary like interface, like the
+    state database or another box configured with a shared backend.
+
+    Processes sharing a lock directory coordinate so that only one of them at
+    the time fetches a new token, the others will pick up that token from the
+    cache. By default all processes on a host share one lock directory.
+
+    Tokens are only kept in the cache, the service's 'cc' state isn't
+    written to.
+
+    A token response without expires_in, which is optional, says nothing
+    about how long the token can be used. Such a token is given
+    default_lifetime, if set, otherwise it isn't cached and the next call
+    fetches a new token.
+    """
+
+    def __init__(self, service, storage=None, lock_dir=None, httpc=None,
+                 min_validity=60, lock_timeout=30, single_flight=None,
+                 default_lifetime=0):
+        """
+        :param service: The client credentials access token service
+        :param storage: Where the tokens are cached. Default is the state
+            database of the service.
+        :param lock_dir: Directory where lock files are placed. Default is
+            'oidcservice-cc-locks' in the system's temporary directory.
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. Default is the service context's
+            :py:class:`oidcservice.http_transport.HTTPTransport`.
+        :param min_validity: A cached token must be valid for at least this
+            many seconds to be used.
+        :param lock_timeout: How long to wait for another process to finish
+            fetching a token.
+        :param single_flight: A :py:class:`oidcservice.single_flight.SingleFlight`
+            instance.
+        :param default_lifetime: Number of seconds a token is assumed to be
+            valid if the token response has no expires_in.
+        """
+        self.service = service
+        if storage is None:
+            storage = service.state_db
+        _context = service.service_context
+        self.store = CCTokenStore(storage, issuer=_context.get('issuer'),
+                                  client_id=_context.get('client_id'))
+        if lock_dir is None:
+            lock_dir = os.path.join(tempfile.gettempdir(),
+                                    'oidcservice-cc-locks')
+        self.lock_dir = lock_dir
+        os.makedirs(lock_dir, exist_ok=True)
+        self.httpc = httpc
+        self.min_validity = min_validity
+        self.lock_timeout = lock_timeout
+        self.single_flight = single_flight or SingleFlight()
+        self.default_lifetime = default_lifetime
+
+    def _lock(self, resource):
+        _key = self.store.index_key(resource)
+        return FileLock(os.path.join(self.lock_dir, '{}.lock'.format(_key)),
+                        timeout=self.lock_timeout)
+
+    def _cached(self, scope, resource):
+        return self.store.find(scope, resource, min_validity=self.min_validity)
+
+    def _fetch(self, scope, resource, **kwargs):
+        # Another thread, or process, may have fetched a token while this one
+        # was waiting.
+        _token = self._cached(scope, resource)
+        if _token:
+            return _token
+
+        _request_args = {'grant_type': 'client_credentials'}
+        if scope:
+            _request_args['scope'] = normalize_scope(scope)
+        if resource:
+            _request_args['resource'] = resource
+
+        LOGGER.debug('Fetching client credentials token for scope: %s', scope)
+        _resp = self._request(_request_args, **kwargs)
+        if is_error_message(_resp):
+            raise TokenError(
+                'Could not get client credentials token: {}'.format(
+                    _resp.to_json()))
+
+        _lifetime = int(_resp.get('expires_in', self.default_lifetime))
+        if not _lifetime:
+            LOGGER.warning('Client credentials token without expires_in, '
+                           'not cached. Set default_lifetime to cache it.')
+            return _resp.to_dict()
+
+        _resp['__expires_at'] = time_sans_frac() + _lifetime
+        _token = _resp.to_dict()
+        self.store.add(_token, scope, resource)
+        return _token
+
+    def _request(self, request_args, **kwargs):
+        # Like the service's do_request but without updating the service
+        # context, which would overwrite the shared 'cc' state.
+        _httpc = self.httpc or self.service.service_context.get_http_transport()
+        _info = self.service.get_request_parameters(request_args=request_args,
+                                                    **kwargs)
+        _resp = _httpc(_info['method'], _info['url'], data=_info.get('body'),
+                       headers=_info.get('headers'))
+        return self.service.parse_request_response(_resp)
+
+    def _locked_fetch(self, scope, resource, **kwargs):
+        # All changes to the tokens for one resource are done while holding
+        # this lock.
+        with self._lock(resource):
+            return self._fetch(scope, resource, **kwargs)
+
+    def get_token(self, scope=None, resource=None, **kwargs):
+        """
+        Get a client credentials token response. A cached one if there is a
+        valid one otherwise a new one is fetched.
+
+        :param scope: The scope of the token
+        :param resource: The resource/audience of the token
+        :param kwargs: Extra keyword arguments passed on to the service
+        :return: A dictionary with the token response
+        """
+        _token = self._cached(scope, resource)
+        if _token:
+            return _token
+
+        _key = (tuple(normalize_scope(scope)),
+                tuple(normalize_resource(resource)))
+        return self.single_flight.do(_key, self._locked_fetch, scope,
+                                     resource, **kwargs)
+
+    def get_access_token(self, scope=None, resource=None, **kwargs):
+        """
+        Get a valid client credentials access token.
+
+        :param scope: The scope of the token
+        :param resource: The resource/audience of the token
+        :param kwargs: Extra keyword arguments passed on to the service
+        :return: An access token
+        """
+        return self.get_token(scope, resource, **kwargs)['access_token']
+
+    def invalidate(self, access_token, resource=None):
+        """
+        Remove a cached token, for instance after the resource server has
+        rejected it.
+
+        :param access_token: The access token
+        :param resource: The resource/audience of the token
+        """
+        with self._lock(resource):
+            self.store.remove(access_token, resource)
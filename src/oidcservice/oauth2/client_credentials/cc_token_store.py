@@ -0,0 +1,153 @@
+"""
+A store for client credentials access tokens, indexed by scope set and
+resource/audience.
+"""
+import hashlib
+import json
+import logging
+
+from oidcmsg.time_util import time_sans_frac
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_FORMAT = 'cc_{}'
+
+
+def normalize_scope(scope):
+    """
+    Normalize a scope specification to a sorted list of unique scope values.
+
+    :param scope: A space separated string or a list of strings
+    :return: A list of scope values
+    """
+    if not scope:
+        return []
+    if isinstance(scope, str):
+        scope = scope.split(' ')
+    return sorted({s for s in scope if s})
+
+
+def normalize_resource(resource):
+    """
+    Normalize a resource/audience specification to a sorted list of unique
+    values.
+
+    :param resource: A string or a list of strings
+    :return: A list of resource identifiers
+    """
+    if not resource:
+        return []
+    if isinstance(resource, str):
+        return [resource]
+    return sorted(set(resource))
+
+
+class CCTokenStore:
+    """
+    Keeps several client credentials tokens for one client at one issuer.
+    Tokens are grouped by resource/audience and within such a group a token
+    issued for a set of scopes can be used for any subset of those scopes.
+
+    The information is kept in a storage with a dictionary like interface,
+    one entry per resource/audience group.
+    """
+
+    def __init__(self, storage, issuer='', client_id=''):
+        """
+        :param storage: Storage instance with a dictionary like interface
+        :param issuer: Issuer ID
+        :param client_id: Client ID
+        """
+        self.storage = storage
+        self.issuer = issuer
+        self.client_id = client_id
+
+    def index_key(self, resource=None):
+        """
+        The key under which the tokens for a resource/audience are stored.
+
+        :param resource: Resource/audience
+        :return: A key
+        """
+        _spec = [self.issuer, self.client_id, normalize_resource(resource)]
+        _hash = hashlib.sha256(json.dumps(_spec).encode('utf-8')).hexdigest()
+        return KEY_FORMAT.format(_hash)
+
+    def entries(self, resource=None):
+        """
+        :param resource: Resource/audience
+        :return: List of dictionaries with the keys 'scope' and 'token'
+        """
+        _val = self.storage.get(self.index_key(resource))
+        if not _val:
+            return []
+        return json.loads(_val)
+
+    def _store(self, resource, entries):
+        self.storage[self.index_key(resource)] = json.dumps(entries)
+
+    def find(self, scope=None, resource=None, min_validity=0, now=0):
+        """
+        Find the best token for a scope. That is the token, valid for at least
+        min_validity seconds, with the smallest scope set that contains all
+        the wanted scopes. If more than one, the one that expires last.
+
+        :param scope: The wanted scope
+        :param resource: Resource/audience
+        :param min_validity: The least number of seconds the token must be
+            valid for.
+        :param now: Current time, seconds since epoch
+        :return: A token response as a dictionary or None
+        """
+        if not now:
+            now = time_sans_frac()
+
+        _wanted = set(normalize_scope(scope))
+        _best = None
+        for _entry in self.entries(resource):
+            _exp = _entry['token'].get('__expires_at', 0)
+            if _exp - min_validity <= now:
+                continue
+            if not _wanted.issubset(_entry['scope']):
+                continue
+
+            _rank = (len(_entry['scope']), -_exp)
+            if _best is None or _rank < _best[0]:
+                _best = (_rank, _entry['token'])
+
+        if _best is None:
+            return None
+        return _best[1]
+
+    def add(self, token, scope=None, resource=None, now=0):
+        """
+        Add a token. A token with the same scope set is replaced and expired
+        tokens are removed.
+
+        :param token: The token response as a dictionary. Must contain
+            '__expires_at'.
+        :param scope: The scope the token was issued for. If the token
+            response contains a scope parameter that is used instead.
+        :param resource: Resource/audience
+        :param now: Current time, seconds since epoch
+        """
+        if not now:
+            now = time_sans_frac()
+
+        _scope = normalize_scope(token.get('scope', scope))
+        _entries = [e for e in self.entries(resource)
+                    if e['scope'] != _scope and
+                    e['token'].get('__expires_at', 0) > now]
+        _entries.append({'scope': _scope, 'token': token})
+        self._store(resource, _entries)
+
+    def remove(self, access_token, resource=None):
+        """
+        Remove a token.
+
+        :param access_token: The access token
+        :param resource: Resource/audience
+        """
+        _entries = [e for e in self.entries(resource)
+                    if e['token'].get('access_token') != access_token]
+        self._store(resource, _entries)
@@ -1,13 +1,17 @@
 """The service that talks to the OAuth2 provider info discovery endpoint."""
 import logging
+import threading
 
+from cryptojwt.key_bundle import KeyBundle
 from cryptojwt.key_jar import KeyJar
 from oidcmsg import oauth2
-from oidcmsg.oauth2 import ResponseMessage
+from oidcmsg.oauth2 import ResponseMessage, is_error_message
+from oidcmsg.time_util import time_sans_frac
 
 from oidcservice import OIDCONF_PATTERN
-from oidcservice.exception import OidcServiceError
-from oidcservice.service import Service
+from oidcservice.exception import OidcServiceError, ResponseError
+from oidcservice.service import Service, ServiceDict
+from oidcservice.util import content_digest
 
 LOGGER = logging.getLogger(__name__)
 
@@ -24,6 +28,11 @@ class ProviderInfoDiscovery(Service):
     def __init__(self, service_context, client_authn_factory=None, conf=None):
         Service.__init__(self, service_context, client_authn_factory=client_authn_factory,
                          conf=conf)
+        # A oidcservice.provider_info_cache.ProviderInfoCache instance,
+        # possibly shared with other service contexts.
+        self.cache = self.conf.get('cache')
+        # Digest of the provider info last applied to the service context
+        self._applied_digest = ''
 
     def get_endpoint(self):
         """
@@ -45,11 +54,111 @@ class ProviderInfoDiscovery(Service):
         """
         The Provider info discovery version of get_request_parameters()
 
+        If there is cached information the request is made conditional.
+
         :param method:
         :param kwargs:
         :return:
         """
-        return {'url': self.get_endpoint(), 'method': method}
+        _info = {'url': self.get_endpoint(), 'method': method}
+        if self.cache is not None:
+            _entry = self.cache.get(_info['url'])
+            if _entry:
+                _headers = _entry.conditional_headers()
+                if _headers:
+                    _info['headers'] = _headers
+        return _info
+
+    def _cached_response(self, entry):
+        return self.response_cls(**entry.content)
+
+    def parse_request_response(self, reqresp, response_body_type='', state='',
+                               **kwargs):
+        """
+        Deal with the response to a provider info request. If there is a
+        cache, a 304 (Not Modified) response is answered from the cache and
+        a successful response is added to it.
+        """
+        if self.cache is None:
+            return Service.parse_request_response(
+                self, reqresp, response_body_type, state=state, **kwargs)
+
+        _key = self.get_endpoint()
+        if reqresp.status_code == 304:
+            _entry = self.cache.revalidated(_key, reqresp.headers)
+            if _entry is None:
+                raise ResponseError(
+                    'Not Modified but no cached provider info for {}'.format(
+                        _key))
+            LOGGER.debug('Provider info for %s not modified', _key)
+            return self._cached_response(_entry)
+
+        _resp = Service.parse_request_response(
+            self, reqresp, response_body_type, state=state, **kwargs)
+        if not is_error_message(_resp):
+            self.cache.store(_key, _resp.to_dict(), reqresp.headers)
+        return _resp
+
+    def revalidate(self, httpc=None):
+        """
+        Revalidate the cached provider info. Only the cache is updated not
+        the service context.
+
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`.
+        :return: The provider info response
+        """
+        if httpc is None:
+            httpc = self.service_context.get_http_transport()
+
+        _info = self.get_request_parameters()
+        reqresp = httpc(_info['method'], _info['url'],
+                        headers=_info.get('headers'))
+        return self.parse_request_response(reqresp)
+
+    def _revalidate_in_background(self, key, httpc):
+        if not self.cache.claim_revalidation(key):
+            return None
+
+        def _revalidate():
+            try:
+                self.revalidate(httpc)
+            except Exception as err:
+                LOGGER.warning('Could not revalidate provider info for %s: %s',
+                               key, err)
+            finally:
+                self.cache.release_revalidation(key)
+
+        _thread = threading.Thread(target=_revalidate, daemon=True)
+        _thread.start()
+        return _thread
+
+    def do_request(self, httpc=None, request_args=None, response_body_type='',
+                   **kwargs):
+        """
+        Get the provider info. If there is a cache, fresh cached information
+        is used without contacting the issuer. Stale information that is
+        still within the stale-while-revalidate window is used while it's
+        being revalidated in the background.
+        """
+        if self.cache is not None:
+            _key = self.get_endpoint()
+            _entry = self.cache.get(_key)
+            if _entry:
+                _now = time_sans_frac()
+                if not _entry.is_fresh(_now):
+                    if _entry.is_usable(_now):
+                        self._revalidate_in_background(_key, httpc)
+                    else:
+                        _entry = None
+            if _entry:
+                _resp = self._cached_response(_entry)
+                self.update_service_context(_resp)
+                return _resp
+
+        return Service.do_request(self, httpc, request_args=request_args,
+                                  response_body_type=response_body_type,
+                                  **kwargs)
 
     def _verify_issuer(self, resp, issuer):
         _pcr_issuer = resp["issuer"]
@@ -75,16 +184,6 @@ class ProviderInfoDiscovery(Service):
                         _issuer, _pcr_issuer))
         return _issuer
 
-    @staticmethod
-    def _store_endpoint(srvs, key, val):
-        for _srv in srvs.values():
-            # Every service has an endpoint_name assigned
-            # when initiated. This name *MUST* match the
-            # endpoint names used in the provider info
-            if _srv.endpoint_name == key:
-                _srv.endpoint = val
-                break
-
     def _set_endpoints(self, resp):
         """
         If there are services defined set the service endpoint to be
@@ -95,12 +194,9 @@ class ProviderInfoDiscovery(Service):
             pass
         else:
             if _srvs:
-                for key, val in resp.items():
-                    # All service endpoint parameters in the provider info has
-                    # a name ending in '_endpoint' so I can look specifically
-                    # for those
-                    if key.endswith("_endpoint"):
-                        self._store_endpoint(_srvs, key, val)
+                if not isinstance(_srvs, ServiceDict):
+                    _srvs = ServiceDict(_srvs)
+                _srvs.set_endpoints(resp)
 
     def _update_service_context(self, resp):
         """
@@ -131,14 +227,37 @@ class ProviderInfoDiscovery(Service):
         except KeyError:
             _keyjar = KeyJar()
 
+        _scheduler = getattr(self.service_context, 'key_scheduler', None)
+
         # Load the keys. Note that this only means that the key specification
         # is loaded not necessarily that any keys are fetched.
-        if 'jwks_uri' in resp:
+        if 'jwks_uri' in resp and _scheduler is not None:
+            # Leave the fetching of the keys to the scheduler
+            if not _keyjar.find(resp['jwks_uri'], _pcr_issuer):
+                _keyjar.add_kb(_pcr_issuer, KeyBundle(
+                    source=resp['jwks_uri'], httpc=_keyjar.httpc,
+                    httpc_params=_keyjar.httpc_params))
+            _scheduler.prefetch(_keyjar, _pcr_issuer)
+        elif 'jwks_uri' in resp:
             _keyjar.load_keys(_pcr_issuer, jwks_uri=resp['jwks_uri'])
         elif 'jwks' in resp:
             _keyjar.load_keys(_pcr_issuer, jwks=resp['jwks'])
 
         self.service_context.keyjar = _keyjar
 
+    def _is_applied(self, digest):
+        """
+        Whether provider info with this digest is what was last applied to
+        the service context.
+        """
+        return (digest == self._applied_digest and
+                bool(self.service_context.get('provider_info')))
+
     def update_service_context(self, resp, **kwargs):
-        return self._update_service_context(resp)
+        _digest = content_digest(resp)
+        if self._is_applied(_digest):
+            LOGGER.debug('Provider info unchanged')
+            return
+
+        self._update_service_context(resp)
+        self._applied_digest = _digest
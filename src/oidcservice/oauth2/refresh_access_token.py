@@ -31,6 +31,10 @@ class RefreshAccessToken(Service):
         if 'expires_in' in resp:
             resp['__expires_at'] = time_sans_frac() + int(resp['expires_in'])
         self.store_item(resp, 'token_response', key)
+        # Userinfo fetched with the old access token may be out of date
+        _cache = getattr(self.service_context, 'user_info_cache', None)
+        if _cache is not None:
+            _cache.remove(key)
 
     def oauth_pre_construct(self, request_args=None, **kwargs):
         """Preconstructor of request arguments"""
@@ -1,4 +1,6 @@
 import logging
+import threading
+from collections import deque
 
 from cryptojwt.utils import b64e
 from oidcmsg.message import Message
@@ -10,12 +12,109 @@ from oidcservice.oauth2.utils import get_state_parameter
 logger = logging.getLogger(__name__)
 
 
+def make_code_challenge(length=64, method='S256'):
+    """
+    Construct a code verifier and the corresponding code challenge.
+
+    :param length: Length of the code verifier
+    :param method: Code challenge method
+    :return: Tuple of code verifier, code challenge and method
+    """
+    # code_verifier: string of length cv_len
+    code_verifier = unreserved(length)
+    _cv = code_verifier.encode()
+
+    try:
+        # Pick hash method
+        _hash_method = CC_METHOD[method]
+    except KeyError:
+        raise Unsupported(
+            'PKCE Transformation method:{}'.format(method))
+
+    # Use it on the code_verifier and base64 encode the hash value
+    code_challenge = b64e(_hash_method(_cv).digest()).decode('ascii')
+    return code_verifier, code_challenge, method
+
+
+class PKCEPool:
+    """
+    A pool of precomputed code verifiers and challenges that is refilled in
+    the background when it runs low.
+    """
+
+    def __init__(self, length=64, method='S256', size=64, low_water=0):
+        """
+        :param length: Length of the code verifiers
+        :param method: Code challenge method
+        :param size: How many to keep in the pool
+        :param low_water: When there are fewer than this many left the pool
+            is refilled. Default is a quarter of the size.
+        """
+        if method not in CC_METHOD:
+            raise Unsupported('PKCE Transformation method:{}'.format(method))
+
+        self.length = length
+        self.method = method
+        self.size = size
+        self.low_water = low_water or size // 4
+        self._pool = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self.refill_in_background()
+
+    def __len__(self):
+        return len(self._pool)
+
+    def fill(self):
+        """Fill the pool up to its size"""
+        while len(self._pool) < self.size:
+            self._pool.append(make_code_challenge(self.length, self.method))
+
+    def _refill(self):
+        try:
+            self.fill()
+        except Exception as err:
+            logger.error('Could not refill PKCE pool: %s', err)
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def refill_in_background(self):
+        """Fill the pool in a separate thread unless that is already done"""
+        with self._lock:
+            if self._refilling:
+                return
+            self._refilling = True
+        threading.Thread(target=self._refill, daemon=True).start()
+
+    def get(self):
+        """
+        :return: Tuple of code verifier, code challenge and method. If the
+            pool is empty one is constructed on the spot.
+        """
+        try:
+            _item = self._pool.popleft()
+        except IndexError:
+            _item = None
+
+        if len(self._pool) < self.low_water:
+            self.refill_in_background()
+
+        if _item is None:
+            return make_code_challenge(self.length, self.method)
+        return _item
+
+
 def add_code_challenge(request_args, service, **kwargs):
     """
     PKCE RFC 7636 support
     To be added as a post_construct method to an
     :py:class:`oidcservice.oidc.service.Authorization` instance
 
+    If run as a pre_construct method the code verifier is handed over to
+    the post_construct methods that stores it together with the
+    authorization request.
+
     :param service: The service that uses this function
     :param request_args: Set of request arguments
     :param kwargs: Extra set of keyword arguments
@@ -24,32 +123,18 @@ def add_code_challenge(request_args, service, **kwargs):
     _kwargs = service.service_context.add_on["pkce"]
 
     try:
-        cv_len = _kwargs['code_challenge_length']
+        code_verifier, code_challenge, _method = _kwargs['pool'].get()
     except KeyError:
-        cv_len = 64  # Use default
-
-    # code_verifier: string of length cv_len
-    code_verifier = unreserved(cv_len)
-    _cv = code_verifier.encode()
-
-    try:
-        _method = _kwargs['code_challenge_method']
-    except KeyError:
-        _method = 'S256'
-
-    try:
-        # Pick hash method
-        _hash_method = CC_METHOD[_method]
-        # Use it on the code_verifier
-        _hv = _hash_method(_cv).digest()
-        # base64 encode the hash value
-        code_challenge = b64e(_hv).decode('ascii')
-    except KeyError:
-        raise Unsupported(
-            'PKCE Transformation method:{}'.format(_method))
+        code_verifier, code_challenge, _method = make_code_challenge(
+            _kwargs.get('code_challenge_length', 64),
+            _kwargs.get('code_challenge_method', 'S256'))
 
     _item = Message(code_verifier=code_verifier, code_challenge_method=_method)
-    service.store_item(_item, 'pkce', request_args['state'])
+    _post_args = kwargs.get('post_args')
+    if _post_args is None:
+        service.store_item(_item, 'pkce', request_args['state'])
+    else:
+        _post_args['pkce'] = _item
 
     request_args.update(
         {
@@ -82,7 +167,8 @@ def put_state_in_post_args(request_args, **kwargs):
     return request_args, {'state': state}
 
 
-def add_pkce_support(service, code_challenge_length, code_challenge_method):
+def add_pkce_support(service, code_challenge_length, code_challenge_method,
+                     pool_size=0):
     """
     PKCE support can only be considered if this client can access authorization and
     access token services.
@@ -90,6 +176,8 @@ def add_pkce_support(service, code_challenge_length, code_challenge_method):
     :param service: Dictionary of services
     :param code_challenge_length:
     :param code_challenge_method:
+    :param pool_size: If not 0 code verifiers and challenges are
+        precomputed and kept in a pool of this size.
     :return:
     """
     if "authorization" in service and "accesstoken" in service:
@@ -98,6 +186,9 @@ def add_pkce_support(service, code_challenge_length, code_challenge_method):
             "code_challenge_length": code_challenge_length,
             "code_challenge_method": code_challenge_method
         }
+        if pool_size:
+            _service.service_context.add_on['pkce']['pool'] = PKCEPool(
+                code_challenge_length, code_challenge_method, size=pool_size)
 
         _service.pre_construct.append(add_code_challenge)
 
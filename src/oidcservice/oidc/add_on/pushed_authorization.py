@@ -1,73 +1,246 @@
 import logging
+import threading
+from functools import partial
 
 from cryptojwt import JWT
-from oidcmsg.message import Message
-from oidcmsg.oauth2 import JWTSecuredAuthorizationRequest
+from oidcmsg.message import (SINGLE_REQUIRED_INT, SINGLE_REQUIRED_STRING,
+                             Message)
+from oidcmsg.oauth2 import (JWTSecuredAuthorizationRequest, ResponseMessage,
+                            is_error_message)
+from oidcmsg.time_util import time_sans_frac
 
-import requests
+from oidcservice.async_service import AsyncService, ThreadedTransport
+from oidcservice.exception import OidcServiceError
+from oidcservice.service import Service
+from oidcservice.util import content_digest
 
 logger = logging.getLogger(__name__)
 
 
-def push_authorization(request_args, service, **kwargs):
-    """
-    :param request_args: All the request arguments as a AuthorizationRequest instance
-    :param service: The service to which this post construct method is applied.
-    :param kwargs: Extra keyword arguments.
-    """
-
-    method_args = service.service_context.add_on["pushed_authorization"]
+class PushedAuthorizationResponse(Message):
+    """Response from a pushed authorization request endpoint, RFC 9126"""
+    c_param = {
+        'request_uri': SINGLE_REQUIRED_STRING,
+        'expires_in': SINGLE_REQUIRED_INT
+    }
 
-    # construct the message body
-    if method_args["body_format"] == "urlencoded":
-        _body = request_args.to_urlencoded()
-    else:
-        _jwt = JWT(key_jar=service.service_context.keyjar,
-                   iss=service.service_context.base_url)
-        _jws = _jwt.pack(request_args.to_dict())
 
-        _msg = Message(request=_jws)
-        if method_args["merge_rule"] == "lax":
+class PushedAuthorization(Service):
+    """
+    Pushes authorization requests to the OP's pushed authorization request
+    endpoint, RFC 9126, and returns the authorization requests that should
+    be sent to the authorization endpoint instead.
+
+    A request_uri is meant to be used once, RFC 9126 section 4. Reusing it
+    for identical authorization requests until it expires is opt-in, by
+    setting 'reuse_request_uri' in the configuration, and only works with
+    OPs that allow it.
+    """
+    msg_type = Message
+    response_cls = PushedAuthorizationResponse
+    error_msg = ResponseMessage
+    endpoint_name = 'pushed_authorization_request_endpoint'
+    synchronous = True
+    service_name = 'pushed_authorization'
+    http_method = 'POST'
+    request_body_type = 'urlencoded'
+    response_body_type = 'json'
+
+    def __init__(self, service_context, client_authn_factory=None, conf=None,
+                 **kwargs):
+        Service.__init__(self, service_context,
+                         client_authn_factory=client_authn_factory, conf=conf,
+                         **kwargs)
+        self.body_format = self.conf.get('body_format', 'jws')
+        self.signing_algorithm = self.conf.get('signing_algorithm', 'RS256')
+        self.merge_rule = self.conf.get('merge_rule', 'strict')
+        self.timeout = self.conf.get('timeout', 10)
+        self.reuse_request_uri = self.conf.get('reuse_request_uri', False)
+        # Seconds before expiry a request_uri is no longer reused
+        self.expiry_margin = self.conf.get('expiry_margin', 10)
+        self.http_client = self.conf.get('http_client')
+        # digest of authorization request -> (expires at, request_uri)
+        self._request_uris = {}
+        self._lock = threading.Lock()
+
+    def httpc(self):
+        """
+        :return: A callable with the same signature as
+            :py:func:`requests.request`
+        """
+        if self.http_client is not None:
+            return getattr(self.http_client, 'request', self.http_client)
+
+        return partial(self.service_context.get_http_transport(),
+                       timeout=self.timeout)
+
+    def construct(self, request_args=None, **kwargs):
+        """
+        Construct the body of the pushed authorization request.
+
+        :param request_args: The authorization request
+        :return: A :py:class:`oidcmsg.message.Message` instance
+        """
+        if self.body_format == "urlencoded":
+            return Message(**request_args.to_dict())
+
+        _jwt = JWT(key_jar=self.service_context.keyjar,
+                   iss=self.service_context.base_url,
+                   sign_alg=self.signing_algorithm)
+        _msg = Message(request=_jwt.pack(request_args.to_dict()))
+        if self.merge_rule == "lax":
             for param in request_args.required_parameters():
                 _msg[param] = request_args.get(param)
+        return _msg
 
-        _body = _msg.to_urlencoded()
-
-    # Send it to the Pushed Authorization Request Endpoint
-    resp = method_args["http_client"].get(
-        service.service_context.get('provider_info')["pushed_authorization_request_endpoint"],
-        data=_body
-    )
-
-    if resp.status_code == 200:
-        _resp = Message().from_json(resp.text)
-        _req = JWTSecuredAuthorizationRequest(request_uri=_resp["request_uri"])
-        if method_args["merge_rule"] == "lax":
+    def _authorization_request(self, request_args, request_uri):
+        _req = JWTSecuredAuthorizationRequest(request_uri=request_uri)
+        if self.merge_rule == "lax":
             for param in request_args.required_parameters():
                 _req[param] = request_args.get(param)
-        request_args = _req
+        return _req
+
+    def _cached_request_uri(self, key, now):
+        with self._lock:
+            try:
+                _expires_at, _request_uri = self._request_uris[key]
+            except KeyError:
+                return None
+            if _expires_at - self.expiry_margin <= now:
+                del self._request_uris[key]
+                return None
+            return _request_uri
+
+    def _cache_request_uri(self, key, response, now):
+        with self._lock:
+            for _key in [k for k, (e, _) in self._request_uris.items() if
+                         e - self.expiry_margin <= now]:
+                del self._request_uris[_key]
+            self._request_uris[key] = (now + response['expires_in'],
+                                       response['request_uri'])
+
+    def _reused(self, request_args, now):
+        # Returns the key to cache a new request_uri under and the
+        # authorization request if a request_uri could be reused.
+        if not self.reuse_request_uri:
+            return '', None
+
+        _key = content_digest(request_args.to_dict())
+        _request_uri = self._cached_request_uri(_key, now)
+        if _request_uri:
+            logger.debug('Reusing request_uri %s', _request_uri)
+            return _key, self._authorization_request(request_args, _request_uri)
+        return _key, None
+
+    def _pushed(self, request_args, response, key, now):
+        if is_error_message(response):
+            raise OidcServiceError(
+                'Pushed authorization request failed: {}'.format(
+                    response.to_json()))
+
+        if key:
+            self._cache_request_uri(key, response, now)
+        return self._authorization_request(request_args,
+                                           response['request_uri'])
+
+    def push(self, request_args, httpc=None):
+        """
+        Push an authorization request.
+
+        :param request_args: The authorization request as a
+            :py:class:`oidcmsg.oauth2.AuthorizationRequest` instance
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. Default is the service context's
+            :py:class:`oidcservice.http_transport.HTTPTransport`.
+        :return: The request to send to the authorization endpoint
+        """
+        _now = time_sans_frac()
+        _key, _req = self._reused(request_args, _now)
+        if _req is not None:
+            return _req
+
+        _resp = self.do_request(httpc or self.httpc(),
+                                request_args=request_args)
+        return self._pushed(request_args, _resp, _key, _now)
+
+    async def async_push(self, request_args, transport=None):
+        """
+        The same as :py:meth:`push` but the request is sent using an
+        :py:class:`oidcservice.async_service.AsyncTransport`.
+
+        :param request_args: The authorization request as a
+            :py:class:`oidcmsg.oauth2.AuthorizationRequest` instance
+        :param transport: A :py:class:`oidcservice.async_service.AsyncTransport`
+            instance. Default is to use :py:meth:`httpc` from worker threads.
+        :return: The request to send to the authorization endpoint
+        """
+        _now = time_sans_frac()
+        _key, _req = self._reused(request_args, _now)
+        if _req is not None:
+            return _req
+
+        if transport is None:
+            transport = ThreadedTransport(self.httpc())
+        _resp = await AsyncService(self, transport).do_request(
+            request_args=request_args)
+        return self._pushed(request_args, _resp, _key, _now)
 
-    return request_args
 
+def push_authorization(request_args, service, **kwargs):
+    """
+    :param request_args: All the request arguments as a AuthorizationRequest instance
+    :param service: The service to which this post construct method is applied.
+    :param kwargs: Extra keyword arguments.
+    """
+    _par = service.service_context.add_on["pushed_authorization"]["service"]
+    return _par.push(request_args)
 
-def add_pushed_authorization_support(services, body_format="jws", signing_algorthm="RS256",
-                                     http_client=None, merge_rule="strict"):
+
+def add_pushed_authorization_support(services, body_format="jws", signing_algorithm="RS256",
+                                     http_client=None, merge_rule="strict", timeout=10,
+                                     reuse_request_uri=False, post_construct=True,
+                                     signing_algorthm=None):
     """
     Add the necessary pieces to make pushed authorization happen.
 
     :param services: A dictionary with all the services the client has access to.
     :param body_format: jws or urlencoded
+    :param signing_algorithm: Algorithm used to sign the request when
+        body_format is jws
+    :param http_client: A HTTP client, something with the same signature as
+        :py:func:`requests.request` or with such a method named request.
+        Default is the service context's HTTP transport.
+    :param timeout: Request timeout in seconds
+    :param reuse_request_uri: Reuse a request_uri for identical requests
+        until it expires. Off by default since a request_uri is meant to be
+        used once.
+    :param post_construct: Whether the authorization request should be
+        pushed as part of constructing it. If not it's up to the caller to
+        use the 'pushed_authorization' service.
+    :param signing_algorthm: The old, misspelled, name of signing_algorithm.
+        Still accepted.
     """
-
-    if http_client is None:
-        http_client = requests
+    if signing_algorthm:
+        signing_algorithm = signing_algorthm
 
     _service = services["authorization"]
+    _par = PushedAuthorization(_service.service_context, conf={
+        "body_format": body_format,
+        "signing_algorithm": signing_algorithm,
+        "http_client": http_client,
+        "merge_rule": merge_rule,
+        "timeout": timeout,
+        "reuse_request_uri": reuse_request_uri
+    })
+    services['pushed_authorization'] = _par
+
     _service.service_context.add_on['pushed_authorization'] = {
         "body_format": body_format,
-        "signing_algorithm": signing_algorthm,
+        "signing_algorithm": signing_algorithm,
         "http_client": http_client,
-        "merge_rule": merge_rule
+        "merge_rule": merge_rule,
+        "service": _par
     }
 
-    _service.post_construct.append(push_authorization)
+    if post_construct:
+        _service.post_construct.append(push_authorization)
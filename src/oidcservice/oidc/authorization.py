@@ -1,5 +1,8 @@
+import asyncio
 import logging
+from concurrent.futures import ProcessPoolExecutor
 
+from cryptojwt.jwt import JWT
 from oidcmsg import oidc
 from oidcmsg.oidc import make_openid_request, verified_claim_name
 from oidcmsg.time_util import time_sans_frac, utc_time_sans_frac
@@ -9,14 +12,27 @@ from oidcservice.exception import ParameterError
 from oidcservice.oauth2 import authorization
 from oidcservice.oauth2.utils import pick_redirect_uris
 from oidcservice.oidc import IDT2REG
-from oidcservice.oidc.utils import (construct_request_uri,
-                                    request_object_encryption)
+from oidcservice.oidc.utils import (construct_request_uri, make_request_object,
+                                    request_object_encryption,
+                                    request_object_encryption_args)
 
 __author__ = 'Roland Hedberg'
 
 LOGGER = logging.getLogger(__name__)
 
 
+class PendingRequestObjects:
+    """
+    Request objects the executor is working on and the state items that
+    should be stored once they are done.
+    """
+
+    def __init__(self):
+        # (future, request method, keyword arguments)
+        self.futures = []
+        self.items = {}
+
+
 class Authorization(authorization.Authorization):
     msg_type = oidc.AuthorizationRequest
     response_cls = oidc.AuthorizationResponse
@@ -28,6 +44,13 @@ class Authorization(authorization.Authorization):
         self.pre_construct = [self.set_state, pick_redirect_uris,
                               self.oidc_pre_construct]
         self.post_construct = [self.oidc_post_construct]
+        # Thread or process pool that signs and encrypts request objects
+        self.executor = self.conf.get('request_object_executor')
+        # Where request objects passed by reference are kept. If None they
+        # are written to files.
+        self.request_object_store = self.conf.get('request_object_store')
+        # (id(key), private) -> (key, serialized key)
+        self._serialized_keys = {}
 
     def set_state(self, request_args, **kwargs):
         try:
@@ -87,7 +110,8 @@ class Authorization(authorization.Authorization):
         if post_args is None:
             post_args = {}
 
-        for attr in ["request_object_signing_alg", "algorithm", 'sig_kid']:
+        for attr in ["request_object_signing_alg", "algorithm", 'sig_kid',
+                     'pending']:
             try:
                 post_args[attr] = kwargs[attr]
             except KeyError:
@@ -121,13 +145,36 @@ class Authorization(authorization.Authorization):
                 alg = "RS256"
         return alg
 
+    def store_request(self, req, **kwargs):
+        """
+        Stores the request parameter in the request object store.
+        If request_uris are registered the first one is used as is, since
+        the OP may only accept registered URIs. All requests then share that
+        request_uri. Without registered request_uris the store makes one
+        that is unique for each request.
+
+        :param req: The request
+        :param kwargs: Extra keyword arguments
+        :return: The URL the OP should use to fetch the request
+        """
+        try:
+            _webname = self.service_context.get('registration_response')['request_uris'][0]
+        except (KeyError, TypeError):
+            return self.request_object_store.add(req)
+        return self.request_object_store.add(req, _webname)
+
     def store_request_on_file(self, req, **kwargs):
         """
-        Stores the request parameter in a file.
+        Stores the request parameter in a file, or in the request object
+        store if there is one.
+
         :param req: The request
         :param kwargs: Extra keyword arguments
         :return: The URL the OP should use to access the file
         """
+        if self.request_object_store is not None:
+            return self.store_request(req, **kwargs)
+
         try:
             _webname = self.service_context.get('registration_response')['request_uris'][0]
             filename = self.service_context.filename_from_webname(_webname)
@@ -139,9 +186,83 @@ class Authorization(authorization.Authorization):
         fid.close()
         return _webname
 
+    def _serialize(self, key, private=False):
+        # Keys are serialized once. Holding on to the key makes sure its id
+        # isn't reused.
+        _cache = self._serialized_keys
+        try:
+            return _cache[(id(key), private)][1]
+        except KeyError:
+            pass
+        if len(_cache) >= 32:
+            _cache.clear()
+        _jwk = key.serialize(private=private)
+        _cache[(id(key), private)] = (key, _jwk)
+        return _jwk
+
+    def _signing_jwks(self, keyjar, issuer, alg):
+        # Only the key JWT.pack would have used
+        _key = JWT(key_jar=keyjar, iss=issuer, sign_alg=alg).pack_key(issuer)
+        return {'keys': [self._serialize(_key, private=True)]}
+
+    def make_request_object(self, req, **kwargs):
+        """Sign and possibly encrypt a request object"""
+        _req = make_openid_request(req, **kwargs)
+        # Should the request be encrypted
+        return request_object_encryption(_req, self.service_context, **kwargs)
+
+    def submit_request_object(self, req, **kwargs):
+        """
+        Hand the signing and encryption of a request object over to the
+        executor. A process pool gets the keys as JWKSs since key objects
+        can't be pickled.
+
+        :return: A future
+        """
+        if not isinstance(self.executor, ProcessPoolExecutor):
+            return self.executor.submit(self.make_request_object,
+                                        oidc.Message(**req.to_dict()),
+                                        **kwargs)
+
+        _alg = kwargs['request_object_signing_alg']
+        _jwks = None
+        if _alg and _alg != 'none':
+            _jwks = self._signing_jwks(kwargs['keys'], kwargs['issuer'], _alg)
+
+        _encryption = request_object_encryption_args(self.service_context,
+                                                     **kwargs)
+        if _encryption:
+            # JWE uses the first of the receiver's keys
+            _encryption['jwks'] = {
+                'keys': [self._serialize(k) for k in
+                         _encryption.pop('keys')[:1]]}
+
+        return self.executor.submit(
+            make_request_object, req.to_dict(), kwargs['issuer'],
+            kwargs['recv'], _alg, jwks=_jwks,
+            with_jti=kwargs.get('with_jti', False),
+            lifetime=kwargs.get('lifetime', 0), encryption=_encryption)
+
+    def set_request_parameter(self, req, request_method, request_object,
+                              **kwargs):
+        """Add the request object to the request, by value or by reference"""
+        if request_method == "request":
+            req["request"] = request_object
+        else:  # MUST be request_uri
+            req["request_uri"] = self.store_request_on_file(request_object,
+                                                            **kwargs)
+
     def construct_request_parameter(self, req, request_method, audience=None, expires_in=0,
-                                    **kwargs):
-        """Construct a request parameter"""
+                                    pending=None, **kwargs):
+        """
+        Construct a request parameter.
+
+        If there is an executor the request object is signed and encrypted
+        by that. If pending is a :py:class:`PendingRequestObjects` instance
+        the future, request method and keyword arguments are added to it and
+        it's up to the caller to wait for the result and call
+        :py:meth:`set_request_parameter`.
+        """
         alg = self.get_request_object_signing_alg(**kwargs)
         kwargs["request_object_signing_alg"] = alg
 
@@ -165,16 +286,16 @@ class Authorization(authorization.Authorization):
         if expires_in:
             req['exp'] = utc_time_sans_frac() + int(expires_in)
 
-        _req = make_openid_request(req, **kwargs)
+        if self.executor is None:
+            _req = self.make_request_object(req, **kwargs)
+        else:
+            _future = self.submit_request_object(req, **kwargs)
+            if pending is not None:
+                pending.futures.append((_future, request_method, kwargs))
+                return
+            _req = _future.result()
 
-        # Should the request be encrypted
-        _req = request_object_encryption(_req, self.service_context,
-                                         **kwargs)
-
-        if request_method == "request":
-            req["request"] = _req
-        else:  # MUST be request_uri
-            req["request_uri"] = self.store_request_on_file(_req, **kwargs)
+        self.set_request_parameter(req, request_method, _req, **kwargs)
 
     def oidc_post_construct(self, req, **kwargs):
         """
@@ -184,6 +305,10 @@ class Authorization(authorization.Authorization):
         :param kwargs: Extra keyword arguments
         :return: A possibly modified request.
         """
+        _items = {}
+        if 'pkce' in kwargs:
+            _items['pkce'] = kwargs.pop('pkce')
+
         if 'openid' in req['scope']:
             _response_type = req['response_type'][0]
             if 'id_token' in _response_type or 'code' in _response_type:
@@ -202,7 +327,35 @@ class Authorization(authorization.Authorization):
 
             self.construct_request_parameter(req, _request_method, **kwargs)
 
-        self.store_item(req, 'auth_request', req['state'])
+        _items['auth_request'] = req
+        _pending = kwargs.get('pending')
+        if _pending is not None and _pending.futures:
+            # Stored when the request object is done
+            _pending.items = _items
+        else:
+            self.store_items(_items, req['state'])
+        return req
+
+    async def async_construct_request(self, request_args=None, **kwargs):
+        """
+        The same as :py:meth:`construct_request` but if there is an
+        executor the event loop isn't blocked while the request object is
+        signed and encrypted.
+
+        :param request_args: Initial request arguments as a dictionary
+        :param kwargs: Extra keyword arguments
+        :return: The request
+        """
+        _pending = PendingRequestObjects()
+        req = self.construct_request(request_args, pending=_pending, **kwargs)
+        if not _pending.futures:
+            return req
+
+        for _future, _request_method, _kwargs in _pending.futures:
+            self.set_request_parameter(req, _request_method,
+                                       await asyncio.wrap_future(_future),
+                                       **_kwargs)
+        self.store_items(_pending.items, req['state'])
         return req
 
     def gather_verify_arguments(self):
@@ -1,10 +1,16 @@
+import copy
+import json
 import logging
+import threading
+from collections import OrderedDict
 
 from oidcmsg import oidc
+from oidcmsg.message import Message
 from oidcmsg.oauth2 import ResponseMessage
 
 from oidcservice.exception import ConfigurationError
 from oidcservice.oauth2 import provider_info_discovery
+from oidcservice.util import content_digest
 
 __author__ = 'Roland Hedberg'
 
@@ -69,6 +75,62 @@ def add_redirect_uris(request_args, service=None, **kwargs):
     return request_args, {}
 
 
+class PreferenceMatchCache:
+    """
+    A bounded cache of the result of matching client preferences against
+    provider info. The key is a digest over the client preferences, the
+    provider info and the behaviour the matching started from. The result is
+    kept as a JSON document so a cached result can't be changed by anyone
+    using it.
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def key(client_preferences, pcr, behaviour):
+        """
+        :return: The cache key or None if the information can't be hashed.
+        """
+        if isinstance(pcr, Message):
+            pcr = pcr.to_dict()
+        try:
+            return content_digest({'client_preferences': client_preferences,
+                                   'provider_info': pcr,
+                                   'behaviour': behaviour})
+        except (TypeError, ValueError):
+            return None
+
+    def get(self, key):
+        """
+        :param key: Cache key
+        :return: A copy of the cached behaviour or None
+        """
+        with self._lock:
+            try:
+                _val = self._cache[key]
+            except KeyError:
+                return None
+            self._cache.move_to_end(key)
+        return json.loads(_val)
+
+    def set(self, key, behaviour):
+        with self._lock:
+            self._cache[key] = json.dumps(behaviour)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
 class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
     msg_type = oidc.Message
     response_cls = oidc.ProviderConfigurationResponse
@@ -78,8 +140,19 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
         provider_info_discovery.ProviderInfoDiscovery.__init__(
             self, service_context, client_authn_factory=client_authn_factory,
             conf=conf)
+        # A PreferenceMatchCache instance. Services, like those of tenants
+        # with the same preferences talking to the same OP, that are given
+        # the same cache share the results.
+        self.match_cache = self.conf.get('match_cache')
+        if self.match_cache is None:
+            self.match_cache = PreferenceMatchCache()
 
     def update_service_context(self, resp, **kwargs):
+        _digest = content_digest(resp)
+        if self._is_applied(_digest):
+            logger.debug('Provider info unchanged')
+            return
+
         self._update_service_context(resp)
         self.match_preferences(resp, self.service_context.get('issuer'))
         if 'pre_load_keys' in self.conf and self.conf['pre_load_keys']:
@@ -87,6 +160,7 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
                 issuer=resp['issuer'])
             logger.info(
                 'Preloaded keys for {}: {}'.format(resp['issuer'], _jwks))
+        self._applied_digest = _digest
 
     def match_preferences(self, pcr=None, issuer=None):
         """
@@ -105,13 +179,39 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
         if not pcr:
             pcr = self.service_context.get('provider_info')
 
+        _prefs = self.service_context.client_preferences
+        _behaviour = self.service_context.get('behaviour')
+
+        _key = self.match_cache.key(_prefs, pcr, _behaviour)
+        _cached = None if _key is None else self.match_cache.get(_key)
+        if _cached is not None:
+            _behaviour = _cached
+        else:
+            _behaviour = self._match_preferences(pcr, _prefs,
+                                                 copy.deepcopy(_behaviour))
+            if _key is not None:
+                self.match_cache.set(_key, _behaviour)
+
+        self.service_context.set('behaviour', _behaviour)
+        logger.debug('service_context behaviour: {}'.format(_behaviour))
+
+    @staticmethod
+    def _match_preferences(pcr, client_preferences, behaviour):
+        """
+        The matching done by :py:meth:`match_preferences`.
+
+        :param pcr: Provider configuration response
+        :param client_preferences: The client preferences
+        :param behaviour: The behaviour to start from, this is modified.
+        :return: The resulting behaviour
+        """
         regreq = oidc.RegistrationRequest
 
-        _behaviour = self.service_context.get('behaviour')
+        _behaviour = behaviour
 
         for _pref, _prov in PREFERENCE2PROVIDER.items():
             try:
-                vals = self.service_context.client_preferences[_pref]
+                vals = client_preferences[_pref]
             except KeyError:
                 continue
 
@@ -156,7 +256,7 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
             if _pref not in _behaviour:
                 raise ConfigurationError("OP couldn't match preference:%s" % _pref, pcr)
 
-        for key, val in self.service_context.client_preferences.items():
+        for key, val in client_preferences.items():
             if key in _behaviour:
                 continue
 
@@ -171,5 +271,4 @@ class ProviderInfoDiscovery(provider_info_discovery.ProviderInfoDiscovery):
             if key not in PREFERENCE2PROVIDER:
                 _behaviour[key] = val
 
-        self.service_context.set('behaviour', _behaviour)
-        logger.debug('service_context behaviour: {}'.format(_behaviour))
+        return _behaviour
@@ -24,6 +24,22 @@ class RegistrationRead(Service):
         except KeyError:
             return ''
 
+    def get_request_parameters(self, request_args=None, method="",
+                               request_body_type="", authn_method='', **kwargs):
+        """
+        As :py:meth:`oidcservice.service.Service.get_request_parameters`.
+        A registration response other than the one in the service context
+        can be read by giving it as the 'registration_response' keyword
+        argument.
+        """
+        if 'registration_response' in kwargs and 'endpoint' not in kwargs:
+            kwargs['endpoint'] = kwargs['registration_response'][
+                'registration_client_uri']
+        return Service.get_request_parameters(
+            self, request_args=request_args, method=method,
+            request_body_type=request_body_type, authn_method=authn_method,
+            **kwargs)
+
     def get_authn_header(self, request, authn_method, **kwargs):
         """
         Construct an authorization specification to be sent in the
@@ -38,9 +54,11 @@ class RegistrationRead(Service):
 
         if authn_method == "client_secret_basic":
             LOGGER.debug("Client authn method: %s", authn_method)
+            try:
+                _response = kwargs['registration_response']
+            except KeyError:
+                _response = self.service_context.get('registration_response')
             headers["Authorization"] = "Bearer {}".format(
-                self.service_context.get('registration_response')[
-                    "registration_access_token"]
-            )
+                _response["registration_access_token"])
 
         return headers
\ No newline at end of file
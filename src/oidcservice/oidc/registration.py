@@ -1,10 +1,12 @@
 import logging
 
 from oidcmsg import oidc
-from oidcmsg.oauth2 import ResponseMessage
+from oidcmsg.oauth2 import ResponseMessage, is_error_message
 
 from oidcservice.oidc.provider_info_discovery import add_redirect_uris
+from oidcservice.oidc.read_registration import RegistrationRead
 from oidcservice.service import Service
+from oidcservice.util import alias_issuer
 
 __author__ = 'Roland Hedberg'
 
@@ -111,6 +113,8 @@ class Registration(Service):
                               add_post_logout_redirect_uris,
                               add_jwks_uri_or_jwks]
         self.post_construct = [self.oidc_post_construct]
+        # A RegistrationStore instance
+        self.store = self.conf.get('store')
 
     def add_client_behaviour_preference(self, request_args=None, **kwargs):
         for prop in self.msg_type.c_param.keys():
@@ -140,6 +144,58 @@ class Registration(Service):
 
         return request_args
 
+    def _still_registered(self, httpc, response):
+        """
+        Ask the OP, using the client configuration endpoint, whether a
+        stored registration is still valid.
+        """
+        if 'registration_client_uri' not in response or \
+                'registration_access_token' not in response:
+            return True
+
+        try:
+            _resp = RegistrationRead(self.service_context).do_request(
+                httpc, registration_response=response)
+        except Exception as err:
+            logger.info('Could not read registration: %s', err)
+            _resp = None
+
+        if _resp is None or is_error_message(_resp):
+            return False
+        if _resp.get('client_id') != response.get('client_id'):
+            return False
+        return set(_resp.get('redirect_uris', [])) == set(
+            self.service_context.get('redirect_uris') or [])
+
+    def do_request(self, httpc=None, request_args=None, response_body_type='',
+                   **kwargs):
+        """
+        If there is a registration store and it holds a registration, made
+        with the same redirect URIs and preferences, whose client secret
+        hasn't expired that registration is used instead of registering
+        again. Unless switched off by setting 'verify_stored' to False in
+        the configuration, the registration is first read back from the
+        OP to make sure it's still valid.
+        """
+        if self.store is not None:
+            _stored = self.store.lookup(self.service_context)
+            if _stored is not None:
+                if not self.conf.get('verify_stored', True) or \
+                        self._still_registered(httpc, _stored):
+                    logger.debug('Reusing stored registration at %s',
+                                 self.service_context.get('issuer'))
+                    _resp = self.response_cls(**_stored)
+                    self.update_service_context(_resp)
+                    return _resp
+
+                logger.info('Stored registration at %s no longer valid',
+                            self.service_context.get('issuer'))
+                self.store.remove(self.service_context)
+
+        return Service.do_request(self, httpc, request_args=request_args,
+                                  response_body_type=response_body_type,
+                                  **kwargs)
+
     def update_service_context(self, resp, key='', **kwargs):
         if "token_endpoint_auth_method" not in resp:
             resp["token_endpoint_auth_method"] = "client_secret_basic"
@@ -149,10 +205,7 @@ class Registration(Service):
         if _client_id:
             self.service_context.set('client_id', _client_id)
             if _client_id not in self.service_context.keyjar:
-                self.service_context.keyjar.import_jwks(
-                    self.service_context.keyjar.export_jwks(True, ''),
-                    issuer_id=_client_id
-                )
+                alias_issuer(self.service_context.keyjar, '', _client_id)
             _client_secret = resp.get('client_secret')
             if _client_secret:
                 self.service_context.set('client_secret', _client_secret)
@@ -169,3 +222,6 @@ class Registration(Service):
                 "registration_access_token"])
         except KeyError:
             pass
+
+        if self.store is not None and _client_id:
+            self.store.save(self.service_context, resp)
@@ -1,14 +1,27 @@
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 
 from oidcmsg import oidc
 from oidcmsg.exception import MissingSigningKey
 from oidcmsg.message import Message
+from oidcmsg.oauth2 import is_error_message
+from oidcmsg.time_util import time_sans_frac
 
+import requests
+from oidcservice.exception import ResponseError
 from oidcservice.oauth2.utils import get_state_parameter
 from oidcservice.service import Service
+from oidcservice.util import get_header
 
 logger = logging.getLogger(__name__)
 
+# Errors that make a claims source unusable but aren't fatal
+CLAIMS_SOURCE_ERRORS = (requests.RequestException, ResponseError,
+                        MissingSigningKey, TimeoutError)
+
 UI2REG = {
     'sigalg': 'userinfo_signed_response_alg',
     'encalg': 'userinfo_encrypted_response_alg',
@@ -27,6 +40,61 @@ def carry_state(request_args=None, **kwargs):
     return request_args, {'state': get_state_parameter(request_args, kwargs)}
 
 
+class ExpiringCache:
+    """
+    A thread safe cache where every entry has its own expiration time.
+    When the cache is full the least recently stored entry is evicted.
+    """
+
+    def __init__(self, max_size=1024):
+        """
+        :param max_size: Max number of entries
+        """
+        self.max_size = max_size
+        # key -> (expires at, value)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, now=0):
+        """
+        :param key: Cache key
+        :param now: Current time, seconds since epoch
+        :return: The value or None if there is no entry or it has expired
+        """
+        with self._lock:
+            try:
+                _expires_at, _value = self._entries[key]
+            except KeyError:
+                return None
+            if _expires_at <= (now or time_sans_frac()):
+                del self._entries[key]
+                return None
+        return _value
+
+    def set(self, key, value, expires_at):
+        """
+        :param key: Cache key
+        :param value: The value
+        :param expires_at: When the entry expires, seconds since epoch
+        """
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class UserInfo(Service):
     msg_type = Message
     response_cls = oidc.OpenIDSchema
@@ -41,6 +109,26 @@ class UserInfo(Service):
         Service.__init__(self, service_context, client_authn_factory=client_authn_factory,
                          conf=conf)
         self.pre_construct = [self.oidc_pre_construct, carry_state]
+        # Used when fetching distributed claims. A callable with the same
+        # signature as requests.request
+        self.httpc = self.conf.get('httpc')
+        self.claims_timeout = self.conf.get('claims_timeout', 10)
+        self.claims_max_age = self.conf.get('claims_max_age', 300)
+        self.claims_max_workers = self.conf.get('claims_max_workers', 8)
+        # (endpoint, access token) -> claims
+        self.claims_cache = ExpiringCache()
+        # digest of an aggregated claims JWT -> verified claims
+        self.jwt_cache = ExpiringCache()
+        self._executor = None
+        self._lock = threading.Lock()
+        # Opt-in. Number of seconds a userinfo response is reused.
+        self.user_info_max_age = self.conf.get('user_info_max_age', 0)
+        # state -> userinfo response. Shared through the service context so
+        # the refresh_token service can invalidate entries.
+        self.user_info_cache = ExpiringCache(
+            self.conf.get('user_info_cache_size', 1024))
+        if self.user_info_max_age:
+            self.service_context.user_info_cache = self.user_info_cache
 
     def oidc_pre_construct(self, request_args=None, **kwargs):
         if request_args is None:
@@ -56,6 +144,43 @@ class UserInfo(Service):
 
         return request_args, {}
 
+    def do_request(self, httpc=None, request_args=None, response_body_type='',
+                   **kwargs):
+        """
+        If conf['user_info_max_age'] is set, a userinfo response is reused
+        for that many seconds. The refresh_token service invalidates the
+        cached response when it gets a new access token for the state.
+        A request with an explicit access token in request_args always goes
+        to the OP.
+        """
+        if not self.user_info_max_age or \
+                'access_token' in (request_args or {}):
+            return Service.do_request(self, httpc, request_args=request_args,
+                                      response_body_type=response_body_type,
+                                      **kwargs)
+
+        _state = kwargs.get('state', '')
+        _cached = self.user_info_cache.get(_state)
+        if _cached is not None:
+            logger.debug('Using cached userinfo for state %s', _state)
+            return _cached
+
+        _resp = Service.do_request(self, httpc, request_args=request_args,
+                                   response_body_type=response_body_type,
+                                   **kwargs)
+        if not is_error_message(_resp):
+            self.user_info_cache.set(
+                _state, _resp, time_sans_frac() + self.user_info_max_age)
+        return _resp
+
+    def invalidate_user_info(self, state):
+        """
+        Make the next userinfo request for a state go to the OP.
+
+        :param state: The state
+        """
+        self.user_info_cache.remove(state)
+
     def post_parse_response(self, response, **kwargs):
         _args = self.multiple_extend_request_args(
             {}, kwargs['state'], ['id_token'],
@@ -70,39 +195,133 @@ class UserInfo(Service):
             if response['sub'] != _sub:
                 raise ValueError('Incorrect "sub" value')
 
-        try:
-            _csrc = response["_claim_sources"]
-        except KeyError:
-            pass
-        else:
-            for csrc, spec in _csrc.items():
-                if "JWT" in spec:
-                    try:
-                        aggregated_claims = Message().from_jwt(
-                            spec["JWT"].encode("utf-8"),
-                            keyjar=self.service_context.keyjar)
-                    except MissingSigningKey as err:
-                        logger.warning(
-                            'Error encountered while unpacking aggregated '
-                            'claims'.format(err))
-                    else:
-                        claims = [value for value, src in
-                                  response["_claim_names"].items() if
-                                  src == csrc]
-
-                        for key in claims:
-                            response[key] = aggregated_claims[key]
-                elif 'endpoint' in spec:
-                    _info = {
-                        "headers": self.get_authn_header(
-                            {}, self.default_authn_method,
-                            authn_endpoint=self.endpoint_name),
-                        "url": spec["endpoint"]
-                    }
+        if "_claim_sources" in response:
+            self.resolve_claim_sources(response, kwargs['state'])
 
         self.store_item(response, 'user_info', kwargs['state'])
         return response
 
+    def _claims_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.claims_max_workers)
+            return self._executor
+
+    def _http_client(self):
+        if self.httpc is None:
+            return self.service_context.get_http_transport()
+        return self.httpc
+
+    def unpack_aggregated_claims(self, jwt):
+        """
+        Verify and unpack the JWT of an aggregated claims source.
+        The result is cached, until the JWT expires but at most
+        conf['claims_max_age'] seconds, so that the signature of a JWT is only
+        verified once.
+
+        :param jwt: A signed JWT
+        :return: The claims as a :py:class:`oidcmsg.message.Message` instance
+        """
+        _key = hashlib.sha256(jwt.encode("utf-8")).hexdigest()
+        _now = time_sans_frac()
+        _claims = self.jwt_cache.get(_key, _now)
+        if _claims is not None:
+            return _claims
+
+        _claims = Message().from_jwt(jwt.encode("utf-8"),
+                                     keyjar=self.service_context.keyjar)
+        _expires_at = _now + self.claims_max_age
+        if 'exp' in _claims:
+            _expires_at = min(_expires_at, int(_claims['exp']))
+        if _expires_at > _now:
+            self.jwt_cache.set(_key, _claims, _expires_at)
+        return _claims
+
+    def fetch_distributed_claims(self, endpoint, access_token):
+        """
+        Fetch claims from a distributed claims source. Claims are cached per
+        endpoint and access token.
+
+        :param endpoint: The claims endpoint
+        :param access_token: The access token to use at the endpoint
+        :return: The claims as a :py:class:`oidcmsg.message.Message` instance
+        """
+        _key = (endpoint, access_token)
+        _claims = self.claims_cache.get(_key)
+        if _claims is not None:
+            return _claims
+
+        _headers = {}
+        if access_token:
+            _headers['Authorization'] = 'Bearer {}'.format(access_token)
+        _resp = self._http_client()('GET', endpoint, headers=_headers,
+                                    timeout=self.claims_timeout)
+        if _resp.status_code != 200:
+            raise ResponseError('Could not fetch claims from {}: {}'.format(
+                endpoint, _resp.status_code))
+
+        if get_header(_resp.headers, 'Content-Type').startswith(
+                'application/jwt'):
+            _claims = self.unpack_aggregated_claims(_resp.text)
+        else:
+            _claims = Message().from_json(_resp.text)
+
+        self.claims_cache.set(_key, _claims,
+                              time_sans_frac() + self.claims_max_age)
+        return _claims
+
+    def resolve_claim_sources(self, response, state=''):
+        """
+        Add the claims from aggregated and distributed claim sources to a
+        response. Distributed claims are fetched and aggregated claims
+        verified concurrently.
+
+        A distributed claims source is only used if it comes with an access
+        token or one is provided by conf['claims_access_token'], a callable
+        that given the endpoint and the state returns an access token
+        obtained out of band. The access token the OP issued is never sent
+        to a claims provider.
+
+        A source that can't be reached or for which there are no keys is
+        skipped, a claims JWT that doesn't verify is an error.
+
+        :param response: The userinfo response
+        :param state: The state
+        :return: The response
+        """
+        _token_callback = self.conf.get('claims_access_token')
+        _pool = self._claims_executor()
+        _futures = {}
+        for csrc, spec in response["_claim_sources"].items():
+            if "JWT" in spec:
+                _futures[csrc] = _pool.submit(self.unpack_aggregated_claims,
+                                              spec["JWT"])
+            elif 'endpoint' in spec:
+                _token = spec.get('access_token')
+                if not _token and _token_callback:
+                    _token = _token_callback(spec['endpoint'], state)
+                if not _token:
+                    logger.warning('No access token for claims source %s',
+                                   csrc)
+                    continue
+                _futures[csrc] = _pool.submit(self.fetch_distributed_claims,
+                                              spec['endpoint'], _token)
+
+        _results = {}
+        for csrc, _future in _futures.items():
+            try:
+                _results[csrc] = _future.result(timeout=self.claims_timeout)
+            except CLAIMS_SOURCE_ERRORS as err:
+                logger.warning('Could not use claims source %s: %s', csrc,
+                               err)
+
+        for csrc, _claims in _results.items():
+            for key, src in response.get("_claim_names", {}).items():
+                if src == csrc and key in _claims:
+                    response[key] = _claims[key]
+        return response
+
     def gather_verify_arguments(self):
         """
         Need to add some information before running verify()
@@ -1,20 +1,29 @@
+import json
 import os
+from functools import lru_cache
 
 from cryptojwt.jwe.jwe import JWE
 from cryptojwt.jwe.utils import alg2keytype
+from cryptojwt.key_bundle import KeyBundle
+from cryptojwt.key_jar import KeyJar
 from oidcmsg.exception import MissingRequiredAttribute
+from oidcmsg.message import Message
+from oidcmsg.oidc import make_openid_request
 
 from oidcservice import rndstr
 
 
-def request_object_encryption(msg, service_context, **kwargs):
+def request_object_encryption_args(service_context, **kwargs):
     """
-    Created an encrypted JSON Web token with *msg* as body.
-
-    :param msg: The mesaqg
-    :param service_context:
-    :param kwargs:
-    :return:
+    Find out how a request object should be encrypted.
+
+    :param service_context: A
+        :py:class:`oidcservice.service_context.ServiceContext` instance
+    :param kwargs: Extra keyword arguments
+    :return: A dictionary with the encryption algorithm (alg), the content
+        encryption algorithm (enc), the key ID (kid) and the receivers
+        encryption keys (keys) or None if the request object should not be
+        encrypted.
     """
     try:
         encalg = kwargs["request_object_encryption_alg"]
@@ -23,10 +32,10 @@ def request_object_encryption(msg, service_context, **kwargs):
             encalg = service_context.get('behaviour')[
                 "request_object_encryption_alg"]
         except KeyError:
-            return msg
+            return None
 
     if not encalg:
-        return msg
+        return None
 
     try:
         encenc = kwargs["request_object_encryption_enc"]
@@ -42,7 +51,6 @@ def request_object_encryption(msg, service_context, **kwargs):
         raise MissingRequiredAttribute(
             "No request_object_encryption_enc specified")
 
-    _jwe = JWE(msg, alg=encalg, enc=encenc)
     _kty = alg2keytype(encalg)
 
     try:
@@ -57,12 +65,86 @@ def request_object_encryption(msg, service_context, **kwargs):
         _keys = service_context.keyjar.get_encrypt_key(_kty,
                                                        issuer_id=kwargs["target"],
                                                        kid=_kid)
-        _jwe["kid"] = _kid
     else:
         _keys = service_context.keyjar.get_encrypt_key(_kty,
                                                        issuer_id=kwargs["target"])
 
-    return _jwe.encrypt(_keys)
+    return {'alg': encalg, 'enc': encenc, 'kid': _kid, 'keys': _keys}
+
+
+def encrypt_request_object(msg, alg, enc, keys, kid=''):
+    """
+    Encrypt a request object.
+
+    :param msg: The request object
+    :param alg: Encryption algorithm
+    :param enc: Content encryption algorithm
+    :param keys: The receivers encryption keys
+    :param kid: Key ID
+    :return: A JWE
+    """
+    _jwe = JWE(msg, alg=alg, enc=enc)
+    if kid:
+        _jwe["kid"] = kid
+    return _jwe.encrypt(keys)
+
+
+def request_object_encryption(msg, service_context, **kwargs):
+    """
+    Created an encrypted JSON Web token with *msg* as body.
+
+    :param msg: The mesaqg
+    :param service_context:
+    :param kwargs:
+    :return:
+    """
+    _args = request_object_encryption_args(service_context, **kwargs)
+    if _args is None:
+        return msg
+    return encrypt_request_object(msg, **_args)
+
+
+@lru_cache(maxsize=16)
+def _load_keyjar(issuer, jwks):
+    _keyjar = KeyJar()
+    _keyjar.import_jwks(json.loads(jwks), issuer)
+    return _keyjar
+
+
+@lru_cache(maxsize=16)
+def _load_keys(jwks):
+    return KeyBundle(keys=json.loads(jwks)['keys']).keys()
+
+
+def make_request_object(request, issuer, recv, alg, jwks=None, with_jti=False,
+                        lifetime=0, encryption=None):
+    """
+    Sign and possibly encrypt a request object. All the arguments can be
+    pickled so this can be run in another process. Keys are parsed once per
+    process.
+
+    :param request: The request as a dictionary
+    :param issuer: Who is signing the request object
+    :param recv: The intended receiver of the request object
+    :param alg: Signing algorithm
+    :param jwks: JWKS with the signing keys, private parts included
+    :param with_jti: Whether a JTI should be included
+    :param lifetime: How long the request object is expected to be valid
+    :param encryption: None or a dictionary with the encryption algorithm
+        (alg), the content encryption algorithm (enc), the key ID (kid) and
+        a JWKS with the receivers encryption keys (jwks).
+    :return: The request object
+    """
+    _keyjar = _load_keyjar(issuer, json.dumps(jwks or {'keys': []},
+                                              sort_keys=True))
+    _req = make_openid_request(Message(**request), _keyjar, issuer, alg, recv,
+                               with_jti=with_jti, lifetime=lifetime)
+    if encryption:
+        _keys = _load_keys(json.dumps(encryption['jwks'], sort_keys=True))
+        _req = encrypt_request_object(_req, encryption['alg'],
+                                      encryption['enc'], _keys,
+                                      kid=encryption.get('kid', ''))
+    return _req
 
 
 def construct_request_uri(local_dir, base_path, **kwargs):
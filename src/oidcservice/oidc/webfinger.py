@@ -1,13 +1,19 @@
 import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from urllib.parse import urlsplit, urlunsplit
 
 from oidcmsg import oidc
 from oidcmsg.exception import MissingRequiredAttribute
 from oidcmsg.oauth2 import Message, ResponseMessage
-from oidcmsg.oidc import JRD
+from oidcmsg.oidc import JRD, Link
+from oidcmsg.time_util import time_sans_frac
 
+from oidcservice.exception import WebFingerError
 from oidcservice.oidc import OIC_ISSUER, WF_URL
 from oidcservice.service import Service
+from oidcservice.single_flight import SingleFlight
 
 __author__ = 'Roland Hedberg'
 
@@ -20,6 +26,177 @@ QUERY = 3
 FRAGMENT = 4
 
 
+def create_url(part, ignore):
+    res = []
+    for a in range(0, 5):
+        if a in ignore:
+            res.append('')
+        else:
+            res.append(part[a])
+    return urlunsplit(tuple(res))
+
+
+@lru_cache(maxsize=1024)
+def normalize_resource(resource):
+    """
+    Given a resource identifier find the domain specifier and normalize the
+    identifier. Implements
+    http://openid.net/specs/openid-connect-discovery-1_0.html#NormalizationSteps
+
+    The result is memoized.
+
+    :param resource: The resource identifier
+    :return: Tuple of normalized resource identifier and authority
+    """
+    if resource[0] in ['=', '@', '!']:  # Have no process for handling these
+        raise ValueError('Not allowed resource identifier')
+
+    try:
+        part = urlsplit(resource)
+    except Exception:
+        raise ValueError('Unparsable resource')
+    else:
+        if not part[SCHEME]:
+            if not part[NETLOC]:
+                _path = part[PATH]
+                if not part[QUERY] and not part[FRAGMENT]:
+                    if '/' in _path or ':' in _path:
+                        resource = "https://{}".format(resource)
+                        part = urlsplit(resource)
+                        authority = part[NETLOC]
+                    else:
+                        if '@' in _path:
+                            authority = _path.split('@')[1]
+                        else:
+                            authority = _path
+                        resource = 'acct:{}'.format(_path)
+                elif part[QUERY]:
+                    resource = "https://{}?{}".format(_path, part[QUERY])
+                    parts = urlsplit(resource)
+                    authority = parts[NETLOC]
+                else:
+                    resource = "https://{}".format(_path)
+                    part = urlsplit(resource)
+                    authority = part[NETLOC]
+            else:
+                raise ValueError('Missing netloc')
+        else:
+            _scheme = part[SCHEME]
+            if _scheme not in ['http', 'https', 'acct']:
+                # assume it to be a hostname port combo,
+                # eg. example.com:8080
+                resource = 'https://{}'.format(resource)
+                part = urlsplit(resource)
+                authority = part[NETLOC]
+                resource = create_url(part, [FRAGMENT])
+            elif _scheme in ['http', 'https'] and not part[NETLOC]:
+                raise ValueError(
+                    'No authority part in the resource specification')
+            elif _scheme == 'acct':
+                _path = part[PATH]
+                for c in ['/', '?']:
+                    _path = _path.split(c)[0]
+
+                if '@' in _path:
+                    authority = _path.split('@')[1]
+                else:
+                    raise ValueError(
+                        'No authority part in the resource specification')
+                authority = authority.split('#')[0]
+                resource = create_url(part, [FRAGMENT])
+            else:
+                authority = part[NETLOC]
+                resource = create_url(part, [FRAGMENT])
+
+    return resource, authority
+
+
+class WebFingerCache:
+    """
+    Cache of resolved issuers keyed by normalized resource identifier.
+    Failures are cached for a shorter time than successes.
+    Since all accounts at a domain normally use the same OP, 'acct:'
+    resources can share one entry per domain.
+    """
+
+    def __init__(self, ttl=3600, negative_ttl=60, share_domain=True,
+                 max_size=10000):
+        """
+        :param ttl: Number of seconds a resolved issuer is cached
+        :param negative_ttl: Number of seconds a failure is cached
+        :param share_domain: Whether all 'acct:' resources at a domain
+            share one entry.
+        :param max_size: When the cache grows above this size expired entries
+            are removed and if that is not enough the oldest ones.
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.share_domain = share_domain
+        self.max_size = max_size
+        self.single_flight = SingleFlight()
+        # key -> (expires_at, issuer href, error description)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def key(self, resource):
+        """
+        :param resource: Resource identifier, need not be normalized
+        :return: The cache key
+        """
+        _resource, _authority = normalize_resource(resource)
+        if self.share_domain and _resource.startswith('acct:'):
+            return 'acct:@{}'.format(_authority)
+        return _resource
+
+    def get(self, key, now=0):
+        """
+        :param key: Cache key
+        :param now: Current time, seconds since epoch
+        :return: The issuer href or None if there is no valid entry.
+        :raises WebFingerError: If there is a cached failure
+        """
+        with self._lock:
+            try:
+                _expires_at, _href, _error = self._entries[key]
+            except KeyError:
+                return None
+            if _expires_at <= (now or time_sans_frac()):
+                del self._entries[key]
+                return None
+
+        if _error:
+            raise WebFingerError(_error)
+        return _href
+
+    def _set(self, key, value, now):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                for _key in [k for k, v in self._entries.items() if
+                             v[0] <= now]:
+                    del self._entries[_key]
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def set(self, key, href, now=0):
+        if not now:
+            now = time_sans_frac()
+        self._set(key, (now + self.ttl, href, ''), now)
+
+    def set_failure(self, key, error, now=0):
+        if not now:
+            now = time_sans_frac()
+        self._set(key, (now + self.negative_ttl, '', str(error)), now)
+
+    def remove(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
 class WebFinger(Service):
     """
     Implements RFC 7033
@@ -38,6 +215,18 @@ class WebFinger(Service):
                          conf=conf, **kwargs)
 
         self.rel = rel or OIC_ISSUER
+        # A WebFingerCache instance, may be shared between services
+        self.cache = self.conf.get('cache')
+
+    def _check_href(self, href):
+        try:
+            _http_allowed = self.get_conf_attr(
+                'allow', default={})['http_links']
+        except KeyError:
+            _http_allowed = False
+
+        if href.startswith('http://') and not _http_allowed:
+            raise ValueError('http link not allowed ({})'.format(href))
 
     def update_service_context(self, resp, key='', **kwargs):
         try:
@@ -47,30 +236,14 @@ class WebFinger(Service):
         else:
             for link in links:
                 if link['rel'] == self.rel:
-                    _href = link['href']
-                    try:
-                        _http_allowed = self.get_conf_attr(
-                            'allow', default={})['http_links']
-                    except KeyError:
-                        _http_allowed = False
-
-                    if _href.startswith('http://') and not _http_allowed:
-                        raise ValueError(
-                            'http link not allowed ({})'.format(_href))
-
+                    self._check_href(link['href'])
                     self.service_context.set('issuer', link['href'])
                     break
         return resp
 
     @staticmethod
     def create_url(part, ignore):
-        res = []
-        for a in range(0, 5):
-            if a in ignore:
-                res.append('')
-            else:
-                res.append(part[a])
-        return urlunsplit(tuple(res))
+        return create_url(part, ignore)
 
     def query(self, resource):
         """
@@ -80,84 +253,80 @@ class WebFinger(Service):
 
         :param resource:
         """
-        if resource[0] in ['=', '@', '!']:  # Have no process for handling these
-            raise ValueError('Not allowed resource identifier')
-
-        try:
-            part = urlsplit(resource)
-        except Exception:
-            raise ValueError('Unparsable resource')
-        else:
-            if not part[SCHEME]:
-                if not part[NETLOC]:
-                    _path = part[PATH]
-                    if not part[QUERY] and not part[FRAGMENT]:
-                        if '/' in _path or ':' in _path:
-                            resource = "https://{}".format(resource)
-                            part = urlsplit(resource)
-                            authority = part[NETLOC]
-                        else:
-                            if '@' in _path:
-                                authority = _path.split('@')[1]
-                            else:
-                                authority = _path
-                            resource = 'acct:{}'.format(_path)
-                    elif part[QUERY]:
-                        resource = "https://{}?{}".format(_path, part[QUERY])
-                        parts = urlsplit(resource)
-                        authority = parts[NETLOC]
-                    else:
-                        resource = "https://{}".format(_path)
-                        part = urlsplit(resource)
-                        authority = part[NETLOC]
-                else:
-                    raise ValueError('Missing netloc')
-            else:
-                _scheme = part[SCHEME]
-                if _scheme not in ['http', 'https', 'acct']:
-                    # assume it to be a hostname port combo,
-                    # eg. example.com:8080
-                    resource = 'https://{}'.format(resource)
-                    part = urlsplit(resource)
-                    authority = part[NETLOC]
-                    resource = self.create_url(part, [FRAGMENT])
-                elif _scheme in ['http', 'https'] and not part[NETLOC]:
-                    raise ValueError(
-                        'No authority part in the resource specification')
-                elif _scheme == 'acct':
-                    _path = part[PATH]
-                    for c in ['/', '?']:
-                        _path = _path.split(c)[0]
-
-                    if '@' in _path:
-                        authority = _path.split('@')[1]
-                    else:
-                        raise ValueError(
-                            'No authority part in the resource specification')
-                    authority = authority.split('#')[0]
-                    resource = self.create_url(part, [FRAGMENT])
-                else:
-                    authority = part[NETLOC]
-                    resource = self.create_url(part, [FRAGMENT])
-
+        resource, authority = normalize_resource(resource)
         location = WF_URL.format(authority)
         return oidc.WebFingerRequest(
             resource=resource, rel=OIC_ISSUER).request(location)
 
-    def get_request_parameters(self, request_args=None, **kwargs):
-
+    def _resource(self, request_args=None, **kwargs):
         if request_args is None:
             request_args = {}
 
         try:
-            _resource = request_args['resource']
+            return request_args['resource']
         except KeyError:
             try:
-                _resource = kwargs['resource']
+                return kwargs['resource']
             except KeyError:
                 try:
-                    _resource = self.service_context.config['resource']
+                    return self.service_context.config['resource']
                 except KeyError:
                     raise MissingRequiredAttribute('resource')
 
+    def get_request_parameters(self, request_args=None, **kwargs):
+        _resource = self._resource(request_args, **kwargs)
         return {'url': self.query(_resource), 'method': 'GET'}
+
+    def _issuer_href(self, resp):
+        for link in resp.get('links', []):
+            if link['rel'] == self.rel:
+                self._check_href(link['href'])
+                return link['href']
+        raise WebFingerError('No link with rel={}'.format(self.rel))
+
+    def _resolve(self, httpc, key, resource):
+        try:
+            _info = self.get_request_parameters(request_args={
+                'resource': resource})
+            _resp = self.parse_request_response(
+                httpc(_info['method'], _info['url'],
+                      headers=_info.get('headers')),
+                self.response_body_type)
+            if 'error' in _resp:
+                raise WebFingerError(_resp.to_json())
+            _href = self._issuer_href(_resp)
+        except Exception as err:
+            logger.info('WebFinger lookup of %s failed: %s', resource, err)
+            self.cache.set_failure(key, err)
+            raise
+
+        self.cache.set(key, _href)
+        return _resp
+
+    def do_request(self, httpc=None, request_args=None, response_body_type='',
+                   **kwargs):
+        """
+        If there is a cache, a resolved issuer is used as long as the entry
+        is valid and a failed lookup isn't redone until the negative TTL has
+        passed. Concurrent lookups bound to the same cache key are coalesced
+        into one.
+        """
+        if self.cache is None:
+            return Service.do_request(self, httpc, request_args=request_args,
+                                      response_body_type=response_body_type,
+                                      **kwargs)
+
+        _resource = normalize_resource(
+            self._resource(request_args, **kwargs))[0]
+        _key = self.cache.key(_resource)
+        _href = self.cache.get(_key)
+        if _href is None:
+            if httpc is None:
+                httpc = self.service_context.get_http_transport()
+            _resp = self.cache.single_flight.do(_key, self._resolve, httpc,
+                                                _key, _resource)
+        else:
+            logger.debug('Using cached WebFinger result for %s', _resource)
+            _resp = JRD(subject=_resource,
+                        links=[Link(rel=self.rel, href=_href)])
+        return self.update_service_context(_resp)
@@ -0,0 +1,241 @@
+"""
+A cache for provider configuration information. One cache instance can be
+shared by several service contexts, like RP instances serving different
+tenants, talking to the same OPs.
+"""
+import logging
+import threading
+from email.utils import parsedate_to_datetime
+
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.util import content_digest, get_header
+
+LOGGER = logging.getLogger(__name__)
+
+
+def parse_cache_control(value):
+    """
+    Parse the value of a Cache-Control header.
+
+    :param value: The header value
+    :return: Dictionary with the directives as keys. Directives without a
+        value gets the value True.
+    """
+    _directives = {}
+    if not value:
+        return _directives
+
+    for _part in value.split(','):
+        _part = _part.strip()
+        if not _part:
+            continue
+        if '=' in _part:
+            _name, _val = _part.split('=', 1)
+            _directives[_name.strip().lower()] = _val.strip().strip('"')
+        else:
+            _directives[_part.lower()] = True
+    return _directives
+
+
+def _seconds(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class CacheEntry:
+    """Provider information from one URL together with caching metadata."""
+
+    def __init__(self, content, etag='', last_modified='', fetched_at=0,
+                 expires_at=0, stale_until=0):
+        """
+        :param content: The provider information as a dictionary
+        :param etag: The ETag of the response
+        :param last_modified: The Last-Modified value of the response
+        :param fetched_at: When the information was fetched/revalidated
+        :param expires_at: When the information is no longer fresh
+        :param stale_until: Until when stale information may be served while
+            it's being revalidated.
+        """
+        self.content = content
+        self.digest = content_digest(content)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.revalidating = False
+
+    def is_fresh(self, now=0):
+        return (now or time_sans_frac()) < self.expires_at
+
+    def is_usable(self, now=0):
+        """Fresh or possible to use while revalidating."""
+        return (now or time_sans_frac()) < max(self.expires_at,
+                                               self.stale_until)
+
+    def conditional_headers(self):
+        """
+        :return: The headers to use in a conditional GET
+        """
+        _headers = {}
+        if self.etag:
+            _headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            _headers['If-Modified-Since'] = self.last_modified
+        return _headers
+
+
+class ProviderInfoCache:
+    """
+    Provider information keyed by the URL it was fetched from, usually an
+    issuer's .well-known/openid-configuration URL.
+    How long an entry is fresh is decided by the Cache-Control and Expires
+    headers of the response, if there are none a default max age is used.
+    """
+
+    def __init__(self, default_max_age=3600, stale_while_revalidate=86400):
+        """
+        :param default_max_age: Number of seconds an entry is fresh if the
+            response didn't say anything about it.
+        :param stale_while_revalidate: Number of seconds after an entry has
+            become stale it may still be used while it's being revalidated.
+            Overridden by the stale-while-revalidate directive in the response.
+        """
+        self.default_max_age = default_max_age
+        self.stale_while_revalidate = stale_while_revalidate
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._entries
+
+    def get(self, url):
+        """
+        :param url: The URL the information was fetched from
+        :return: A :py:class:`CacheEntry` instance or None
+        """
+        with self._lock:
+            return self._entries.get(url)
+
+    def remove(self, url):
+        with self._lock:
+            self._entries.pop(url, None)
+
+    def lifetime(self, headers, now=0):
+        """
+        Figure out for how long a response may be used.
+
+        :param headers: The response headers
+        :param now: Current time, seconds since epoch
+        :return: Tuple of expires_at and stale_until. None if the response
+            must not be cached.
+        """
+        if not now:
+            now = time_sans_frac()
+
+        _cc = parse_cache_control(get_header(headers, 'cache-control'))
+        if 'no-store' in _cc:
+            return None
+
+        _swr = _seconds(_cc.get('stale-while-revalidate'))
+        if _swr is None:
+            _swr = self.stale_while_revalidate
+
+        if 'no-cache' in _cc:
+            return now, now + _swr
+
+        _max_age = _seconds(_cc.get('max-age'))
+        if _max_age is not None:
+            _age = _seconds(get_header(headers, 'age')) or 0
+            _expires_at = now + max(_max_age - _age, 0)
+        else:
+            _expires = get_header(headers, 'expires')
+            try:
+                _expires_at = int(parsedate_to_datetime(_expires).timestamp())
+            except (TypeError, ValueError, IndexError):
+                _expires_at = now + self.default_max_age
+
+        return _expires_at, _expires_at + _swr
+
+    def store(self, url, content, headers=None, now=0):
+        """
+        Add or replace the provider information fetched from a URL.
+
+        :param url: The URL the information was fetched from
+        :param content: The provider information as a dictionary
+        :param headers: The response headers
+        :param now: Current time, seconds since epoch
+        :return: A :py:class:`CacheEntry` instance. If the response wasn't
+            cacheable the entry isn't kept.
+        """
+        if not now:
+            now = time_sans_frac()
+
+        _lifetime = self.lifetime(headers, now)
+        if _lifetime is None:
+            self.remove(url)
+            return CacheEntry(content, fetched_at=now)
+
+        _entry = CacheEntry(content,
+                            etag=get_header(headers, 'etag'),
+                            last_modified=get_header(headers, 'last-modified'),
+                            fetched_at=now, expires_at=_lifetime[0],
+                            stale_until=_lifetime[1])
+        with self._lock:
+            self._entries[url] = _entry
+        return _entry
+
+    def revalidated(self, url, headers=None, now=0):
+        """
+        The OP said the cached information is still valid (304 Not
+        Modified). Update the entry with the new caching information.
+
+        :param url: The URL the information was fetched from
+        :param headers: The response headers
+        :param now: Current time, seconds since epoch
+        :return: The updated :py:class:`CacheEntry` instance or None if
+            there was no entry.
+        """
+        if not now:
+            now = time_sans_frac()
+
+        _lifetime = self.lifetime(headers, now)
+        _etag = get_header(headers, 'etag')
+        with self._lock:
+            _entry = self._entries.get(url)
+            if _entry is None:
+                return None
+
+            if _lifetime is None:
+                del self._entries[url]
+                return _entry
+
+            _entry.fetched_at = now
+            _entry.expires_at, _entry.stale_until = _lifetime
+            if _etag:
+                _entry.etag = _etag
+        return _entry
+
+    def claim_revalidation(self, url):
+        """
+        Makes sure only one revalidation of an entry is going on at the time.
+
+        :param url: The URL the information was fetched from
+        :return: True if the caller should do the revalidation
+        """
+        with self._lock:
+            _entry = self._entries.get(url)
+            if _entry is None or _entry.revalidating:
+                return False
+            _entry.revalidating = True
+            return True
+
+    def release_revalidation(self, url):
+        with self._lock:
+            _entry = self._entries.get(url)
+            if _entry is not None:
+                _entry.revalidating = False
@@ -0,0 +1,171 @@
+"""
+Persistence of client registrations. Storing the registration response means
+an RP that is restarted doesn't have to register again with every OP it
+has registered with before.
+
+A registration response contains the client secret and the registration
+access token. They are stored as they are, unencrypted, so the database
+must be protected like any other place client secrets are kept.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.state_interface import InMemoryStateDataBase
+from oidcservice.util import content_digest
+
+LOGGER = logging.getLogger(__name__)
+
+
+def registration_key(issuer, redirect_uris, preferences):
+    """
+    The key a registration is stored under. A registration can only be
+    reused if it was made with the same OP, the same redirect URIs and the
+    same client preferences.
+
+    :param issuer: Issuer ID of the OP
+    :param redirect_uris: The redirect URIs of the client
+    :param preferences: Client preferences and extra registration arguments
+    :return: A key
+    """
+    return '{}:{}'.format(issuer, content_digest({
+        'redirect_uris': sorted(redirect_uris or []),
+        'preferences': preferences
+    }))
+
+
+class DirectoryDataBase:
+    """
+    A database that keeps every value in a file of its own in a directory.
+    Has the same interface as
+    :py:class:`oidcservice.state_interface.InMemoryStateDataBase`.
+    The directory and the files are only accessible by the owner.
+    """
+
+    def __init__(self, db_dir):
+        """
+        :param db_dir: Directory where the values are kept
+        """
+        self.db_dir = db_dir
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir, mode=0o700, exist_ok=True)
+
+    def _filename(self, key):
+        _name = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.db_dir, _name)
+
+    def set(self, key, value):
+        """Assign a value to a key. The file is replaced atomically."""
+        _fd, _tmp = tempfile.mkstemp(dir=self.db_dir)
+        try:
+            with os.fdopen(_fd, 'w') as _fp:
+                _fp.write(value)
+            os.replace(_tmp, self._filename(key))
+        except Exception:
+            os.unlink(_tmp)
+            raise
+
+    def get(self, key):
+        """Return the value bound to a key."""
+        try:
+            with open(self._filename(key)) as _fp:
+                return _fp.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key):
+        """Delete a key and its value."""
+        try:
+            os.unlink(self._filename(key))
+        except FileNotFoundError:
+            pass
+
+
+class RegistrationStore:
+    """
+    Keeps registration responses keyed by issuer, redirect URIs and client
+    preferences. The responses, secrets included, are stored in plaintext.
+    """
+
+    def __init__(self, db=None, skew=60):
+        """
+        :param db: Where the registrations are kept. Anything with the same
+            interface as
+            :py:class:`oidcservice.state_interface.InMemoryStateDataBase`.
+        :param skew: A registration whose client secret expires within
+            this many seconds is not reused.
+        """
+        self.db = db if db is not None else InMemoryStateDataBase()
+        self.skew = skew
+
+    @staticmethod
+    def key(service_context):
+        """
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        :return: The key the registration of the client is stored under
+        """
+        return registration_key(
+            service_context.get('issuer'),
+            service_context.get('redirect_uris'),
+            {'client_preferences': service_context.client_preferences,
+             'register_args': service_context.register_args})
+
+    def save(self, service_context, response, now=0):
+        """
+        Store a registration response.
+
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        :param response: The registration response
+        :param now: Current time, seconds since epoch
+        """
+        self.db.set(self.key(service_context), json.dumps({
+            'registration_response': response.to_dict() if hasattr(
+                response, 'to_dict') else response,
+            'stored_at': now or time_sans_frac()
+        }))
+
+    def remove(self, service_context):
+        """
+        Remove the stored registration of a client.
+
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        """
+        self.db.delete(self.key(service_context))
+
+    def lookup(self, service_context, now=0):
+        """
+        Find a registration that can be reused.
+
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        :param now: Current time, seconds since epoch
+        :return: The registration response as a dictionary or None if
+            there is no registration or its client secret has expired.
+        """
+        _key = self.key(service_context)
+        _item = self.db.get(_key)
+        if not _item:
+            return None
+
+        try:
+            _response = json.loads(_item)['registration_response']
+        except (ValueError, KeyError) as err:
+            LOGGER.warning('Could not read registration %s: %s', _key, err)
+            self.db.delete(_key)
+            return None
+
+        _expires_at = _response.get('client_secret_expires_at', 0)
+        if _expires_at and _expires_at <= (now or time_sans_frac()) + self.skew:
+            LOGGER.info('Stored registration at %s has expired',
+                        service_context.get('issuer'))
+            self.db.delete(_key)
+            return None
+
+        return _response
@@ -0,0 +1,147 @@
+"""
+Stores for request objects that are passed by reference, that is the OP is
+given a request_uri from which it fetches the request object.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice import rndstr
+
+LOGGER = logging.getLogger(__name__)
+
+# Media type of a request object, RFC 9101
+REQUEST_OBJECT_CONTENT_TYPE = 'application/oauth-authz-req+jwt'
+
+
+class InMemoryRequestObjectStore:
+    """
+    Keeps request objects in memory until they expire or the store is full,
+    in which case the least recently added is evicted.
+
+    Anything with the same interface, add/get/remove, can be used, for
+    instance a store backed by a database shared by several nodes.
+    """
+
+    def __init__(self, base_url, lifetime=300, max_size=10000):
+        """
+        :param base_url: The URL under which the request objects are
+            published. A request_uri is this followed by a name.
+        :param lifetime: Number of seconds a request object is kept.
+        :param max_size: Max number of request objects kept.
+        """
+        if not base_url.endswith('/'):
+            base_url += '/'
+        self.base_url = base_url
+        self.base_path = urlsplit(base_url).path
+        self.lifetime = lifetime
+        self.max_size = max_size
+        # name -> (expires_at, request object)
+        self._db = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._db)
+
+    def name(self, request_uri):
+        """
+        :param request_uri: A request_uri or the path part of one
+        :return: The name the request object is stored under
+        """
+        _name = request_uri.split('#')[0]
+        for _base in [self.base_url, self.base_path]:
+            if _name.startswith(_base):
+                return _name[len(_base):]
+        return _name.rsplit('/', 1)[-1]
+
+    def add(self, request_object, request_uri='', now=0):
+        """
+        Store a request object.
+
+        :param request_object: The request object, a signed and/or
+            encrypted JWT
+        :param request_uri: Where the request object should be published.
+            If not given a unique one is constructed.
+        :param now: Current time, seconds since epoch
+        :return: The request_uri
+        """
+        if not now:
+            now = time_sans_frac()
+
+        with self._lock:
+            if request_uri:
+                _name = self.name(request_uri)
+            else:
+                _name = '{}.jwt'.format(rndstr(32))
+                while _name in self._db:
+                    _name = '{}.jwt'.format(rndstr(32))
+                request_uri = '{}{}'.format(self.base_url, _name)
+
+            self._db[_name] = (now + self.lifetime, request_object)
+            self._db.move_to_end(_name)
+            while len(self._db) > self.max_size:
+                self._db.popitem(last=False)
+
+        return request_uri
+
+    def get(self, request_uri, now=0):
+        """
+        Find a request object.
+
+        :param request_uri: A request_uri or the path part of one
+        :param now: Current time, seconds since epoch
+        :return: The request object or None if there is none or it has
+            expired.
+        """
+        _name = self.name(request_uri)
+        with self._lock:
+            try:
+                _expires_at, _request_object = self._db[_name]
+            except KeyError:
+                return None
+            if _expires_at <= (now or time_sans_frac()):
+                del self._db[_name]
+                return None
+        return _request_object
+
+    def remove(self, request_uri):
+        """
+        Remove a request object, typically when the authorization response
+        has been received.
+
+        :param request_uri: A request_uri or the path part of one
+        """
+        with self._lock:
+            self._db.pop(self.name(request_uri), None)
+
+    def remove_expired(self, now=0):
+        """
+        Remove all request objects that have expired.
+
+        :param now: Current time, seconds since epoch
+        :return: Number of request objects removed
+        """
+        if not now:
+            now = time_sans_frac()
+        with self._lock:
+            _expired = [n for n, (e, _) in self._db.items() if e <= now]
+            for _name in _expired:
+                del self._db[_name]
+        return len(_expired)
+
+    def response(self, path):
+        """
+        What a web framework should return when the OP fetches a request
+        object.
+
+        :param path: The path part of the URL the OP used
+        :return: Tuple of HTTP status code, headers and body
+        """
+        _request_object = self.get(path)
+        if _request_object is None:
+            return 404, {'Content-Type': 'text/plain'}, 'Not found'
+        return 200, {'Content-Type': REQUEST_OBJECT_CONTENT_TYPE}, \
+            _request_object
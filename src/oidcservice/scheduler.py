@@ -0,0 +1,186 @@
+"""
+Runs refreshes, of for instance access tokens or keys, at scheduled points in
+time in the background.
+"""
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from oidcmsg.time_util import time_sans_frac
+
+
+class RefreshScheduler:
+    """
+    Keeps a min-heap of points in time when things have to be refreshed and
+    hands the refreshes that are due over to a pool of worker threads,
+    either when :py:meth:`run_pending` is called or from a background
+    thread.
+
+    Subclasses supply the refresh action, :py:meth:`refresh_due`.
+    """
+    thread_name = 'refresh-scheduler'
+
+    def __init__(self, max_workers=4):
+        """
+        :param max_workers: Size of the worker pool that does the refreshing.
+        """
+        self.max_workers = max_workers
+        self._heap = []
+        # key -> (refresh time, item). Heap entries that don't match are
+        # stale.
+        self._scheduled = {}
+        self._cond = threading.Condition(threading.Lock())
+        self._executor = None
+        self._thread = None
+        self._running = False
+
+    def schedule(self, key, when, item=None):
+        """
+        Schedule a refresh. Replaces any earlier refresh with the same key.
+
+        :param key: What is to be refreshed
+        :param when: Refresh time as seconds since epoch
+        :param item: What :py:meth:`refresh_due` is called with. Default is
+            the key.
+        """
+        with self._cond:
+            self._scheduled[key] = (when, key if item is None else item)
+            heapq.heappush(self._heap, (when, key))
+            self._cond.notify()
+
+    def unschedule(self, key):
+        """
+        :param key: What shouldn't be refreshed anymore
+        """
+        with self._cond:
+            # The heap entry is ignored when it pops up
+            self._scheduled.pop(key, None)
+
+    def is_scheduled(self, key):
+        """
+        :param key: What is to be refreshed
+        :return: True if a refresh is scheduled
+        """
+        with self._cond:
+            return key in self._scheduled
+
+    def _is_current(self, when, key):
+        _entry = self._scheduled.get(key)
+        return _entry is not None and _entry[0] == when
+
+    def _drop_stale(self):
+        while self._heap:
+            _when, _key = self._heap[0]
+            if self._is_current(_when, _key):
+                break
+            heapq.heappop(self._heap)
+
+    def _next_due(self):
+        # The caller must hold the lock
+        self._drop_stale()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def next_due(self):
+        """
+        :return: When the next refresh is due or None if nothing is
+            scheduled.
+        """
+        with self._cond:
+            return self._next_due()
+
+    def _pop_due(self, now):
+        _due = []
+        with self._cond:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= now:
+                _when, _key = heapq.heappop(self._heap)
+                if self._is_current(_when, _key):
+                    _due.append((_key, self._scheduled.pop(_key)[1]))
+                self._drop_stale()
+        return _due
+
+    def pop_due(self, now=0):
+        """
+        Remove and return everything that is due to be refreshed.
+
+        :param now: Current time, seconds since epoch
+        :return: List of items
+        """
+        return [_item for _, _item in self._pop_due(now or time_sans_frac())]
+
+    def refresh_due(self, item):
+        """
+        Do a refresh that is due. Runs in a worker thread.
+
+        :param item: What is to be refreshed
+        """
+        raise NotImplementedError()
+
+    def _executor_pool(self):
+        with self._cond:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers)
+            return self._executor
+
+    def run_pending(self, now=0):
+        """
+        Hand all refreshes that are due over to the worker pool.
+
+        :param now: Current time, seconds since epoch
+        :return: Dictionary with keys as keys and futures as values
+        """
+        _pool = self._executor_pool()
+        return {_key: _pool.submit(self.refresh_due, _item)
+                for _key, _item in self._pop_due(now or time_sans_frac())}
+
+    def _run(self):
+        with self._cond:
+            while self._running:
+                _next = self._next_due()
+                if _next is None:
+                    self._cond.wait()
+                    continue
+
+                _delay = _next - time_sans_frac()
+                if _delay > 0:
+                    self._cond.wait(_delay)
+                    continue
+
+                self._cond.release()
+                try:
+                    self.run_pending()
+                finally:
+                    self._cond.acquire()
+
+    def start(self):
+        """Start refreshing in the background."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name=self.thread_name)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stop refreshing in the background.
+
+        :param wait: Wait for ongoing refreshes to finish
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+        with self._cond:
+            _executor, self._executor = self._executor, None
+        if _executor is not None:
+            _executor.shutdown(wait=wait)
@@ -1,17 +1,24 @@
 """ The basic Service class upon which all the specific services are built. """
+import json
 import logging
+from functools import lru_cache
 from urllib.parse import urlparse
 
+from cryptojwt.exception import BadSyntax
 from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import KeyJar
+from cryptojwt.utils import as_bytes, b64d
+from oidcmsg.exception import MissingSigningKey
 from oidcmsg.message import Message
 from oidcmsg.oauth2 import ResponseMessage, is_error_message
 
 from oidcservice import util
 from oidcservice.client_auth import factory as ca_factory
-from oidcservice.exception import ResponseError
+from oidcservice.exception import ResponseError, ServerError
 from oidcservice.state_interface import StateInterface
 from oidcservice.util import (JOSE_ENCODED, JSON_ENCODED, URL_ENCODED,
-                              get_http_body, get_http_url)
+                              get_deserialization_method, get_http_body,
+                              get_http_url)
 
 __author__ = 'Roland Hedberg'
 
@@ -24,6 +31,65 @@ SPECIAL_ARGS = ['authn_endpoint', 'algs']
 REQUEST_INFO = 'Doing request with: URL:{}, method:{}, data:{}, https_args:{}'
 
 
+@lru_cache(maxsize=16)
+def _load_keyjar(keys):
+    _keyjar = KeyJar()
+    for _issuer_id, _jwks in json.loads(keys).items():
+        _keyjar.import_jwks(_jwks, _issuer_id)
+    return _keyjar
+
+
+def own_keys_needed(token):
+    """
+    :param token: Something that may be a JWT
+    :return: True if it's a JWT that is encrypted or MAC'ed, which means the
+        receiver's own keys are needed to unpack it.
+    """
+    _parts = token.split('.')
+    if len(_parts) == 5:
+        return True
+    if len(_parts) != 3:
+        return False
+    try:
+        _header = json.loads(b64d(as_bytes(_parts[0])))
+    except (BadSyntax, ValueError, TypeError):
+        return False
+    return isinstance(_header, dict) and str(
+        _header.get('alg', '')).startswith('HS')
+
+
+def verify_response(response_cls, response, keys, **kwargs):
+    """
+    Verify a response. All the arguments can be pickled so this can be run
+    in another process. Keys are parsed once per process.
+
+    :param response_cls: The response message class
+    :param response: The response as a dictionary
+    :param keys: A JSON document mapping issuer IDs to JWKSs
+    :param kwargs: Arguments to the verify method, except the key jar
+    :return: The verified response
+    """
+    _resp = response_cls(**response)
+    _resp.verify(keyjar=_load_keyjar(keys), **kwargs)
+    return _resp
+
+
+def unpack_jwt(token, keys, iss='', **kwargs):
+    """
+    Verify and/or decrypt a JWT. Like :py:func:`verify_response` this can be
+    run in another process.
+
+    :param token: The JWT
+    :param keys: A JSON document mapping issuer IDs to JWKSs
+    :param iss: Who the JWT is intended for
+    :param kwargs: Arguments to :py:class:`cryptojwt.jwt.JWT`
+    :return: The payload
+    """
+    _jwt = JWT(key_jar=_load_keyjar(keys), **kwargs)
+    _jwt.iss = iss
+    return _jwt.unpack(token)
+
+
 class Service(StateInterface):
     """The basic Service class."""
     msg_type = Message
@@ -59,6 +125,12 @@ class Service(StateInterface):
         else:
             self.conf = {}
 
+        # Where responses are verified, typically a process pool so that
+        # signature checks and decryption are done outside this process.
+        self.verify_executor = self.conf.get('verify_executor')
+        # (issuer ID, private) -> (keys, JWKS as JSON)
+        self._jwks_cache = {}
+
         # pull in all the modifiers
         self.pre_construct = []
         self.post_construct = []
@@ -404,11 +476,72 @@ class Service(StateInterface):
 
         return kwargs
 
+    def _jwks(self, issuer_id, private=False):
+        # One key owner's JWKS as JSON, reused as long as the owner has the
+        # same key objects.
+        _keyjar = self.service_context.keyjar
+        _keys = []
+        if issuer_id in _keyjar:
+            _keys = [k for k in _keyjar.get_issuer_keys(issuer_id) if
+                     k.inactive_since == 0]
+
+        _cached = self._jwks_cache.get((issuer_id, private))
+        if _cached and len(_cached[0]) == len(_keys) and all(
+                a is b for a, b in zip(_cached[0], _keys)):
+            return _cached[1]
+
+        _jwks = json.dumps({'keys': [k.serialize(private) for k in _keys]},
+                           sort_keys=True)
+        self._jwks_cache[(issuer_id, private)] = (_keys, _jwks)
+        return _jwks
+
+    def _verification_keys(self, *tokens):
+        """
+        The keys a worker process needs to verify a set of JWTs. That is the
+        issuer's public keys and, only if one of the JWTs is encrypted or
+        MAC'ed, the client's own keys.
+
+        :param tokens: The JWTs
+        :return: A JSON document mapping issuer IDs to JWKSs
+        """
+        _owners = {self.service_context.get('issuer'): False}
+        if any(own_keys_needed(t) for t in tokens):
+            _owners[''] = True
+            _owners[self.service_context.get('client_id')] = True
+        return '{{{}}}'.format(', '.join(
+            '{}: {}'.format(json.dumps(_id), self._jwks(_id, _private)) for
+            _id, _private in sorted(_owners.items())))
+
+    def verify(self, resp, **kwargs):
+        """
+        Verify a response, in the verify executor if there is one. The
+        executor, typically a process pool, gets the response and the keys
+        as JWKSs since key objects can't be pickled.
+
+        :param resp: The response
+        :param kwargs: Arguments to the verify method
+        :return: The verified response
+        """
+        if self.verify_executor is None:
+            resp.verify(**kwargs)
+            return resp
+
+        _args = {k: v for k, v in kwargs.items() if k != 'keyjar'}
+        _tokens = [v for v in resp.values() if isinstance(v, str)]
+        return self.verify_executor.submit(
+            verify_response, type(resp), resp.to_dict(),
+            self._verification_keys(*_tokens), **_args).result()
+
     def _do_jwt(self, info):
         args = {'allowed_sign_algs': self.service_context.get_sign_alg(self.service_name)}
         enc_algs = self.service_context.get_enc_alg_enc(self.service_name)
         args['allowed_enc_algs'] = enc_algs['alg']
         args['allowed_enc_encs'] = enc_algs['enc']
+        if self.verify_executor is not None:
+            return self.verify_executor.submit(
+                unpack_jwt, info, self._verification_keys(info),
+                self.service_context.get('client_id'), **args).result()
+
         _jwt = JWT(key_jar=self.service_context.keyjar, **args)
         _jwt.iss = self.service_context.get('client_id')
         return _jwt.unpack(info)
@@ -435,6 +568,20 @@ class Service(StateInterface):
                 raise
         return resp
 
+    def _refresh_issuer_keys(self):
+        """
+        No key matching a signature was found. If there is a key refresh
+        scheduler, let it decide whether the issuer's keys should be
+        refreshed.
+
+        :return: True if the keys were refreshed
+        """
+        _scheduler = getattr(self.service_context, 'key_scheduler', None)
+        if _scheduler is None:
+            return False
+        return _scheduler.unknown_key(self.service_context.keyjar,
+                                      self.service_context.get('issuer'))
+
     def parse_response(self, info, sformat="", state="", **kwargs):
         """
         This the start of a pipeline that will:
@@ -493,7 +640,13 @@ class Service(StateInterface):
             try:
                 # verify the message. If something is wrong an exception is
                 # thrown
-                resp.verify(**vargs)
+                try:
+                    resp = self.verify(resp, **vargs)
+                except MissingSigningKey:
+                    if not self._refresh_issuer_keys():
+                        raise
+                    # The issuer had new keys, try again
+                    resp = self.verify(resp, **vargs)
             except Exception as err:
                 LOGGER.error(
                     'Got exception while verifying response: %s', err)
@@ -507,6 +660,74 @@ class Service(StateInterface):
 
         return resp
 
+    def parse_request_response(self, reqresp, response_body_type='', state='',
+                               **kwargs):
+        """
+        Deal with a HTTP response to a request sent on behalf of this service.
+
+        :param reqresp: The HTTP response, an object with the attributes
+            status_code, text and headers.
+        :param response_body_type: Expected serialization of the response
+            body. If not given it is derived from the Content-Type header.
+        :param state: The state
+        :param kwargs: Extra key word arguments
+        :return: The parsed response. If the server returned an OAuth2 error
+            this will be an instance of the services error message class.
+        """
+        if reqresp.status_code in SUCCESSFUL:
+            _sformat = response_body_type or get_deserialization_method(reqresp)
+            return self.parse_response(reqresp.text, _sformat, state=state,
+                                       **kwargs)
+
+        if 400 <= reqresp.status_code < 500:
+            LOGGER.error('Error response (%s): %s', reqresp.status_code,
+                         reqresp.text)
+            try:
+                return self.error_msg().from_json(reqresp.text)
+            except ValueError:
+                pass
+
+        LOGGER.error('HTTP error: %s [%s]', reqresp.text, reqresp.status_code)
+        if reqresp.status_code >= 500:
+            raise ServerError(
+                'HTTP ERROR: {} [{}]'.format(reqresp.text, reqresp.status_code))
+        raise ResponseError(
+            'HTTP ERROR: {} [{}]'.format(reqresp.text, reqresp.status_code))
+
+    def do_request(self, httpc=None, request_args=None,
+                   response_body_type='', **kwargs):
+        """
+        Runs the whole chain: constructs the request, sends it, parses the
+        response and if it wasn't an error response updates the service
+        context.
+
+        :param httpc: A HTTP client. A callable with the same signature as
+            :py:func:`requests.request`. Default is the service context's
+            :py:class:`oidcservice.http_transport.HTTPTransport`.
+        :param request_args: Message arguments
+        :param response_body_type: Expected serialization of the response
+        :param kwargs: Extra keyword arguments, passed on to
+            get_request_parameters.
+        :return: The parsed response
+        """
+        if httpc is None:
+            httpc = self.service_context.get_http_transport()
+
+        _state = kwargs.get('state', '')
+        _info = self.get_request_parameters(request_args=request_args, **kwargs)
+        LOGGER.debug(REQUEST_INFO.format(_info['url'], _info['method'],
+                                         _info.get('body'),
+                                         _info.get('headers')))
+
+        reqresp = httpc(_info['method'], _info['url'], data=_info.get('body'),
+                        headers=_info.get('headers'))
+
+        response = self.parse_request_response(reqresp, response_body_type,
+                                               state=_state)
+        if not is_error_message(response):
+            self.update_service_context(response, key=_state)
+        return response
+
     def get_conf_attr(self, attr, default=None):
         """
         Get the value of a attribute in the configuration
@@ -523,6 +744,90 @@ class Service(StateInterface):
         return default
 
 
+class ServiceDict(dict):
+    """
+    A dictionary with service names as keys and service instances as values.
+    Also keeps an index from endpoint name, as used in the provider info,
+    to the services that use that endpoint.
+    """
+
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._endpoint_index = None
+
+    def _reset_index(self):
+        self._endpoint_index = None
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._reset_index()
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._reset_index()
+
+    def pop(self, *args):
+        self._reset_index()
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        self._reset_index()
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        self._reset_index()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        dict.update(self, *args, **kwargs)
+        self._reset_index()
+
+    def clear(self):
+        dict.clear(self)
+        self._reset_index()
+
+    @property
+    def endpoint_index(self):
+        """
+        :return: Dictionary with endpoint names as keys and lists of service
+            instances as values.
+        """
+        if self._endpoint_index is None:
+            _index = {}
+            for _srv in self.values():
+                # Every service has an endpoint_name assigned when initiated.
+                # This name *MUST* match the endpoint names used in the
+                # provider info
+                if _srv.endpoint_name:
+                    _index.setdefault(_srv.endpoint_name, []).append(_srv)
+            self._endpoint_index = _index
+        return self._endpoint_index
+
+    def services_for_endpoint(self, endpoint_name):
+        """
+        Which services that use an endpoint.
+
+        :param endpoint_name: The endpoint name, with or without the
+            '_endpoint' suffix, e.g. 'token_endpoint' or 'token'.
+        :return: A list of service instances
+        """
+        if not endpoint_name.endswith('_endpoint'):
+            endpoint_name = '{}_endpoint'.format(endpoint_name)
+        return self.endpoint_index.get(endpoint_name, [])
+
+    def set_endpoints(self, provider_info):
+        """
+        Set the endpoint of every service whose endpoint appears in the
+        provider info.
+
+        :param provider_info: The provider info
+        """
+        for _name, _srvs in self.endpoint_index.items():
+            if _name in provider_info:
+                for _srv in _srvs:
+                    _srv.endpoint = provider_info[_name]
+
+
 def gather_constructors(service_methods, construct):
     """Loads the construct methods that are defined."""
     try:
@@ -548,10 +853,10 @@ def init_services(service_definitions, service_context, client_authn_factory=Non
         for all service instances.
     :param client_authn_factory: A list of methods the services can use to
         authenticate the client to a service.
-    :return: A dictionary, with service name as key and the service instance as
-        value.
+    :return: A :py:class:`ServiceDict` instance, with service name as key and
+        the service instance as value.
     """
-    service = {}
+    service = ServiceDict()
     for service_name, service_configuration in service_definitions.items():
         try:
             kwargs = service_configuration['kwargs']
@@ -16,6 +16,8 @@ from oidcmsg.context import OidcContext
 from oidcmsg.message import Message
 from oidcmsg.oidc import RegistrationRequest
 
+from oidcservice.http_transport import HTTPTransport
+
 CLI_REG_MAP = {
     "userinfo": {
         "sign": "userinfo_signed_response_alg",
@@ -109,6 +111,14 @@ class ServiceContext(OidcContext):
         self.args = {}
         self.add_on = {}
         self.httpc_params = {}
+        # A oidcservice.http_transport.HTTPTransport instance, created when
+        # first needed
+        self.http_transport = None
+        # A oidcservice.key_scheduler.KeyRefreshScheduler instance
+        self.key_scheduler = None
+        # The userinfo service's cache of userinfo responses per state, if
+        # it caches them.
+        self.user_info_cache = None
 
         _def_value = copy.deepcopy(DEFAULT_VALUE)
         # Dynamic information
@@ -127,7 +137,8 @@ class ServiceContext(OidcContext):
         for key, val in kwargs.items():
             setattr(self, key, val)
 
-        for attr in ['base_url', 'requests_dir', 'allow', 'client_preferences', 'verify_args']:
+        for attr in ['base_url', 'requests_dir', 'allow', 'client_preferences', 'verify_args',
+                     'httpc_params']:
             try:
                 setattr(self, attr, config[attr])
             except KeyError:
@@ -152,6 +163,17 @@ class ServiceContext(OidcContext):
     def __setitem__(self, key, value):
         setattr(self, key, value)
 
+    def get_http_transport(self):
+        """
+        The HTTP client services use unless given one.
+
+        :return: A :py:class:`oidcservice.http_transport.HTTPTransport`
+            instance that uses :py:attr:`httpc_params`.
+        """
+        if self.http_transport is None:
+            self.http_transport = HTTPTransport(self.httpc_params)
+        return self.http_transport
+
     def filename_from_webname(self, webname):
         """
         A 1<->1 map is maintained between a URL pointing to a file and
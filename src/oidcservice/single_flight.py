@@ -0,0 +1,124 @@
+"""
+Coalescing of concurrent calls that are doing the same thing.
+While a call bound to a key is in flight, other callers using the same key
+wait for that call to finish and share its result.
+"""
+import asyncio
+import logging
+import threading
+
+LOGGER = logging.getLogger(__name__)
+
+
+class _Call:
+    """A call in flight."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Makes sure that there is only one call in flight per key.
+    Works for threads (:py:meth:`do`) as well as for coroutines running in
+    one event loop (:py:meth:`async_do`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+
+    def in_flight(self, key):
+        """
+        :param key: The key
+        :return: True if there is a call bound to the key in flight
+        """
+        with self._lock:
+            return key in self._calls or key in self._futures
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Run func unless there is already a call bound to the key in flight,
+        in which case wait for that call to finish and use its outcome.
+        If the call raised an exception that exception is raised to all
+        callers.
+
+        :param key: The key
+        :param func: A callable
+        :param args: Positional arguments to func
+        :param kwargs: Keyword arguments to func
+        :return: What func returned
+        """
+        with self._lock:
+            _call = self._calls.get(key)
+            if _call is None:
+                _call = _Call()
+                self._calls[key] = _call
+                _leader = True
+            else:
+                _leader = False
+
+        if not _leader:
+            LOGGER.debug('Waiting for call in flight for: %s', key)
+            _call.done.wait()
+            if _call.error is not None:
+                raise _call.error
+            return _call.result
+
+        try:
+            _call.result = func(*args, **kwargs)
+        except Exception as err:
+            _call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            _call.done.set()
+
+        return _call.result
+
+    async def async_do(self, key, func, *args, **kwargs):
+        """
+        The coroutine version of :py:meth:`do`. func should be a coroutine
+        function.
+
+        :param key: The key
+        :param func: A coroutine function
+        :param args: Positional arguments to func
+        :param kwargs: Keyword arguments to func
+        :return: What func returned
+        """
+        with self._lock:
+            _fut = self._futures.get(key)
+            if _fut is None:
+                _fut = asyncio.get_running_loop().create_future()
+                self._futures[key] = _fut
+                _leader = True
+            else:
+                _leader = False
+
+        if not _leader:
+            LOGGER.debug('Waiting for call in flight for: %s', key)
+            # shield so a cancelled waiter doesn't cancel the shared call
+            return await asyncio.shield(_fut)
+
+        try:
+            _res = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            _fut.cancel()
+            raise
+        except Exception as err:
+            _fut.set_exception(err)
+            # Nobody may be waiting, don't complain about it.
+            _fut.exception()
+            raise
+        else:
+            _fut.set_result(_res)
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+        return _res
@@ -111,6 +111,28 @@ class StateInterface:
 
         self.state_db[key] = _state.to_json()
 
+    def store_items(self, items, key):
+        """
+        Store a number of items in one write to the state database.
+
+        :param items: A dictionary with item types as keys and items as
+            values.
+        :param key: The key under which the information should be stored in
+            the state database
+        """
+        try:
+            _state = self.get_state(key)
+        except KeyError:
+            _state = State()
+
+        for item_type, item in items.items():
+            try:
+                _state[item_type] = item.to_json()
+            except AttributeError:
+                _state[item_type] = item
+
+        self.state_db[key] = _state.to_json()
+
     def get_iss(self, key):
         """
         Get the Issuer ID
@@ -0,0 +1,191 @@
+"""
+Keeps track of when access tokens expire and refreshes them before they do.
+"""
+import logging
+import random
+
+from oidcmsg.message import Message
+from oidcmsg.oauth2 import is_error_message
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.exception import TokenError
+from oidcservice.scheduler import RefreshScheduler
+from oidcservice.single_flight import SingleFlight
+
+LOGGER = logging.getLogger(__name__)
+
+# The places in the state where an access token can be found. If more than
+# one of them carries an access token, the later one is the most recent.
+TOKEN_ITEMS = ['auth_response', 'token_response', 'refresh_token_response']
+
+
+class TokenManager(RefreshScheduler):
+    """
+    Keeps track of when access tokens have to be refreshed and refreshes
+    them, using the refresh_token service, in a pool of worker threads ahead
+    of expiry.
+    """
+    thread_name = 'token-manager'
+
+    def __init__(self, service, httpc=None, lead_time=60, jitter=10,
+                 max_workers=4, single_flight=None):
+        """
+        :param service: The refresh_token service instance. For client
+            credentials this is the CC refresh_token service and the state
+            key is 'cc'.
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`.
+        :param lead_time: How many seconds before expiry a token should be
+            refreshed.
+        :param jitter: Upper bound, in seconds, of a random amount of time
+            that is subtracted from the refresh time. Spreads the refreshes
+            of tokens that were issued at the same time.
+        :param max_workers: Size of the worker pool that does the refreshing.
+        :param single_flight: A :py:class:`oidcservice.single_flight.SingleFlight`
+            instance. Managers that share state keys should share this.
+        """
+        RefreshScheduler.__init__(self, max_workers=max_workers)
+        self.service = service
+        self.httpc = httpc
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.single_flight = single_flight or SingleFlight()
+
+    def token_info(self, state):
+        """
+        Find the most recent access token bound to a state.
+
+        :param state: Key to the state
+        :return: A :py:class:`oidcmsg.message.Message` instance with at least
+            an 'access_token' parameter or None if there is no access token.
+        """
+        _state = self.service.get_state(state)
+        _info = None
+        for typ in TOKEN_ITEMS:
+            try:
+                _item = Message(**_state[typ])
+            except KeyError:
+                continue
+            if 'access_token' in _item:
+                _info = _item
+        return _info
+
+    def expires_at(self, state):
+        """
+        :param state: Key to the state
+        :return: When the access token expires, 0 if unknown.
+        """
+        _info = self.token_info(state)
+        if _info is None:
+            return 0
+        return _info.get('__expires_at', 0)
+
+    def refresh_time(self, expires_at):
+        """
+        When a token that expires at a specific time should be refreshed.
+
+        :param expires_at: Expiration time as seconds since epoch
+        :return: Refresh time as seconds since epoch
+        """
+        _jitter = random.uniform(0, self.jitter) if self.jitter else 0
+        return expires_at - self.lead_time - _jitter
+
+    def track(self, state):
+        """
+        Start keeping track of the access token bound to a state.
+        Tokens without a known expiration time are not tracked.
+
+        :param state: Key to the state
+        :return: The time the token will be refreshed or 0 if not tracked.
+        """
+        _exp = self.expires_at(state)
+        if not _exp:
+            return 0
+
+        _when = self.refresh_time(_exp)
+        self.schedule(state, _when)
+        return _when
+
+    def untrack(self, state):
+        """
+        Stop keeping track of the access token bound to a state.
+
+        :param state: Key to the state
+        """
+        self.unschedule(state)
+
+    def refresh(self, state, **kwargs):
+        """
+        Refresh the access token bound to a state. If successful the new
+        token is tracked.
+        Concurrent refreshes of the same state are coalesced into one request,
+        the other callers get the response to that request.
+
+        :param state: Key to the state
+        :param kwargs: Extra keyword arguments passed on to the service
+        :return: The response from the token endpoint
+        """
+        return self.single_flight.do(state, self._do_refresh, state, **kwargs)
+
+    def _do_refresh(self, state, **kwargs):
+        LOGGER.debug('Refreshing access token for state: %s', state)
+        _resp = self.service.do_request(self.httpc, state=state, **kwargs)
+        if is_error_message(_resp):
+            LOGGER.warning('Failed to refresh access token for state %s: %s',
+                           state, _resp.to_dict())
+        else:
+            self.track(state)
+        return _resp
+
+    def _refresh_expired(self, state):
+        # Another caller may have refreshed the token while this one was
+        # finding out that it had expired.
+        _info = self.token_info(state)
+        if _info is None:
+            raise KeyError('No access token bound to state: {}'.format(state))
+        _exp = _info.get('__expires_at', 0)
+        if _exp > time_sans_frac() + self.service.service_context.clock_skew:
+            return _info
+        return self._do_refresh(state)
+
+    def refresh_due(self, state):
+        """
+        Refresh an access token that is due to be refreshed.
+
+        :param state: Key to the state
+        :return: The response from the token endpoint
+        """
+        try:
+            return self.refresh(state)
+        except Exception as err:
+            LOGGER.error('Error while refreshing access token for state %s: %s',
+                         state, err)
+            raise
+
+    def get_valid_access_token(self, state):
+        """
+        Return an access token bound to the state that has not expired.
+        If the token has expired, or is about to, it is refreshed first.
+
+        :param state: Key to the state
+        :return: An access token
+        """
+        _info = self.token_info(state)
+        if _info is None:
+            raise KeyError('No access token bound to state: {}'.format(state))
+
+        _exp = _info.get('__expires_at', 0)
+        if not _exp:
+            return _info['access_token']
+
+        if _exp > time_sans_frac() + self.service.service_context.clock_skew:
+            if not self.is_scheduled(state):
+                self.track(state)
+            return _info['access_token']
+
+        self.untrack(state)
+        _resp = self.single_flight.do(state, self._refresh_expired, state)
+        if is_error_message(_resp):
+            raise TokenError(
+                'Could not refresh access token for state: {}'.format(state))
+        return _resp['access_token']
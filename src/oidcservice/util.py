@@ -1,10 +1,13 @@
 """Utilities"""
+import hashlib
 import importlib
+import json
 import logging
 from urllib.parse import parse_qs, urlsplit, urlunsplit
 
 import yaml
 from oidcmsg.exception import UnSupported
+from oidcmsg.message import Message
 
 LOGGER = logging.getLogger(__name__)
 
@@ -13,6 +16,7 @@ __author__ = 'roland'
 URL_ENCODED = 'application/x-www-form-urlencoded'
 JSON_ENCODED = "application/json"
 JOSE_ENCODED = "application/jose"
+JWT_ENCODED = "application/jwt"
 
 
 def get_http_url(url, req, method='GET'):
@@ -64,6 +68,82 @@ def get_http_body(req, content_type=URL_ENCODED):
         "Unsupported content type: '%s'" % content_type)
 
 
+def get_header(headers, name, default=''):
+    """
+    Case insensitive lookup of a HTTP header.
+
+    :param headers: The headers as a dictionary
+    :param name: Name of the header
+    :param default: What to return if the header is missing
+    :return: The header value
+    """
+    if not headers:
+        return default
+
+    try:
+        return headers[name]
+    except KeyError:
+        pass
+
+    _name = name.lower()
+    for key, val in headers.items():
+        if key.lower() == _name:
+            return val
+    return default
+
+
+def alias_issuer(keyjar, issuer_id, alias):
+    """
+    Make the keys of one issuer available under another issuer ID as well.
+    The key bundles are shared, not copied, so no keys are serialized or
+    parsed. With an in-memory key jar a change to a bundle is seen under
+    both IDs. A key jar backed by storage keeps a copy under each ID.
+
+    :param keyjar: A :py:class:`cryptojwt.key_jar.KeyJar` instance
+    :param issuer_id: The issuer ID the keys are bound to
+    :param alias: The other issuer ID
+    :return: The key issuer bound to the alias or None if there were no
+        keys to share.
+    """
+    if issuer_id not in keyjar:
+        return None
+
+    _bundles = keyjar[issuer_id].get_bundles()
+    if not _bundles:
+        return None
+
+    _alias = keyjar.return_issuer(alias)
+    _present = _alias.get_bundles()
+    for _bundle in _bundles:
+        if not any(_bundle is kb or not _bundle.difference(kb)
+                   for kb in _present):
+            _alias.add_kb(_bundle)
+    # A key jar backed by storage hands out copies, write the issuer back
+    keyjar[alias] = _alias
+    return _alias
+
+
+def get_deserialization_method(reqresp):
+    """
+    Map the content type of a HTTP response onto a deserialization method.
+
+    :param reqresp: A HTTP response instance with a headers attribute
+    :return: The deserialization method or '' if it could not be decided.
+    """
+    _ctype = get_header(reqresp.headers, 'content-type')
+    if not _ctype:
+        return ''
+
+    if JSON_ENCODED in _ctype:
+        return 'json'
+    if JWT_ENCODED in _ctype or JOSE_ENCODED in _ctype:
+        return 'jwt'
+    if URL_ENCODED in _ctype:
+        return 'urlencoded'
+
+    return ''
+
+
 def load_yaml_config(filename):
     """Load a YAML configuration file."""
     with open(filename, "rt", encoding='utf-8') as file:
@@ -91,3 +171,18 @@ def importer(name):
     _part = modsplit(name)
     module = importlib.import_module(_part[0])
     return getattr(module, _part[1])
+
+
+def content_digest(content):
+    """
+    A digest over a message or dictionary that doesn't depend on the order
+    of the claims.
+
+    :param content: A :py:class:`oidcmsg.message.Message` instance or a
+        dictionary
+    :return: A hex digest
+    """
+    if isinstance(content, Message):
+        content = content.to_dict()
+    _json = json.dumps(content, sort_keys=True)
+    return hashlib.sha256(_json.encode('utf-8')).hexdigest()
@@ -0,0 +1,303 @@
+"""
+Warm-start snapshots of a service context. A snapshot contains the
+information an RP has collected about an OP: provider info, client
+registration and the OP's keys. Loading a snapshot at startup means the RP
+doesn't have to redo discovery, registration and key fetching before it can
+serve a login.
+
+The registration information includes the client secret and the
+registration access token. It's only put in a snapshot if asked for and is
+then written to disc in plaintext, so the snapshot directory must be
+protected accordingly.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from cryptojwt.key_issuer import KeyIssuer
+from oidcmsg.oauth2 import is_error_message
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.service import ServiceDict
+from oidcservice.util import content_digest
+
+LOGGER = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Items in the service context that are part of a snapshot
+CONTEXT_ITEMS = ['issuer', 'provider_info', 'behaviour']
+
+# Items in the service context that comes from client registration
+REGISTRATION_ITEMS = ['registration_response', 'client_id', 'client_secret',
+                      'client_secret_expires_at', 'registration_access_token']
+
+
+def export_snapshot(service_context, now=0, include_registration=False):
+    """
+    Collect the information that should go into a snapshot.
+
+    :param service_context: A
+        :py:class:`oidcservice.service_context.ServiceContext` instance
+    :param now: Current time, seconds since epoch
+    :param include_registration: Whether the registration information,
+        secrets included, should be part of the snapshot.
+    :return: The snapshot as a dictionary
+    """
+    _issuer = service_context.get('issuer')
+    _items = CONTEXT_ITEMS
+    if include_registration:
+        _items = CONTEXT_ITEMS + REGISTRATION_ITEMS
+
+    _context = {}
+    for _item in _items:
+        _val = service_context.get(_item)
+        if _val:
+            _context[_item] = _val
+
+    # Only the keys that were fetched from the OP, not the RP's own keys
+    _keys = {}
+    _provider_issuer = service_context.get('provider_info', {}).get('issuer',
+                                                                    _issuer)
+    for _id in {_issuer, _provider_issuer}:
+        if _id and _id in service_context.keyjar:
+            _keys[_id] = service_context.keyjar[_id].dump()
+
+    return {
+        'version': SNAPSHOT_VERSION,
+        'issuer': _issuer,
+        'created_at': now or time_sans_frac(),
+        'context': _context,
+        'keys': _keys
+    }
+
+
+def _set_endpoints(services, provider_info):
+    if not isinstance(services, ServiceDict):
+        services = ServiceDict(services)
+    services.set_endpoints(provider_info)
+
+
+def _import_registration(service_context, services, context):
+    _reg_resp = context.get('registration_response')
+    if _reg_resp and 'registration' in services:
+        services['registration'].update_service_context(_reg_resp)
+        return
+
+    for _item in REGISTRATION_ITEMS:
+        if _item in context:
+            service_context.set(_item, context[_item])
+
+    _client_secret = context.get('client_secret')
+    if _client_secret:
+        service_context.keyjar.add_symmetric('', _client_secret)
+        if context.get('client_id'):
+            service_context.keyjar.add_symmetric(context['client_id'],
+                                                 _client_secret)
+
+
+def import_snapshot(service_context, snapshot, services=None, max_age=0,
+                    now=0):
+    """
+    Load a snapshot into a service context.
+
+    A snapshot isn't used if it's of another version, for another issuer or
+    older than max_age. If the client secret has expired the registration
+    information isn't loaded.
+
+    :param service_context: A
+        :py:class:`oidcservice.service_context.ServiceContext` instance
+    :param snapshot: The snapshot as a dictionary
+    :param services: The services that belong to the service context. If
+        given the service endpoints are set from the provider info.
+    :param max_age: Max age of the snapshot in seconds, 0 means no limit.
+    :param now: Current time, seconds since epoch
+    :return: True if the snapshot was loaded otherwise False
+    """
+    if not now:
+        now = time_sans_frac()
+
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        LOGGER.info('Snapshot of unknown version: %s', snapshot.get('version'))
+        return False
+
+    _issuer = service_context.get('issuer')
+    if _issuer and snapshot.get('issuer') != _issuer:
+        LOGGER.warning('Snapshot for another issuer: %s != %s',
+                       snapshot.get('issuer'), _issuer)
+        return False
+
+    if max_age and snapshot.get('created_at', 0) + max_age < now:
+        LOGGER.info('Snapshot for %s too old', snapshot.get('issuer'))
+        return False
+
+    if services is None:
+        services = getattr(service_context, 'service', None) or {}
+
+    _context = snapshot.get('context', {})
+    for _item in CONTEXT_ITEMS:
+        if _item in _context:
+            service_context.set(_item, _context[_item])
+
+    _expires_at = _context.get('client_secret_expires_at', 0)
+    if _expires_at and _expires_at <= now:
+        LOGGER.info('Client secret has expired, not using registration '
+                    'information for %s', snapshot.get('issuer'))
+    else:
+        _import_registration(service_context, services, _context)
+
+    _keyjar = service_context.keyjar
+    for _id, _desc in snapshot.get('keys', {}).items():
+        _key_issuer = KeyIssuer(httpc=_keyjar.httpc,
+                                httpc_params=_keyjar.httpc_params).load(_desc)
+        for _bundle in _key_issuer:
+            _bundle.httpc = _keyjar.httpc
+        _keyjar[_id] = _key_issuer
+
+    if 'provider_info' in _context:
+        _set_endpoints(services, _context['provider_info'])
+    return True
+
+
+class SnapshotStore:
+    """
+    Keeps snapshots as gzipped JSON documents in a directory, one file
+    per issuer. The files are only readable by the owner.
+    """
+
+    def __init__(self, snapshot_dir, max_age=86400, include_registration=False):
+        """
+        :param snapshot_dir: Directory where the snapshots are kept
+        :param max_age: Snapshots older than this many seconds are not used.
+        :param include_registration: Whether the registration information,
+            among it the client secret and the registration access token,
+            should be saved. It's saved unencrypted.
+        """
+        self.snapshot_dir = snapshot_dir
+        if not os.path.isdir(snapshot_dir):
+            os.makedirs(snapshot_dir, mode=0o700, exist_ok=True)
+        self.max_age = max_age
+        self.include_registration = include_registration
+
+    def filename(self, issuer):
+        """
+        :param issuer: Issuer ID
+        :return: The name of the file where the snapshot for an issuer is kept
+        """
+        _name = hashlib.sha256(issuer.encode('utf-8')).hexdigest()
+        return os.path.join(self.snapshot_dir, '{}.json.gz'.format(_name))
+
+    def save(self, service_context, now=0):
+        """
+        Write a snapshot of a service context to disc. The file is replaced
+        atomically so a reader never sees half a snapshot.
+
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        :param now: Current time, seconds since epoch
+        :return: The name of the file
+        """
+        _snapshot = export_snapshot(service_context, now,
+                                    self.include_registration)
+        _data = json.dumps(_snapshot, separators=(',', ':')).encode('utf-8')
+
+        _filename = self.filename(_snapshot['issuer'])
+        _fd, _tmp = tempfile.mkstemp(dir=self.snapshot_dir)
+        try:
+            with os.fdopen(_fd, 'wb') as _fp:
+                _fp.write(gzip.compress(_data))
+            os.replace(_tmp, _filename)
+        except Exception:
+            os.unlink(_tmp)
+            raise
+        return _filename
+
+    def read(self, issuer):
+        """
+        :param issuer: Issuer ID
+        :return: The snapshot as a dictionary or None if there is none or
+            it couldn't be read.
+        """
+        try:
+            with gzip.open(self.filename(issuer), 'rb') as _fp:
+                return json.loads(_fp.read().decode('utf-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            LOGGER.warning('Could not read snapshot for %s: %s', issuer, err)
+            return None
+
+    def load(self, service_context, services=None, issuer='', now=0):
+        """
+        Load the snapshot for an issuer into a service context.
+
+        :param service_context: A
+            :py:class:`oidcservice.service_context.ServiceContext` instance
+        :param services: The services that belong to the service context.
+        :param issuer: Issuer ID, default is the issuer of the service context
+        :param now: Current time, seconds since epoch
+        :return: True if a snapshot was loaded otherwise False
+        """
+        _snapshot = self.read(issuer or service_context.get('issuer'))
+        if _snapshot is None:
+            return False
+        return import_snapshot(service_context, _snapshot, services=services,
+                               max_age=self.max_age, now=now)
+
+    def revalidate(self, services, httpc=None):
+        """
+        Check that the loaded information is still valid. The provider info
+        is fetched again and applied to the service context if it has
+        changed, the OP's keys are reloaded and a new snapshot is written.
+
+        :param services: The services that belong to the service context.
+        :param httpc: A HTTP client with the same signature as
+            :py:func:`requests.request`. Default is the service context's
+            :py:class:`oidcservice.http_transport.HTTPTransport`.
+        :return: True if the provider info had changed
+        """
+        _srv = services['provider_info']
+        _context = _srv.service_context
+        if httpc is None:
+            httpc = _context.get_http_transport()
+        _changed = False
+
+        _info = _srv.get_request_parameters()
+        _resp = _srv.parse_request_response(
+            httpc(_info['method'], _info['url'], headers=_info.get('headers')))
+        if not is_error_message(_resp):
+            if content_digest(_resp) != content_digest(
+                    _context.get('provider_info', {})):
+                LOGGER.info('Provider info for %s has changed',
+                            _context.get('issuer'))
+                _srv.update_service_context(_resp)
+                _set_endpoints(services, _resp)
+                _changed = True
+
+        _issuer = _context.get('issuer')
+        if _issuer in _context.keyjar:
+            _context.keyjar[_issuer].update()
+
+        self.save(_context)
+        return _changed
+
+    def revalidate_in_background(self, services, httpc=None):
+        """
+        Run :py:meth:`revalidate` in a separate thread.
+
+        :return: The thread
+        """
+
+        def _revalidate():
+            try:
+                self.revalidate(services, httpc)
+            except Exception as err:
+                LOGGER.warning('Revalidation of snapshot failed: %s', err)
+
+        _thread = threading.Thread(target=_revalidate, daemon=True)
+        _thread.start()
+        return _thread
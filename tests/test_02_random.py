@@ -0,0 +1,41 @@
+import os
+from collections import Counter
+
+from oidcservice import BASECH, BASECHR, random_string, rndstr, unreserved
+
+
+def test_rndstr():
+    assert len(rndstr()) == 16
+    _str = rndstr(1000)
+    assert len(_str) == 1000
+    assert set(_str) <= set(BASECHR)
+    assert rndstr(32) != rndstr(32)
+    assert rndstr(0) == ''
+
+
+def test_unreserved():
+    _str = unreserved(1000)
+    assert len(_str) == 1000
+    assert set(_str) <= set(BASECH)
+    # Larger than the buffer
+    assert len(unreserved(10000)) == 10000
+
+
+def test_uniform():
+    # 256 isn't a multiple of 3, without rejection sampling 'a' would be
+    # chosen more often than the others.
+    _count = Counter(random_string(30000, 'abc'))
+    assert set(_count) == {'a', 'b', 'c'}
+    for _char in 'abc':
+        assert 9000 < _count[_char] < 11000
+
+
+def test_fork():
+    rndstr(32)
+    _read, _write = os.pipe()
+    _pid = os.fork()
+    if _pid == 0:
+        os.write(_write, rndstr(32).encode('ascii'))
+        os._exit(0)
+    os.waitpid(_pid, 0)
+    assert os.read(_read, 32).decode('ascii') != rndstr(32)
@@ -1,7 +1,9 @@
 import json
 from urllib.parse import parse_qs, urlsplit
 
+from cryptojwt.key_jar import KeyJar, build_keyjar
 from oidcmsg.oauth2 import AccessTokenRequest, AuthorizationRequest
+from oidcmsg.storage.init import storage_factory
 
 from oidcservice import util
 from oidcservice.util import JSON_ENCODED, URL_ENCODED
@@ -92,3 +94,42 @@ def test_get_http_url_with_qp():
     assert set(_req.keys()) == {'acr_values', 'state', 'redirect_uri',
                                 'response_type', 'client_id', 'scope',
                                 'test'}
+
+
+def test_alias_issuer():
+    keyjar = build_keyjar([{"type": "RSA", "use": ["sig"]}])
+    _issuer = util.alias_issuer(keyjar, '', 'client_id')
+    assert _issuer.get_bundles()[0] is keyjar[''].get_bundles()[0]
+    assert keyjar.get_signing_key('RSA', issuer_id='client_id')
+
+    # Aliasing again doesn't add the bundles twice
+    util.alias_issuer(keyjar, '', 'client_id')
+    assert len(keyjar['client_id'].get_bundles()) == 1
+
+    # Keys added later to one of the IDs are only bound to that ID
+    keyjar.add_symmetric('client_id', 'a longesh client secret')
+    assert len(keyjar[''].get_bundles()) == 1
+
+    assert util.alias_issuer(keyjar, 'unknown', 'other') is None
+    assert 'other' not in keyjar
+
+
+def test_alias_issuer_storage(tmpdir):
+    _conf = {
+        'handler': 'oidcmsg.storage.abfile.LabeledAbstractFileSystem',
+        'fdir': str(tmpdir.join('keyjar')),
+        'key_conv': 'oidcmsg.storage.converter.QPKey',
+        'value_conv': 'cryptojwt.serialize.item.KeyIssuer',
+        'label': 'keyjar'
+    }
+    keyjar = KeyJar(storage=storage_factory(_conf))
+    keyjar.add_kb('', build_keyjar([{"type": "RSA", "use": ["sig"]}])[''][0])
+    util.alias_issuer(keyjar, '', 'client_id')
+
+    # Read back from storage
+    keyjar = KeyJar(storage=storage_factory(_conf))
+    assert keyjar.get_signing_key('RSA', issuer_id='client_id')
+
+    util.alias_issuer(keyjar, '', 'client_id')
+    keyjar = KeyJar(storage=storage_factory(_conf))
+    assert len(keyjar['client_id'].get_bundles()) == 1
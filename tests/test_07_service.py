@@ -2,7 +2,9 @@ import pytest
 from oidcmsg.oauth2 import (SINGLE_OPTIONAL_INT, SINGLE_OPTIONAL_STRING,
                             SINGLE_REQUIRED_STRING, Message)
 
-from oidcservice.service import Service
+from oidcservice.exception import ResponseError
+from oidcservice.oidc import DEFAULT_SERVICES
+from oidcservice.service import Service, ServiceDict, init_services
 from oidcservice.service_context import ServiceContext
 from oidcservice.state_interface import InMemoryStateDataBase, State
 
@@ -64,6 +66,35 @@ class TestDummyService(object):
             self.service.get_urlinfo(_info['url']))
         assert msg.to_dict() == {'foo': 'bar', 'req_str': 'some string'}
 
+    def test_parse_request_response(self):
+        _resp = Response(200, '{"req_str": "some string"}',
+                         {'content-type': 'application/json'})
+        self.service.response_cls = DummyMessage
+        _msg = self.service.parse_request_response(_resp)
+        assert _msg.to_dict() == {'req_str': 'some string'}
+
+    def test_parse_request_response_error(self):
+        _resp = Response(400, '{"error": "invalid_request"}',
+                         {'content-type': 'application/json'})
+        _msg = self.service.parse_request_response(_resp)
+        assert _msg['error'] == 'invalid_request'
+
+        with pytest.raises(ResponseError):
+            self.service.parse_request_response(Response(500, 'Oops'))
+
+    def test_do_request(self):
+        def httpc(method, url, data=None, headers=None):
+            assert method == 'GET'
+            assert url.startswith('https://example.com/authorize?')
+            return Response(200, '{"req_str": "some string"}',
+                            {'content-type': 'application/json'})
+
+        self.service.endpoint = 'https://example.com/authorize'
+        self.service.response_cls = DummyMessage
+        _msg = self.service.do_request(
+            httpc, request_args={'foo': 'bar', 'req_str': 'some string'})
+        assert _msg.to_dict() == {'req_str': 'some string'}
+
 
 class TestRequest(object):
     @pytest.fixture(autouse=True)
@@ -76,3 +107,38 @@ class TestRequest(object):
         _req = self.service.construct(request_args=req_args)
         assert isinstance(_req, Message)
         assert list(_req.keys()) == ['foo']
+
+
+class TestServiceDict(object):
+    @pytest.fixture(autouse=True)
+    def create_services(self):
+        service_context = ServiceContext(config={'issuer': 'https://example.com'})
+        self.services = init_services(DEFAULT_SERVICES, service_context)
+        service_context.service = self.services
+
+    def test_endpoint_index(self):
+        assert isinstance(self.services, ServiceDict)
+        assert {s.service_name for s in self.services.services_for_endpoint(
+            'token')} == {'accesstoken', 'refresh_token'}
+        assert self.services.services_for_endpoint('userinfo_endpoint') == [
+            self.services['userinfo']]
+        assert self.services.services_for_endpoint('foo') == []
+
+        _srv = self.services.pop('userinfo')
+        assert self.services.services_for_endpoint('userinfo') == []
+        self.services['userinfo'] = _srv
+        assert self.services.services_for_endpoint('userinfo') == [_srv]
+
+    def test_set_endpoints(self):
+        self.services['provider_info'].update_service_context({
+            'issuer': 'https://example.com',
+            'token_endpoint': 'https://example.com/token',
+            'userinfo_endpoint': 'https://example.com/userinfo',
+            'version': '3.0'})
+        assert self.services['accesstoken'].endpoint == \
+               'https://example.com/token'
+        assert self.services['refresh_token'].endpoint == \
+               'https://example.com/token'
+        assert self.services['userinfo'].endpoint == \
+               'https://example.com/userinfo'
+        assert self.services['registration'].endpoint == ''
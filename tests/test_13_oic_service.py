@@ -16,6 +16,7 @@ from oidcmsg.oidc.session import (CheckIDRequest, CheckSessionRequest,
                                   EndSessionRequest)
 
 from oidcservice.exception import ParameterError
+from oidcservice.oidc.provider_info_discovery import PreferenceMatchCache
 from oidcservice.oidc.registration import (add_jwks_uri_or_jwks,
                                            response_types_to_grant_types)
 from oidcservice.service_context import ServiceContext
@@ -546,6 +547,63 @@ class TestProviderInfo(object):
             'scope': ['openid', 'profile', 'email', 'address', 'phone']
         }
 
+    def test_match_preferences_cached(self, monkeypatch):
+        _pcr = {
+            'issuer': ISS,
+            'token_endpoint_auth_methods_supported': ['client_secret_basic'],
+            'response_types_supported': ['code', 'id_token']
+        }
+        _calls = []
+        _cls = type(self.service)
+        _match = _cls._match_preferences
+
+        def _counting_match(*args):
+            _calls.append(1)
+            return _match(*args)
+
+        monkeypatch.setattr(_cls, '_match_preferences',
+                            staticmethod(_counting_match))
+        _cache = PreferenceMatchCache()
+        self.service.match_cache = _cache
+
+        _context = self.service.service_context
+        self.service.match_preferences(_pcr)
+        _behaviour = _context.get('behaviour')
+        assert _behaviour['response_types'] == ['code']
+
+        # Another tenant with the same preferences
+        _context2 = ServiceContext(config={
+            'issuer': ISS,
+            'client_preferences': _context.client_preferences})
+        _srv2 = service_factory('ProviderInfoDiscovery', ['oidc'],
+                                service_context=_context2,
+                                conf={'match_cache': _cache})
+        _context2.set('behaviour', {})
+        _srv2.match_preferences(_pcr)
+        assert _context2.get('behaviour') == _behaviour
+        assert len(_calls) == 1
+
+        # Not shared with a service that has a cache of its own
+        _srv3 = service_factory('ProviderInfoDiscovery', ['oidc'],
+                                service_context=ServiceContext(config={
+                                    'issuer': ISS,
+                                    'client_preferences':
+                                        _context.client_preferences}))
+        _srv3.service_context.set('behaviour', {})
+        _srv3.match_preferences(_pcr)
+        assert len(_calls) == 2
+
+        # Results are not shared objects
+        _context2.get('behaviour')['scope'].append('foo')
+        assert 'foo' not in _behaviour['scope']
+
+        _pcr['response_types_supported'] = ['id_token']
+        _srv2.service_context.set('behaviour', {})
+        _context2.client_preferences['response_types'] = ['id_token']
+        _srv2.match_preferences(_pcr)
+        assert _context2.get('behaviour')['response_types'] == ['id_token']
+        assert len(_calls) == 3
+
 
 def test_response_types_to_grant_types():
     req_args = ['code']
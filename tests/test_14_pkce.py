@@ -1,4 +1,7 @@
+import base64
+import hashlib
 import os
+import time
 
 import pytest
 from cryptojwt.key_jar import init_key_jar
@@ -6,9 +9,11 @@ from oidcmsg.message import SINGLE_REQUIRED_STRING, Message
 from oidcmsg.oauth2 import AuthorizationResponse
 
 from oidcservice.client_auth import factory as ca_factory
+from oidcservice.exception import Unsupported
 from oidcservice.oauth2 import DEFAULT_SERVICES
 from oidcservice.oidc.add_on import do_add_ons
-from oidcservice.oidc.add_on.pkce import add_code_challenge, add_code_verifier
+from oidcservice.oidc.add_on.pkce import (PKCEPool, add_code_challenge,
+                                          add_code_verifier)
 from oidcservice.service import Service, init_services
 from oidcservice.service_context import ServiceContext
 from oidcservice.state_interface import InMemoryStateDataBase, State
@@ -144,3 +149,75 @@ class TestPKCE384:
 
         request_args = add_code_verifier({}, auth_serv, state='state')
         assert len(request_args['code_verifier']) == 128
+
+
+class CountingStateDataBase(InMemoryStateDataBase):
+    def __init__(self):
+        InMemoryStateDataBase.__init__(self)
+        self.writes = []
+
+    def __setitem__(self, key, value):
+        self.writes.append(key)
+        InMemoryStateDataBase.__setitem__(self, key, value)
+
+
+class TestPKCEPool:
+    def test_pool(self):
+        _pool = PKCEPool(length=64, method='S256', size=8)
+        for _ in range(100):
+            if len(_pool) == 8:
+                break
+            time.sleep(0.01)
+        assert len(_pool) == 8
+
+        _verifier, _challenge, _method = _pool.get()
+        assert len(_verifier) == 64
+        assert _method == 'S256'
+        _hash = hashlib.sha256(_verifier.encode()).digest()
+        assert _challenge == base64.urlsafe_b64encode(_hash).decode(
+            'ascii').rstrip('=')
+
+    def test_empty_pool(self):
+        _pool = PKCEPool(length=43, method='S512', size=2, low_water=1)
+        _values = [_pool.get() for _ in range(10)]
+        assert len({v[0] for v in _values}) == 10
+        assert {len(v[0]) for v in _values} == {43}
+
+    def test_unsupported_method(self):
+        with pytest.raises(Unsupported):
+            PKCEPool(method='S1')
+
+    def test_authorization_with_pool(self):
+        config = {
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'behaviour': {'response_types': ['code']},
+            'add_ons': {
+                "pkce": {
+                    "function": "oidcservice.oidc.add_on.pkce.add_pkce_support",
+                    "kwargs": {
+                        "code_challenge_length": 64,
+                        "code_challenge_method": "S256",
+                        "pool_size": 16
+                    }
+                }
+            }
+        }
+        _state_db = CountingStateDataBase()
+        service_context = ServiceContext(CLI_KEY, client_id='client_id',
+                                         issuer='https://www.example.org/as',
+                                         config=config, state_db=_state_db)
+        services = init_services(DEFAULT_SERVICES, service_context, ca_factory)
+        do_add_ons(config['add_ons'], services)
+        assert isinstance(service_context.add_on['pkce']['pool'], PKCEPool)
+
+        request = services['authorization'].construct_request(
+            {"state": 'state', "response_type": "code"})
+        # The authorization request and the PKCE information in one write
+        assert _state_db.writes == ['state']
+
+        _verifier = services['authorization'].get_item(Message, 'pkce',
+                                                       'state')['code_verifier']
+        _hash = hashlib.sha256(_verifier.encode()).digest()
+        assert request['code_challenge'] == base64.urlsafe_b64encode(
+            _hash).decode('ascii').rstrip('=')
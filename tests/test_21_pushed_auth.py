@@ -1,13 +1,19 @@
+import asyncio
 import json
 import os
+from urllib.parse import parse_qs
 
 import pytest
 import responses
 from cryptojwt.key_jar import init_key_jar
+from oidcmsg.message import Message
 
+from oidcservice.async_service import AsyncTransport, HTTPResponse
 from oidcservice.client_auth import factory as ca_factory
+from oidcservice.exception import OidcServiceError
 from oidcservice.oauth2 import DEFAULT_SERVICES
 from oidcservice.oidc.add_on import do_add_ons
+from oidcservice.oidc.add_on.pushed_authorization import PushedAuthorization
 from oidcservice.service import init_services
 from oidcservice.service_context import ServiceContext
 from oidcservice.state_interface import InMemoryStateDataBase
@@ -40,7 +46,7 @@ class TestPushedAuth:
                         ".add_pushed_authorization_support",
                     "kwargs": {
                         "body_format": "jws",
-                        "signing_algorthm": "RS256",
+                        "signing_algorithm": "RS256",
                         "http_client": None,
                         "merge_rule": "lax"
                     }
@@ -71,7 +77,7 @@ class TestPushedAuth:
                 "request_uri": "urn:example:bwc4JK-ESC0w8acc191e-Y1LTC2",
                 "expires_in": 3600
             }
-            rsps.add("GET",
+            rsps.add("POST",
                      auth_service.service_context.get('provider_info')[
                          "pushed_authorization_request_endpoint"],
                      body=json.dumps(_resp), status=200)
@@ -79,3 +85,90 @@ class TestPushedAuth:
             _req = auth_service.construct(request_args=req_args, state='state')
 
         assert set(_req.keys()) == {"request_uri", "response_type", "client_id"}
+
+    def _par_response(self, rsps, request_uri='urn:example:1', status=201):
+        rsps.add("POST", "https://as.example.com/push",
+                 body=json.dumps({"request_uri": request_uri,
+                                  "expires_in": 60}),
+                 status=status, content_type='application/json')
+
+    def test_request_uri_used_once(self):
+        auth_service = self.service["authorization"]
+        req_args = {'foo': 'bar', "response_type": "code"}
+        with responses.RequestsMock() as rsps:
+            self._par_response(rsps, 'urn:example:1')
+            self._par_response(rsps, 'urn:example:2')
+            _req = auth_service.construct(request_args=req_args, state='state')
+            _req2 = auth_service.construct(request_args=req_args, state='state')
+            assert len(rsps.calls) == 2
+
+        assert _req['request_uri'] == 'urn:example:1'
+        assert _req2['request_uri'] == 'urn:example:2'
+
+    def test_reuse_request_uri(self):
+        self.service["pushed_authorization"].reuse_request_uri = True
+        auth_service = self.service["authorization"]
+        req_args = {'foo': 'bar', "response_type": "code"}
+        with responses.RequestsMock() as rsps:
+            self._par_response(rsps)
+            _req = auth_service.construct(request_args=req_args, state='state')
+            _req2 = auth_service.construct(request_args=req_args, state='state')
+            assert len(rsps.calls) == 1
+            _body = parse_qs(rsps.calls[0].request.body)
+
+        assert _req['request_uri'] == _req2['request_uri'] == 'urn:example:1'
+        assert set(_body) == {'request', 'response_type', 'client_id'}
+
+    def test_error_response(self):
+        auth_service = self.service["authorization"]
+        with responses.RequestsMock() as rsps:
+            rsps.add("POST", "https://as.example.com/push",
+                     body=json.dumps({"error": "invalid_request"}),
+                     status=400, content_type='application/json')
+            with pytest.raises(OidcServiceError):
+                auth_service.construct(request_args={"response_type": "code"},
+                                       state='state')
+
+    def test_async_push(self):
+        _par = self.service["pushed_authorization"]
+        assert isinstance(_par, PushedAuthorization)
+        auth_service = self.service["authorization"]
+        auth_service.post_construct.remove(
+            auth_service.post_construct[-1])
+        _req = auth_service.construct(request_args={"response_type": "code"},
+                                      state='state')
+        assert 'request_uri' not in _req
+
+        with responses.RequestsMock() as rsps:
+            self._par_response(rsps, 'urn:example:2')
+            _req = asyncio.run(_par.async_push(_req))
+        assert _req['request_uri'] == 'urn:example:2'
+
+    def test_async_push_transport(self):
+        class Transport(AsyncTransport):
+            calls = []
+
+            async def request(self, method, url, data=None, headers=None):
+                self.calls.append((method, url))
+                return HTTPResponse(201, json.dumps(
+                    {"request_uri": "urn:example:3", "expires_in": 60}),
+                    {'Content-Type': 'application/json'})
+
+        _par = self.service["pushed_authorization"]
+        _req = asyncio.run(_par.async_push(
+            Message(response_type='code', client_id='client_id'),
+            Transport()))
+        assert _req['request_uri'] == 'urn:example:3'
+        assert Transport.calls == [('POST', 'https://as.example.com/push')]
+
+    def test_urlencoded(self):
+        _par = self.service["pushed_authorization"]
+        _par.body_format = 'urlencoded'
+        auth_service = self.service["authorization"]
+        auth_service.post_construct.remove(
+            auth_service.post_construct[-1])
+        _req = auth_service.construct(request_args={"response_type": "code"},
+                                      state='state')
+        _msg = _par.construct(_req)
+        assert 'request' not in _msg
+        assert _msg.to_urlencoded() == _req.to_urlencoded()
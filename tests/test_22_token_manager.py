@@ -0,0 +1,137 @@
+import json
+import time
+
+import pytest
+import responses
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.exception import TokenError
+from oidcservice.oauth2 import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+from oidcservice.token_manager import TokenManager
+
+TOKEN_ENDPOINT = 'https://example.com/token'
+
+
+class TestTokenManager(object):
+    @pytest.fixture(autouse=True)
+    def create_manager(self):
+        client_config = {
+            'client_id': 'client_id',
+            'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'issuer': 'https://example.com'
+        }
+        service_context = ServiceContext(config=client_config)
+        self.service = init_services(DEFAULT_SERVICES, service_context)
+        self.service['refresh_token'].endpoint = TOKEN_ENDPOINT
+        self.manager = TokenManager(self.service['refresh_token'],
+                                    lead_time=60, jitter=0)
+
+    def _add_token(self, state, access_token, expires_in):
+        _srv = self.service['accesstoken']
+        _srv.create_state('https://example.com', state)
+        _srv.update_service_context({
+            'access_token': access_token,
+            'token_type': 'Bearer',
+            'expires_in': expires_in,
+            'refresh_token': 'refresh_{}'.format(access_token)
+        }, key=state)
+
+    def test_track(self):
+        self._add_token('A', 'token_a', 3600)
+        self._add_token('B', 'token_b', 600)
+        _now = time_sans_frac()
+        assert self.manager.track('A') >= _now + 3600 - 60
+        self.manager.track('B')
+        assert self.manager.next_due() <= _now + 600 - 60
+        assert self.manager.pop_due(_now) == []
+        assert self.manager.pop_due(_now + 600) == ['B']
+        assert self.manager.pop_due(_now + 3600) == ['A']
+        assert self.manager.next_due() is None
+
+    def test_untrack(self):
+        self._add_token('A', 'token_a', 3600)
+        self.manager.track('A')
+        self.manager.untrack('A')
+        assert self.manager.next_due() is None
+        assert self.manager.pop_due(time_sans_frac() + 7200) == []
+
+    def test_no_expiry_not_tracked(self):
+        self._add_token('A', 'token_a', 3600)
+        self.service['accesstoken'].store_item(
+            {'access_token': 'token_x', 'token_type': 'Bearer'},
+            'token_response', 'A')
+        assert self.manager.track('A') == 0
+
+    def test_run_pending(self):
+        self._add_token('A', 'token_a', 30)
+        self.manager.track('A')
+        with responses.RequestsMock() as rsps:
+            rsps.add('POST', TOKEN_ENDPOINT, status=200,
+                     body=json.dumps({'access_token': 'token_a2',
+                                      'token_type': 'Bearer',
+                                      'expires_in': 3600}),
+                     content_type='application/json')
+            _futures = self.manager.run_pending()
+            assert set(_futures.keys()) == {'A'}
+            _resp = _futures['A'].result()
+            _request = rsps.calls[0].request
+
+        self.manager.stop()
+        assert _resp['access_token'] == 'token_a2'
+        assert 'grant_type=refresh_token' in _request.body
+        assert _request.headers['Authorization'] == 'Bearer refresh_token_a'
+        assert self.manager.token_info('A')['access_token'] == 'token_a2'
+        # The refreshed token is tracked
+        assert self.manager.next_due() > time_sans_frac()
+
+    def test_get_valid_access_token(self):
+        self._add_token('A', 'token_a', 3600)
+        assert self.manager.get_valid_access_token('A') == 'token_a'
+        assert self.manager.next_due() is not None
+
+    def test_get_valid_access_token_expired(self):
+        self._add_token('A', 'token_a', -10)
+        with responses.RequestsMock() as rsps:
+            rsps.add('POST', TOKEN_ENDPOINT, status=200,
+                     body=json.dumps({'access_token': 'token_a2',
+                                      'token_type': 'Bearer',
+                                      'expires_in': 3600}),
+                     content_type='application/json')
+            assert self.manager.get_valid_access_token('A') == 'token_a2'
+
+    def test_get_valid_access_token_refresh_error(self):
+        self._add_token('A', 'token_a', -10)
+        with responses.RequestsMock() as rsps:
+            rsps.add('POST', TOKEN_ENDPOINT, status=400,
+                     body=json.dumps({'error': 'invalid_grant'}),
+                     content_type='application/json')
+            with pytest.raises(TokenError):
+                self.manager.get_valid_access_token('A')
+
+    def test_token_gone_before_refresh(self):
+        # The tokens are removed before the single-flight leader runs
+        self.service['accesstoken'].create_state('https://example.com', 'A')
+        with pytest.raises(KeyError):
+            self.manager._refresh_expired('A')
+
+    def test_background_refresh(self):
+        self._add_token('A', 'token_a', 30)
+        with responses.RequestsMock() as rsps:
+            rsps.add('POST', TOKEN_ENDPOINT, status=200,
+                     body=json.dumps({'access_token': 'token_a2',
+                                      'token_type': 'Bearer',
+                                      'expires_in': 3600}),
+                     content_type='application/json')
+            self.manager.start()
+            self.manager.track('A')
+            for _ in range(50):
+                if rsps.calls and self.manager.is_scheduled('A'):
+                    break
+                time.sleep(0.1)
+            self.manager.stop()
+
+        assert self.manager.token_info('A')['access_token'] == 'token_a2'
+        assert self.manager.is_scheduled('A')
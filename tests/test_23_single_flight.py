@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from MockOP import HTTPResponse
+
+from oidcservice.oauth2.client_credentials import cc_refresh_access_token
+from oidcservice.service_context import ServiceContext
+from oidcservice.single_flight import SingleFlight
+from oidcservice.token_manager import TokenManager
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def run_threads(func, num):
+    _res = [None] * num
+
+    def _run(i):
+        _res[i] = func()
+
+    _threads = [threading.Thread(target=_run, args=(i,)) for i in range(num)]
+    for _thr in _threads:
+        _thr.start()
+    for _thr in _threads:
+        _thr.join()
+    return _res
+
+
+def test_do():
+    _sf = SingleFlight()
+    _calls = []
+
+    def _func():
+        _calls.append(1)
+        time.sleep(0.2)
+        return len(_calls)
+
+    assert run_threads(lambda: _sf.do('key', _func), 5) == [1] * 5
+    assert len(_calls) == 1
+    assert not _sf.in_flight('key')
+    # Not in flight anymore so next call is a new one
+    assert _sf.do('key', _func) == 2
+
+
+def test_do_error():
+    _sf = SingleFlight()
+
+    def _func():
+        time.sleep(0.1)
+        raise ValueError('Oops')
+
+    def _call():
+        try:
+            _sf.do('key', _func)
+        except ValueError as err:
+            return str(err)
+
+    assert run_threads(_call, 3) == ['Oops'] * 3
+    assert not _sf.in_flight('key')
+
+
+def test_async_do():
+    _sf = SingleFlight()
+    _calls = []
+
+    async def _func(val):
+        _calls.append(val)
+        await asyncio.sleep(0.1)
+        return val
+
+    async def _main():
+        return await asyncio.gather(
+            _sf.async_do('a', _func, 'A'), _sf.async_do('a', _func, 'X'),
+            _sf.async_do('b', _func, 'B'))
+
+    assert asyncio.run(_main()) == ['A', 'A', 'B']
+    assert _calls == ['A', 'B']
+
+
+class TestCoalescedRefresh(object):
+    @pytest.fixture(autouse=True)
+    def create_manager(self):
+        service_context = ServiceContext(
+            config={'client_id': 'client_id', 'client_secret': 'password'})
+        self.service = cc_refresh_access_token.CCRefreshAccessToken(
+            service_context)
+        self.service.endpoint = 'https://example.com/token'
+        self.service.store_item(
+            {'access_token': 'token', 'token_type': 'Bearer',
+             'refresh_token': 'refresh', '__expires_at': 1}, 'token_response',
+            'cc')
+        self.calls = []
+        self.manager = TokenManager(self.service, httpc=self.httpc)
+
+    def httpc(self, method, url, data=None, headers=None):
+        self.calls.append(headers['Authorization'])
+        time.sleep(0.2)
+        _body = {'access_token': 'token_{}'.format(len(self.calls)),
+                 'token_type': 'Bearer', 'expires_in': 3600,
+                 'refresh_token': 'refresh_{}'.format(len(self.calls))}
+        return HTTPResponse(json.dumps(_body), 200, JSON_HEADERS)
+
+    def test_concurrent_refresh(self):
+        _res = run_threads(lambda: self.manager.get_valid_access_token('cc'), 8)
+        assert _res == ['token_1'] * 8
+        assert self.calls == ['Bearer refresh']
+        assert self.manager.get_valid_access_token('cc') == 'token_1'
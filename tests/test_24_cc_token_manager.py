@@ -0,0 +1,149 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+from MockOP import HTTPResponse
+from oidcmsg.storage.abfile import AbstractFileSystem
+
+from oidcservice.exception import TokenError
+from oidcservice.oauth2.client_credentials.cc_access_token import CCAccessToken
+from oidcservice.oauth2.client_credentials.cc_token_manager import \
+    CCTokenManager
+from oidcservice.service_context import ServiceContext
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class TokenEndpoint(object):
+    def __init__(self):
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, data=None, headers=None):
+        with self._lock:
+            self.requests.append(data)
+            _num = len(self.requests)
+        time.sleep(0.1)
+        return HTTPResponse(json.dumps({
+            'access_token': 'token_{}'.format(_num), 'token_type': 'Bearer',
+            'expires_in': 3600}), 200, JSON_HEADERS)
+
+
+class TestCCTokenManager(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.fdir = str(tmpdir.join('tokens'))
+        self.storage = self._storage()
+        self.lock_dir = str(tmpdir.join('locks'))
+        self.endpoint = TokenEndpoint()
+
+    def _storage(self):
+        return AbstractFileSystem(
+            {'fdir': self.fdir, 'key_conv': 'oidcmsg.storage.converter.QPKey'})
+
+    def _manager(self, storage=None):
+        # Each manager represents a worker process with its own service
+        # context
+        service_context = ServiceContext(
+            config={'client_id': 'client_id', 'client_secret': 'password',
+                    'issuer': 'https://example.com'})
+        _srv = CCAccessToken(service_context)
+        _srv.endpoint = 'https://example.com/token'
+        return CCTokenManager(_srv, storage=storage or self.storage,
+                              lock_dir=self.lock_dir, httpc=self.endpoint)
+
+    def test_reuse(self):
+        _mngr = self._manager()
+        assert _mngr.get_access_token('read') == 'token_1'
+        assert _mngr.get_access_token('read') == 'token_1'
+        assert _mngr.get_access_token('write') == 'token_2'
+        assert _mngr.get_access_token('write read') == 'token_3'
+        assert _mngr.get_access_token(['write', 'read']) == 'token_3'
+        assert self.endpoint.requests == [
+            'grant_type=client_credentials&scope=read',
+            'grant_type=client_credentials&scope=write',
+            'grant_type=client_credentials&scope=read+write']
+        # A token for a superset of scopes can be used
+        _mngr.invalidate('token_1')
+        assert _mngr.get_access_token('read') == 'token_3'
+        assert len(self.endpoint.requests) == 3
+        # The shared 'cc' state isn't touched
+        with pytest.raises(KeyError):
+            _mngr.service.get_state('cc')
+
+    def test_shared_between_processes(self):
+        _managers = [self._manager(self._storage()) for _ in range(6)]
+        _res = []
+
+        def _get(mngr):
+            _res.append(mngr.get_access_token('read'))
+
+        _threads = [threading.Thread(target=_get, args=(m,)) for m in
+                    _managers]
+        for _thr in _threads:
+            _thr.start()
+        for _thr in _threads:
+            _thr.join()
+
+        assert _res == ['token_1'] * 6
+        assert len(self.endpoint.requests) == 1
+
+    def test_expired(self):
+        _mngr = self._manager()
+        _mngr.get_access_token()
+        _key = _mngr.store.index_key()
+        _entries = json.loads(self.storage[_key])
+        _entries[0]['token']['__expires_at'] = int(time.time()) + 30
+        self.storage[_key] = json.dumps(_entries)
+        # less than min_validity left
+        assert _mngr.get_access_token() == 'token_2'
+
+    def test_invalidate(self):
+        _mngr = self._manager()
+        _token = _mngr.get_access_token()
+        _mngr.invalidate(_token)
+        assert _mngr.get_access_token() == 'token_2'
+
+    def test_resource(self):
+        _mngr = self._manager()
+        assert _mngr.get_access_token(
+            'read', resource='https://api.example.com') == 'token_1'
+        assert _mngr.get_access_token('read') == 'token_2'
+        assert self.endpoint.requests[0] == (
+            'grant_type=client_credentials&scope=read'
+            '&resource=https%3A%2F%2Fapi.example.com')
+
+    def test_default_lock_dir(self):
+        _mngr = self._manager()
+        _mngr = CCTokenManager(_mngr.service, storage=self.storage,
+                               httpc=self.endpoint)
+        assert os.path.isdir(_mngr.lock_dir)
+        assert _mngr.get_access_token() == 'token_1'
+
+    def test_no_expires_in(self):
+        _mngr = self._manager()
+        _num = []
+
+        def _endpoint(method, url, data=None, headers=None):
+            _num.append(data)
+            return HTTPResponse(json.dumps({
+                'access_token': 'token_{}'.format(len(_num)),
+                'token_type': 'Bearer'}), 200, JSON_HEADERS)
+
+        _mngr.httpc = _endpoint
+        # Can't tell how long the token is valid, so it isn't cached
+        assert _mngr.get_access_token() == 'token_1'
+        assert _mngr.get_access_token() == 'token_2'
+
+        _mngr.default_lifetime = 3600
+        assert _mngr.get_access_token() == 'token_3'
+        assert _mngr.get_access_token() == 'token_3'
+
+    def test_error(self):
+        _mngr = self._manager()
+        _mngr.httpc = lambda *args, **kwargs: HTTPResponse(
+            json.dumps({'error': 'invalid_client'}), 400, JSON_HEADERS)
+        with pytest.raises(TokenError):
+            _mngr.get_access_token()
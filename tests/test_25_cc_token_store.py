@@ -0,0 +1,92 @@
+from oidcmsg.time_util import time_sans_frac
+
+from oidcservice.oauth2.client_credentials.cc_token_store import (
+    CCTokenStore, normalize_resource, normalize_scope)
+from oidcservice.state_interface import InMemoryStateDataBase
+
+
+def test_normalize_scope():
+    assert normalize_scope('b a  b') == ['a', 'b']
+    assert normalize_scope(['read', 'write', 'read']) == ['read', 'write']
+    assert normalize_scope(None) == []
+
+
+def test_normalize_resource():
+    assert normalize_resource('https://a.example.com') == [
+        'https://a.example.com']
+    assert normalize_resource(['https://b.example.com',
+                               'https://a.example.com']) == [
+        'https://a.example.com', 'https://b.example.com']
+    assert normalize_resource(None) == []
+
+
+def token(access_token, expires_in=3600, **kwargs):
+    _token = {'access_token': access_token, 'token_type': 'Bearer',
+              '__expires_at': time_sans_frac() + expires_in}
+    _token.update(kwargs)
+    return _token
+
+
+class TestCCTokenStore(object):
+    def setup_method(self):
+        self.store = CCTokenStore(InMemoryStateDataBase(),
+                                  issuer='https://example.com',
+                                  client_id='client_id')
+
+    def test_index_key(self):
+        assert self.store.index_key() != self.store.index_key(
+            'https://api.example.com')
+        _other = CCTokenStore(self.store.storage, issuer='https://example.com',
+                              client_id='other')
+        assert self.store.index_key() != _other.index_key()
+
+    def test_find_exact(self):
+        self.store.add(token('A'), 'read')
+        self.store.add(token('B'), 'write')
+        assert self.store.find('read')['access_token'] == 'A'
+        assert self.store.find('write')['access_token'] == 'B'
+        assert self.store.find('read write') is None
+
+    def test_find_superset(self):
+        self.store.add(token('AB'), 'read write')
+        self.store.add(token('ABC'), 'read write admin')
+        # the smallest scope set that covers
+        assert self.store.find('read')['access_token'] == 'AB'
+        assert self.store.find('admin')['access_token'] == 'ABC'
+        assert self.store.find()['access_token'] == 'AB'
+
+    def test_scope_from_response(self):
+        self.store.add(token('A', scope='read'), 'read write')
+        assert self.store.find('read')['access_token'] == 'A'
+        assert self.store.find('write') is None
+
+    def test_replace(self):
+        self.store.add(token('A'), 'read')
+        self.store.add(token('A2'), 'read')
+        assert len(self.store.entries()) == 1
+        assert self.store.find('read')['access_token'] == 'A2'
+
+    def test_expiry(self):
+        self.store.add(token('A', 30), 'read')
+        assert self.store.find('read')['access_token'] == 'A'
+        assert self.store.find('read', min_validity=60) is None
+        self.store.add(token('B', -10), 'write')
+        # Expired tokens are removed when a new token is added
+        self.store.add(token('C'), 'other')
+        assert [e['token']['access_token'] for e in self.store.entries()] == [
+            'A', 'C']
+
+    def test_resource(self):
+        self.store.add(token('A'), 'read', 'https://a.example.com')
+        self.store.add(token('B'), 'read', ['https://b.example.com'])
+        assert self.store.find('read', 'https://a.example.com')[
+                   'access_token'] == 'A'
+        assert self.store.find('read', 'https://b.example.com')[
+                   'access_token'] == 'B'
+        assert self.store.find('read') is None
+
+    def test_remove(self):
+        self.store.add(token('A'), 'read')
+        self.store.add(token('AB'), 'read write')
+        self.store.remove('A')
+        assert self.store.find('read')['access_token'] == 'AB'
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+import pytest
+from MockOP import HTTPResponse
+
+from oidcservice.batch_refresh import BatchRefresh
+from oidcservice.oauth2 import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class TokenEndpoint(object):
+    """Refresh tokens starting with 'bad' are rejected."""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, data=None, headers=None):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.in_flight, self.max_in_flight)
+        time.sleep(0.01)
+        with self._lock:
+            self.in_flight -= 1
+
+        _refresh_token = headers['Authorization'][len('Bearer '):]
+        if _refresh_token.startswith('bad'):
+            return HTTPResponse(json.dumps({'error': 'invalid_grant'}),
+                                400, JSON_HEADERS)
+        if _refresh_token.startswith('broken'):
+            return HTTPResponse('Internal error', 500)
+
+        assert parse_qs(data)['grant_type'] == ['refresh_token']
+        return HTTPResponse(json.dumps({
+            'access_token': 'new_{}'.format(_refresh_token),
+            'token_type': 'Bearer', 'expires_in': 3600}), 200, JSON_HEADERS)
+
+
+class TestBatchRefresh(object):
+    @pytest.fixture(autouse=True)
+    def create_services(self):
+        client_config = {
+            'client_id': 'client_id',
+            'client_secret': 'a longesh password',
+            'redirect_uris': ['https://example.com/cli/authz_cb'],
+            'issuer': 'https://example.com'
+        }
+        service_context = ServiceContext(config=client_config)
+        self.service = init_services(DEFAULT_SERVICES, service_context)
+        self.service['refresh_token'].endpoint = 'https://example.com/token'
+        self.endpoint = TokenEndpoint()
+
+    def _add_states(self, num, prefix='ok'):
+        _srv = self.service['accesstoken']
+        _keys = []
+        for i in range(num):
+            _key = '{}{}'.format(prefix, i)
+            _srv.create_state('https://example.com', _key)
+            _srv.store_item({'access_token': 'access', 'token_type': 'Bearer',
+                             'refresh_token': _key}, 'token_response', _key)
+            _keys.append(_key)
+        return _keys
+
+    def test_run(self):
+        _keys = self._add_states(25)
+        _progress = []
+        _batch = BatchRefresh(self.service['refresh_token'],
+                              httpc=self.endpoint, max_concurrency=4,
+                              batch_size=10,
+                              progress=lambda r: _progress.append(r.done))
+        result = _batch.run(iter(_keys))
+
+        assert result.total == 25
+        assert result.succeeded == 25
+        assert result.failed == 0
+        assert result.throughput > 0
+        assert self.endpoint.max_in_flight <= 4
+        assert _progress[-1] == 25
+        assert len(_progress) >= 3
+
+        _item = self.service['accesstoken'].get_item(dict, 'token_response',
+                                                     'ok7')
+        assert _item['access_token'] == 'new_ok7'
+        assert '__expires_at' in _item
+
+    def test_error_isolation(self):
+        _keys = self._add_states(5)
+        _keys.extend(self._add_states(2, 'bad'))
+        _keys.extend(self._add_states(1, 'broken'))
+        _keys.append('unknown')
+
+        _batch = BatchRefresh(self.service['refresh_token'],
+                              httpc=self.endpoint, max_concurrency=3)
+        result = _batch.run(_keys)
+
+        assert result.total == 9
+        assert result.succeeded == 5
+        assert result.failed == 4
+        assert set(result.errors.keys()) == {'bad0', 'bad1', 'broken0',
+                                             'unknown'}
+        assert 'invalid_grant' in result.errors['bad0']
+
+        _item = self.service['accesstoken'].get_item(dict, 'token_response',
+                                                     'bad0')
+        assert _item['access_token'] == 'access'
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+
+import pytest
+from cryptojwt.key_jar import KeyJar
+from MockOP import HTTPResponse
+
+from oidcservice.provider_info_cache import (ProviderInfoCache,
+                                             parse_cache_control)
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+
+ISS = 'https://example.com'
+
+PROVIDER_INFO = {
+    'issuer': ISS,
+    'authorization_endpoint': '{}/authorization'.format(ISS),
+    'token_endpoint': '{}/token'.format(ISS),
+    'userinfo_endpoint': '{}/userinfo'.format(ISS),
+    'jwks_uri': '{}/jwks.json'.format(ISS),
+    'response_types_supported': ['code', 'id_token'],
+    'subject_types_supported': ['public', 'pairwise'],
+    'id_token_signing_alg_values_supported': ['RS256', 'ES256'],
+    'token_endpoint_auth_methods_supported': ['client_secret_basic',
+                                              'private_key_jwt']
+}
+
+
+class DiscoveryEndpoint(object):
+    def __init__(self, cache_control='max-age=600', etag='"v1"'):
+        self.cache_control = cache_control
+        self.etag = etag
+        self.content = PROVIDER_INFO.copy()
+        self.requests = []
+        self.called = threading.Event()
+
+    def __call__(self, method, url, data=None, headers=None):
+        self.requests.append(headers or {})
+        _headers = {'Cache-Control': self.cache_control, 'ETag': self.etag}
+        try:
+            if headers and headers.get('If-None-Match') == self.etag:
+                return HTTPResponse('', 304, _headers)
+            _headers['Content-Type'] = 'application/json'
+            if url.endswith('jwks.json'):
+                return HTTPResponse(json.dumps({'keys': []}), 200, _headers)
+            return HTTPResponse(json.dumps(self.content), 200, _headers)
+        finally:
+            self.called.set()
+
+
+def test_parse_cache_control():
+    assert parse_cache_control('public, max-age=600, no-cache') == {
+        'public': True, 'max-age': '600', 'no-cache': True}
+    assert parse_cache_control('') == {}
+
+
+def test_lifetime():
+    _cache = ProviderInfoCache(default_max_age=100, stale_while_revalidate=10)
+    assert _cache.lifetime({'Cache-Control': 'max-age=60'}, now=1000) == (
+        1060, 1070)
+    assert _cache.lifetime({'cache-control': 'max-age=60', 'age': '20'},
+                           now=1000) == (1040, 1050)
+    assert _cache.lifetime(
+        {'Cache-Control': 'max-age=60, stale-while-revalidate=300'},
+        now=1000) == (1060, 1360)
+    assert _cache.lifetime({'Cache-Control': 'no-cache'}, now=1000) == (
+        1000, 1010)
+    assert _cache.lifetime({'Cache-Control': 'no-store'}, now=1000) is None
+    assert _cache.lifetime({'Expires': 'Thu, 01 Jan 1970 00:20:00 GMT'},
+                           now=1000) == (1200, 1210)
+    assert _cache.lifetime({}, now=1000) == (1100, 1110)
+
+
+class TestProviderInfoCache(object):
+    @pytest.fixture(autouse=True)
+    def create_cache(self):
+        self.cache = ProviderInfoCache()
+        self.endpoint = DiscoveryEndpoint()
+        self.jwks_endpoint = DiscoveryEndpoint()
+
+    def _service(self):
+        service_context = ServiceContext(config={
+            'client_id': 'client_id', 'issuer': ISS,
+            'client_preferences': {
+                'id_token_signed_response_alg': 'ES256',
+                'token_endpoint_auth_method': 'private_key_jwt'}})
+        service_context.keyjar = KeyJar(httpc=self.jwks_endpoint)
+        return service_factory('ProviderInfoDiscovery', ['oidc'],
+                               service_context=service_context,
+                               conf={'cache': self.cache})
+
+    def test_shared_between_service_contexts(self):
+        _srv = self._service()
+        _srv.do_request(self.endpoint)
+        assert _srv.service_context.get('provider_info')['issuer'] == ISS
+        assert _srv.service_context.get('behaviour')[
+                   'id_token_signed_response_alg'] == 'ES256'
+
+        _srv2 = self._service()
+        _resp = _srv2.do_request(self.endpoint)
+        assert _resp['token_endpoint'] == '{}/token'.format(ISS)
+        assert _srv2.service_context.get('behaviour')[
+                   'token_endpoint_auth_method'] == 'private_key_jwt'
+        assert len(self.endpoint.requests) == 1
+
+    def test_unchanged_is_noop(self):
+        _srv = self._service()
+        _resp = _srv.do_request(self.endpoint)
+        _srv.service_context.get('behaviour')[
+            'id_token_signed_response_alg'] = 'X'
+        _srv.update_service_context(_resp)
+        assert _srv.service_context.get('behaviour')[
+                   'id_token_signed_response_alg'] == 'X'
+
+        _changed = _srv.response_cls(**PROVIDER_INFO)
+        _changed['userinfo_endpoint'] = '{}/ui'.format(ISS)
+        _srv.update_service_context(_changed)
+        assert _srv.service_context.get('behaviour')[
+                   'id_token_signed_response_alg'] == 'ES256'
+        assert _srv.service_context.get('provider_info')[
+                   'userinfo_endpoint'] == '{}/ui'.format(ISS)
+
+    def test_conditional_revalidation(self):
+        self.endpoint.cache_control = 'no-cache'
+        _srv = self._service()
+        _srv.do_request(self.endpoint)
+        _info = _srv.get_request_parameters()
+        assert _info['headers'] == {'If-None-Match': '"v1"'}
+
+        _entry = self.cache.get(_info['url'])
+        _entry.stale_until = 0
+        _resp = _srv.do_request(self.endpoint)
+        assert _resp['issuer'] == ISS
+        assert len(self.endpoint.requests) == 2
+        assert self.endpoint.requests[1] == {'If-None-Match': '"v1"'}
+        assert self.cache.get(_info['url']) is _entry
+
+    def test_stale_while_revalidate(self):
+        _srv = self._service()
+        _srv.do_request(self.endpoint)
+        _key = _srv.get_endpoint()
+        self.cache.get(_key).expires_at = 0
+
+        self.endpoint.called.clear()
+        self.endpoint.etag = '"v2"'
+        self.endpoint.content['userinfo_endpoint'] = '{}/ui'.format(ISS)
+        _resp = _srv.do_request(self.endpoint)
+        # Served from the cache
+        assert _resp['userinfo_endpoint'] == '{}/userinfo'.format(ISS)
+
+        assert self.endpoint.called.wait(5)
+        for _ in range(50):
+            if not self.cache.get(_key).revalidating:
+                break
+            time.sleep(0.01)
+
+        assert self.cache.get(_key).etag == '"v2"'
+        _resp = _srv.do_request(self.endpoint)
+        assert _resp['userinfo_endpoint'] == '{}/ui'.format(ISS)
+        assert len(self.endpoint.requests) == 2
+
+    def test_no_store(self):
+        self.endpoint.cache_control = 'no-store'
+        _srv = self._service()
+        _srv.do_request(self.endpoint)
+        _srv.do_request(self.endpoint)
+        assert len(self.endpoint.requests) == 2
+        assert _srv.get_endpoint() not in self.cache
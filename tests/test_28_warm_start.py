@@ -0,0 +1,166 @@
+import gzip
+import json
+import os
+import time
+
+import pytest
+from cryptojwt.jwk.rsa import new_rsa_key
+from cryptojwt.key_jar import KeyJar
+from MockOP import HTTPResponse
+
+from oidcservice.oidc import DEFAULT_SERVICES
+from oidcservice.service import init_services
+from oidcservice.service_context import ServiceContext
+from oidcservice.warm_start import (SnapshotStore, export_snapshot,
+                                    import_snapshot)
+
+ISS = 'https://op.example.org'
+
+PROVIDER_INFO = {
+    'issuer': ISS,
+    'authorization_endpoint': '{}/authorization'.format(ISS),
+    'token_endpoint': '{}/token'.format(ISS),
+    'userinfo_endpoint': '{}/userinfo'.format(ISS),
+    'registration_endpoint': '{}/registration'.format(ISS),
+    'jwks_uri': '{}/jwks.json'.format(ISS),
+    'response_types_supported': ['code'],
+    'subject_types_supported': ['public'],
+    'id_token_signing_alg_values_supported': ['RS256']
+}
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class FakeOP(object):
+    def __init__(self):
+        self.provider_info = PROVIDER_INFO.copy()
+        self.jwks = {'keys': [new_rsa_key(kid='op_key').serialize()]}
+        self.requests = []
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        self.requests.append(url)
+        if url.endswith('jwks.json'):
+            return HTTPResponse(json.dumps(self.jwks), 200, JSON_HEADERS)
+        return HTTPResponse(json.dumps(self.provider_info), 200, JSON_HEADERS)
+
+
+class TestWarmStart(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.op = FakeOP()
+        self.store = SnapshotStore(str(tmpdir.join('snapshots')),
+                                   include_registration=True)
+
+    def _services(self):
+        service_context = ServiceContext(config={
+            'issuer': ISS, 'redirect_uris': ['https://rp.example.com/cb']},
+            keyjar=KeyJar(httpc=self.op))
+        return init_services(DEFAULT_SERVICES, service_context)
+
+    def _bootstrap(self, client_secret_expires_at=0):
+        _services = self._services()
+        _services['provider_info'].do_request(self.op)
+        _context = _services['provider_info'].service_context
+        _context.keyjar.get_issuer_keys(ISS)
+        _services['registration'].update_service_context({
+            'client_id': 'client_id', 'client_secret': 'a longesh secret',
+            'client_secret_expires_at': client_secret_expires_at,
+            'redirect_uris': ['https://rp.example.com/cb']})
+        return _services
+
+    def test_save_load(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        _filename = self.store.save(_context)
+        with gzip.open(_filename) as _fp:
+            assert json.loads(_fp.read())['issuer'] == ISS
+        assert len(self.op.requests) == 2
+
+        _services = self._services()
+        _context = _services['provider_info'].service_context
+        assert self.store.load(_context, _services)
+
+        assert _context.get('provider_info')['issuer'] == ISS
+        assert _context.get('client_id') == 'client_id'
+        assert _context.get('client_secret') == 'a longesh secret'
+        assert _services['accesstoken'].endpoint == '{}/token'.format(ISS)
+        assert _services['userinfo'].endpoint == '{}/userinfo'.format(ISS)
+        _keys = _context.keyjar.get_issuer_keys(ISS)
+        assert [k.kid for k in _keys] == ['op_key']
+        assert _context.keyjar.get_issuer_keys('client_id')
+        # Nothing fetched
+        assert len(self.op.requests) == 2
+
+    def test_no_registration_by_default(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        _store = SnapshotStore(self.store.snapshot_dir)
+        _filename = _store.save(_context)
+        assert os.stat(_filename).st_mode & 0o077 == 0
+        with gzip.open(_filename) as _fp:
+            _snapshot = json.loads(_fp.read())
+        assert set(_snapshot['context']) == {'issuer', 'provider_info'}
+
+        _services = self._services()
+        _context = _services['provider_info'].service_context
+        assert _store.load(_context, _services)
+        assert _context.get('provider_info')['issuer'] == ISS
+        assert _context.get('client_secret') == ''
+
+    def test_no_snapshot(self):
+        _services = self._services()
+        assert not self.store.load(_services['provider_info'].service_context,
+                                   _services)
+
+    def test_too_old(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        self.store.save(_context, now=int(time.time()) - 2 * 86400)
+        _services = self._services()
+        assert not self.store.load(_services['provider_info'].service_context,
+                                   _services)
+
+    def test_other_issuer(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        _snapshot = export_snapshot(_context)
+        _other = ServiceContext(config={'issuer': 'https://other.example.org'})
+        assert not import_snapshot(_other, _snapshot)
+        assert _other.get('provider_info') == {}
+
+    def test_expired_client_secret(self):
+        _context = self._bootstrap(int(time.time()) - 10)[
+            'provider_info'].service_context
+        _snapshot = export_snapshot(_context, include_registration=True)
+
+        _services = self._services()
+        _context = _services['provider_info'].service_context
+        assert import_snapshot(_context, _snapshot, _services)
+        assert _context.get('provider_info')['issuer'] == ISS
+        assert _context.get('client_id') == ''
+        assert _context.get('registration_response') is None
+
+    def test_corrupt_file(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        with open(self.store.filename(ISS), 'wb') as _fp:
+            _fp.write(b'garbage')
+        assert not self.store.load(_context)
+
+    def test_revalidate(self):
+        _context = self._bootstrap()['provider_info'].service_context
+        self.store.save(_context)
+
+        _services = self._services()
+        _context = _services['provider_info'].service_context
+        self.store.load(_context, _services)
+
+        self.op.provider_info['userinfo_endpoint'] = '{}/ui'.format(ISS)
+        self.op.jwks = {'keys': [new_rsa_key(kid='new_key').serialize()]}
+        _thread = self.store.revalidate_in_background(_services, self.op)
+        _thread.join(5)
+
+        assert _services['userinfo'].endpoint == '{}/ui'.format(ISS)
+        assert 'new_key' in [k.kid for k in _context.keyjar.get_issuer_keys(
+            ISS)]
+        _snapshot = self.store.read(ISS)
+        assert _snapshot['context']['provider_info'][
+                   'userinfo_endpoint'] == '{}/ui'.format(ISS)
+
+        assert not self.store.revalidate(_services, self.op)
+        assert os.path.isfile(self.store.filename(ISS))
@@ -0,0 +1,163 @@
+import json
+import time
+
+import pytest
+from cryptojwt.jwk.rsa import new_rsa_key
+from cryptojwt.key_jar import KeyJar
+from MockOP import HTTPResponse
+from oidcmsg.exception import MissingSigningKey
+from oidcmsg.oidc import AccessTokenResponse, IdToken
+
+from oidcservice.key_scheduler import KeyRefreshScheduler
+from oidcservice.service import Service
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+
+ISS = 'https://op.example.org'
+
+PROVIDER_INFO = {
+    'issuer': ISS,
+    'authorization_endpoint': '{}/authorization'.format(ISS),
+    'token_endpoint': '{}/token'.format(ISS),
+    'jwks_uri': '{}/jwks.json'.format(ISS),
+    'response_types_supported': ['code'],
+    'subject_types_supported': ['public'],
+    'id_token_signing_alg_values_supported': ['RS256']
+}
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class FakeOP(object):
+    def __init__(self):
+        self.keys = [new_rsa_key(kid='key_1')]
+        self.jwks_requests = 0
+        self.fail = False
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        if url.endswith('jwks.json'):
+            self.jwks_requests += 1
+            if self.fail:
+                return HTTPResponse('Internal error', 500)
+            return HTTPResponse(json.dumps(
+                {'keys': [k.serialize() for k in self.keys]}), 200,
+                JSON_HEADERS)
+        return HTTPResponse(json.dumps(PROVIDER_INFO), 200, JSON_HEADERS)
+
+
+class IdTokenService(Service):
+    response_cls = AccessTokenResponse
+
+    def gather_verify_arguments(self):
+        return {'keyjar': self.service_context.keyjar, 'iss': ISS,
+                'client_id': 'client_id'}
+
+
+class TestKeyRefreshScheduler(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.op = FakeOP()
+        self.scheduler = KeyRefreshScheduler(lead_time=60, jitter=0,
+                                             min_interval=30)
+        self.service_context = ServiceContext(
+            config={'issuer': ISS, 'client_id': 'client_id'},
+            keyjar=KeyJar(httpc=self.op), key_scheduler=self.scheduler)
+        yield
+        self.scheduler.stop()
+
+    def _discover(self):
+        _srv = service_factory('ProviderInfoDiscovery', ['oidc'],
+                               service_context=self.service_context)
+        _srv.do_request(self.op)
+        # Wait for the prefetch
+        for _ in range(100):
+            if self.scheduler.next_due():
+                break
+            time.sleep(0.01)
+
+    def _kids(self):
+        return sorted(k.kid for k in
+                      self.service_context.keyjar.get_issuer_keys(ISS))
+
+    def test_prefetch_after_discovery(self):
+        self._discover()
+        assert self.op.jwks_requests == 1
+        assert self._kids() == ['key_1']
+        # Fetched keys are not fetched again on use
+        assert self.op.jwks_requests == 1
+
+        _bundle = self.service_context.keyjar[ISS][0]
+        assert self.scheduler.next_due() == _bundle.time_out - 60
+
+    def test_refresh_ahead_of_expiry(self):
+        self._discover()
+        assert self.scheduler.run_pending() == {}
+
+        self.op.keys.append(new_rsa_key(kid='key_2'))
+        _futures = self.scheduler.run_pending(now=time.time() + 3600)
+        assert _futures[ISS].result()
+        assert self._kids() == ['key_1', 'key_2']
+        assert self.op.jwks_requests == 2
+
+    def test_failed_refresh_keeps_keys(self):
+        self._discover()
+        self.op.fail = True
+        _now = time.time()
+        assert not self.scheduler.refresh(self.service_context.keyjar, ISS)
+        assert self._kids() == ['key_1']
+        _bundle = self.service_context.keyjar[ISS][0]
+        assert _bundle.time_out > _now
+        assert _now + 59 <= self.scheduler.next_due() <= _now + 61
+
+    def test_unknown_key(self):
+        self._discover()
+        _keyjar = self.service_context.keyjar
+        assert not self.scheduler.unknown_key(_keyjar, ISS, 'key_1')
+        # Refreshed less than min_interval ago
+        assert not self.scheduler.unknown_key(_keyjar, ISS, 'key_2')
+
+        self.scheduler.min_interval = 0
+        self.op.keys = [new_rsa_key(kid='key_2')]
+        assert self.scheduler.unknown_key(_keyjar, ISS, 'key_2')
+        assert 'key_2' in self._kids()
+
+    def test_verify_with_rotated_key(self):
+        self._discover()
+        self.scheduler.min_interval = 0
+        self.op.keys = [new_rsa_key(kid='key_2')]
+
+        _now = int(time.time())
+        _id_token = IdToken(iss=ISS, sub='subject', aud=['client_id'],
+                            iat=_now, exp=_now + 300).to_jwt(self.op.keys,
+                                                             'RS256')
+        _resp = AccessTokenResponse(access_token='access', token_type='Bearer',
+                                    id_token=_id_token)
+        _srv = IdTokenService(self.service_context)
+        _res = _srv.parse_response(_resp.to_json(), 'json')
+        assert _res['__verified_id_token']['sub'] == 'subject'
+        assert self.op.jwks_requests == 2
+
+        # Rate limited
+        self.scheduler.min_interval = 30
+        self.op.keys = [new_rsa_key(kid='key_3')]
+        _id_token = IdToken(iss=ISS, sub='subject', aud=['client_id'],
+                            iat=_now, exp=_now + 300).to_jwt(self.op.keys,
+                                                             'RS256')
+        _resp['id_token'] = _id_token
+        with pytest.raises(MissingSigningKey):
+            _srv.parse_response(_resp.to_json(), 'json')
+        assert self.op.jwks_requests == 2
+
+    def test_background(self):
+        self._discover()
+        self.op.keys.append(new_rsa_key(kid='key_2'))
+        _bundle = self.service_context.keyjar[ISS][0]
+        _bundle.time_out = time.time() + 60
+        self.scheduler.track(self.service_context.keyjar, ISS)
+
+        self.scheduler.start()
+        for _ in range(100):
+            if self.op.jwks_requests == 2 and len(self._kids()) == 2:
+                break
+            time.sleep(0.02)
+        assert self._kids() == ['key_1', 'key_2']
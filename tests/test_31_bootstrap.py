@@ -0,0 +1,204 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from cryptojwt.jwk.rsa import new_rsa_key
+from MockOP import HTTPResponse, MockOP
+
+import requests
+from oidcservice.bootstrap import Bootstrap, HostLimitedTransport
+
+JSON_HEADERS = {'content-type': 'application/json'}
+
+
+class StandInOP(MockOP):
+    """An OP that supports discovery, JWKS and dynamic registration."""
+
+    def __init__(self, baseurl, fail=0, delay=0.0):
+        MockOP.__init__(self, baseurl)
+        self.issuer = baseurl.rstrip('/')
+        self.jwks = {'keys': [new_rsa_key(kid='op_key').serialize()]}
+        self.fail = fail
+        self.delay = delay
+        self.calls = []
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        self.calls.append((method, url, kwargs.get('timeout')))
+        time.sleep(self.delay)
+        if self.fail:
+            self.fail -= 1
+            return HTTPResponse('Service unavailable', 503)
+
+        path = urlsplit(url).path.lstrip('/')
+        if path == '.well-known/openid-configuration':
+            return self.discovery()
+        if path == '.well-known/webfinger':
+            return self.webfinger(urlsplit(url).query)
+        if path == 'jwks.json':
+            return HTTPResponse(json.dumps(self.jwks), headers=JSON_HEADERS)
+        if path == 'register':
+            return self.register(data)
+        return HTTPResponse('Not found', 404)
+
+    def discovery(self):
+        return HTTPResponse(json.dumps({
+            'issuer': self.issuer,
+            'authorization_endpoint': '{}/authorization'.format(self.issuer),
+            'token_endpoint': '{}/token'.format(self.issuer),
+            'registration_endpoint': '{}/register'.format(self.issuer),
+            'jwks_uri': '{}/jwks.json'.format(self.issuer),
+            'response_types_supported': ['code'],
+            'subject_types_supported': ['public'],
+            'id_token_signing_alg_values_supported': ['RS256']
+        }), headers=JSON_HEADERS)
+
+    def webfinger(self, query):
+        _resource = parse_qs(query)['resource'][0]
+        return HTTPResponse(json.dumps({
+            'subject': _resource,
+            'links': [{'rel': 'http://openid.net/specs/connect/1.0/issuer',
+                       'href': self.issuer}]
+        }), headers=JSON_HEADERS)
+
+    def register(self, request):
+        _req = json.loads(request)
+        _req.update({'client_id': 'client_{}'.format(len(self.calls)),
+                     'client_secret': 'a very long client secret',
+                     'client_secret_expires_at': 0})
+        return HTTPResponse(json.dumps(_req), 201, headers=JSON_HEADERS)
+
+
+class Network(object):
+    """Routes requests to the stand-in OPs and keeps track of concurrency."""
+
+    def __init__(self, ops):
+        self.ops = {urlsplit(op.baseurl).netloc: op for op in ops}
+        self.in_flight = {}
+        self.max_in_flight = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, method, url, **kwargs):
+        _host = urlsplit(url).netloc
+        with self._lock:
+            self.in_flight[_host] = self.in_flight.get(_host, 0) + 1
+            self.max_in_flight[_host] = max(self.max_in_flight.get(_host, 0),
+                                            self.in_flight[_host])
+        try:
+            return self.ops[_host](method, url, **kwargs)
+        finally:
+            with self._lock:
+                self.in_flight[_host] -= 1
+
+
+def _config(issuer, **kwargs):
+    _conf = {
+        'issuer': issuer,
+        'redirect_uris': ['https://rp.example.com/cb'],
+        'client_preferences': {
+            'response_types': ['code'],
+            'token_endpoint_auth_method': 'client_secret_basic'
+        }
+    }
+    _conf.update(kwargs)
+    return _conf
+
+
+def test_bootstrap_many():
+    _ops = [StandInOP('https://op{}.example.org/'.format(i)) for i in range(5)]
+    _network = Network(_ops)
+    _bootstrap = Bootstrap(httpc=_network, max_workers=5, timeout=3)
+
+    _results = _bootstrap.run([_config(op.issuer) for op in _ops])
+    assert [r.ok for r in _results] == [True] * 5
+    for _op, _res in zip(_ops, _results):
+        _context = _res.service_context
+        assert _context.get('provider_info')['issuer'] == _op.issuer
+        assert _context.get('client_id').startswith('client_')
+        assert _res.services['accesstoken'].endpoint == \
+               '{}/token'.format(_op.issuer)
+        assert [k.kid for k in _context.keyjar.get_issuer_keys(
+            _op.issuer)] == ['op_key']
+        assert set(_res.timing.keys()) == {'provider_info', 'jwks',
+                                           'registration'}
+        assert _res.to_dict()['issuer'] == _op.issuer
+        # The timeout is passed on
+        assert {c[2] for c in _op.calls} == {3}
+
+
+def test_webfinger():
+    _op = StandInOP('https://op.example.org/')
+    _bootstrap = Bootstrap(httpc=Network([_op]))
+    _config_wf = _config('', resource='acct:foo@op.example.org',
+                         client_id='client', client_secret='a long secret')
+    del _config_wf['issuer']
+
+    _res = _bootstrap.bootstrap(_config_wf)
+    assert _res.ok, _res.error
+    assert _res.service_context.get('issuer') == _op.issuer
+    assert 'webfinger' in _res.timing
+    # Client already registered
+    assert 'registration' not in _res.timing
+
+
+def test_retry_and_failure():
+    _flaky = StandInOP('https://flaky.example.org/', fail=2)
+    _down = StandInOP('https://down.example.org/', fail=100)
+    _bootstrap = Bootstrap(httpc=Network([_flaky, _down]), retries=2,
+                           backoff=0.01)
+
+    _flaky_res, _down_res = _bootstrap.run(
+        [_config(_flaky.issuer), _config(_down.issuer)])
+    assert _flaky_res.ok
+    assert _flaky_res.attempts['provider_info'] == 3
+    assert not _down_res.ok
+    assert 'ServerError' in _down_res.error
+    assert _down_res.attempts['provider_info'] == 3
+    assert 'jwks' not in _down_res.timing
+
+
+def test_client_error_not_retried():
+    _op = StandInOP('https://op.example.org/')
+    _bootstrap = Bootstrap(httpc=Network([_op]), retries=2, backoff=0.01)
+
+    # There is no provider info at this issuer
+    _res = _bootstrap.bootstrap(_config('https://op.example.org/tenant'))
+    assert not _res.ok
+    assert 'ResponseError' in _res.error
+    assert _res.attempts['provider_info'] == 1
+
+
+def test_registration_not_resent_after_read_timeout():
+    _op = StandInOP('https://op.example.org/')
+    _errors = [requests.exceptions.ConnectTimeout(),
+               requests.exceptions.ReadTimeout()]
+
+    def _httpc(method, url, **kwargs):
+        if url.endswith('/register') and _errors:
+            raise _errors.pop(0)
+        return _op(method, url, **kwargs)
+
+    _bootstrap = Bootstrap(httpc=_httpc, retries=2, backoff=0.01)
+    _res = _bootstrap.bootstrap(_config(_op.issuer))
+    # Retried after the connect timeout but not after the read timeout
+    assert not _res.ok
+    assert 'ReadTimeout' in _res.error
+    assert _res.attempts['registration'] == 2
+
+
+def test_per_host_limit():
+    _op = StandInOP('https://shared.example.org/', delay=0.02)
+    _network = Network([_op])
+    _bootstrap = Bootstrap(httpc=_network, max_workers=6, per_host=2)
+    _results = _bootstrap.run([_config(_op.issuer) for _ in range(6)])
+    assert all(r.ok for r in _results)
+    assert _network.max_in_flight['shared.example.org'] <= 2
+
+
+def test_host_limited_transport():
+    _seen = []
+    _transport = HostLimitedTransport(
+        lambda method, url, **kwargs: _seen.append(kwargs), timeout=5)
+    _transport('GET', 'https://example.com', timeout=1)
+    _transport('GET', 'https://example.com')
+    assert _seen == [{'timeout': 1}, {'timeout': 5}]
@@ -0,0 +1,129 @@
+import json
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+from MockOP import HTTPResponse
+
+from oidcservice.exception import WebFingerError
+from oidcservice.oidc import OIC_ISSUER
+from oidcservice.oidc.webfinger import (WebFinger, WebFingerCache,
+                                        normalize_resource)
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.com'
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class FakeWebFingerServer(object):
+    def __init__(self, delay=0):
+        self.requests = []
+        self.fail = False
+        self.delay = delay
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        self.requests.append(url)
+        if self.delay:
+            time.sleep(self.delay)
+        if self.fail:
+            return HTTPResponse('Not found', 404,
+                                {'Content-Type': 'text/plain'})
+        _resource = parse_qs(urlsplit(url).query)['resource'][0]
+        return HTTPResponse(json.dumps({
+            'subject': _resource,
+            'links': [{'rel': OIC_ISSUER, 'href': ISS}]}), 200, JSON_HEADERS)
+
+
+def test_normalize_resource_memoized():
+    normalize_resource.cache_clear()
+    assert normalize_resource('joe@example.com') == ('acct:joe@example.com',
+                                                     'example.com')
+    assert normalize_resource('joe@example.com') == ('acct:joe@example.com',
+                                                     'example.com')
+    assert normalize_resource.cache_info().hits == 1
+
+
+class TestWebFingerCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.server = FakeWebFingerServer()
+        self.cache = WebFingerCache(ttl=3600, negative_ttl=60)
+
+    def _service(self):
+        return WebFinger(ServiceContext(), conf={'cache': self.cache})
+
+    def test_cached(self):
+        _srv = self._service()
+        _srv.do_request(self.server, resource='joe@example.com')
+        assert _srv.service_context.get('issuer') == ISS
+
+        _srv = self._service()
+        _resp = _srv.do_request(self.server, resource='acct:joe@example.com')
+        assert _srv.service_context.get('issuer') == ISS
+        assert _resp['subject'] == 'acct:joe@example.com'
+        assert len(self.server.requests) == 1
+
+    def test_shared_per_domain(self):
+        self._service().do_request(self.server, resource='joe@example.com')
+        _srv = self._service()
+        _resp = _srv.do_request(self.server, resource='jane@example.com')
+        assert _resp['subject'] == 'acct:jane@example.com'
+        assert _srv.service_context.get('issuer') == ISS
+        assert len(self.server.requests) == 1
+
+        self.cache.share_domain = False
+        self._service().do_request(self.server, resource='jane@example.com')
+        assert len(self.server.requests) == 2
+
+    def test_negative_caching(self):
+        self.server.fail = True
+        for _ in range(3):
+            with pytest.raises(Exception):
+                self._service().do_request(self.server,
+                                           resource='joe@example.com')
+        assert len(self.server.requests) == 1
+
+        with pytest.raises(WebFingerError):
+            self._service().do_request(self.server, resource='joe@example.com')
+
+    def test_expiry(self):
+        _key = self.cache.key('joe@example.com')
+        _now = time.time()
+        self.cache.set(_key, ISS, now=_now)
+        assert self.cache.get(_key, now=_now + 3599) == ISS
+        assert self.cache.get(_key, now=_now + 3600) is None
+
+        self.cache.set_failure(_key, 'failed', now=_now)
+        with pytest.raises(WebFingerError):
+            self.cache.get(_key, now=_now + 59)
+        assert self.cache.get(_key, now=_now + 60) is None
+
+    def test_max_size(self):
+        self.cache.max_size = 2
+        for _domain in ['a.example.com', 'b.example.com', 'c.example.com']:
+            self.cache.set(self.cache.key(_domain), ISS)
+        assert len(self.cache) == 2
+        assert self.cache.get(self.cache.key('a.example.com')) is None
+
+    def test_http_link_not_cached(self):
+        _srv = self._service()
+        _srv.rel = 'http://example.com/rel'
+        with pytest.raises(WebFingerError):
+            _srv.do_request(self.server, resource='joe@example.com')
+
+    def test_coalesced(self):
+        self.server.delay = 0.2
+        _services = [self._service() for _ in range(5)]
+        _threads = [
+            threading.Thread(target=_srv.do_request, args=(self.server,),
+                             kwargs={'resource': 'joe@example.com'})
+            for _srv in _services]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join(5)
+
+        assert len(self.server.requests) == 1
+        for _srv in _services:
+            assert _srv.service_context.get('issuer') == ISS
@@ -0,0 +1,130 @@
+import json
+import os
+import time
+
+import pytest
+from MockOP import HTTPResponse
+
+from oidcservice.oidc.read_registration import RegistrationRead
+from oidcservice.oidc.registration import Registration
+from oidcservice.registration_store import DirectoryDataBase, RegistrationStore
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.org'
+REDIRECT_URIS = ['https://rp.example.com/cb']
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class FakeOP(object):
+    def __init__(self):
+        self.registrations = {}
+        self.requests = []
+        self.count = 0
+        self.client_secret_expires_at = 0
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        self.requests.append((method, url))
+        if method == 'POST':
+            _client_id = 'client_{}'.format(self.count)
+            self.count += 1
+            _req = json.loads(data)
+            _resp = {
+                'client_id': _client_id,
+                'client_secret': 'a longesh secret',
+                'client_secret_expires_at': self.client_secret_expires_at,
+                'registration_access_token': 'token_{}'.format(_client_id),
+                'registration_client_uri': '{}/registration?client_id={}'.format(
+                    ISS, _client_id),
+                'redirect_uris': _req['redirect_uris']
+            }
+            self.registrations[_client_id] = _resp
+            return HTTPResponse(json.dumps(_resp), 201, JSON_HEADERS)
+
+        _client_id = url.split('client_id=')[1]
+        _resp = self.registrations.get(_client_id)
+        if _resp is None or headers['Authorization'] != 'Bearer {}'.format(
+                _resp['registration_access_token']):
+            return HTTPResponse(json.dumps({'error': 'invalid_token'}),
+                                401, JSON_HEADERS)
+        return HTTPResponse(json.dumps(_resp), 200, JSON_HEADERS)
+
+
+class TestRegistrationStore(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmpdir):
+        self.op = FakeOP()
+        self.store = RegistrationStore(
+            DirectoryDataBase(str(tmpdir.join('registrations'))))
+
+    def _register(self, preferences=None, conf=None):
+        _context = ServiceContext(config={
+            'issuer': ISS, 'redirect_uris': REDIRECT_URIS,
+            'client_preferences': preferences or {
+                'response_types': ['code']}})
+        _conf = {'store': self.store}
+        _conf.update(conf or {})
+        _srv = Registration(_context, conf=_conf)
+        _srv.endpoint = '{}/registration'.format(ISS)
+        _srv.do_request(self.op)
+        return _context
+
+    def test_reuse(self):
+        _context = self._register()
+        assert _context.get('client_id') == 'client_0'
+
+        # As after a restart
+        _context = self._register()
+        assert _context.get('client_id') == 'client_0'
+        assert _context.get('client_secret') == 'a longesh secret'
+        assert _context.get('registration_response')['registration_access_token']
+        assert _context.keyjar.get_issuer_keys('client_0')
+        assert [m for m, _ in self.op.requests] == ['POST', 'GET']
+
+    def test_other_preferences(self):
+        self._register()
+        _context = self._register(
+            preferences={'response_types': ['code'],
+                         'token_endpoint_auth_method': 'client_secret_post'})
+        assert _context.get('client_id') == 'client_1'
+
+    def test_expired(self):
+        self.op.client_secret_expires_at = int(time.time()) + 10
+        self._register()
+        _context = self._register()
+        assert _context.get('client_id') == 'client_1'
+        assert [m for m, _ in self.op.requests] == ['POST', 'POST']
+
+    def test_revoked(self):
+        self._register()
+        del self.op.registrations['client_0']
+        _context = self._register()
+        assert _context.get('client_id') == 'client_1'
+        assert [m for m, _ in self.op.requests] == ['POST', 'GET', 'POST']
+
+    def test_read_given_registration(self):
+        _response = self._register().get('registration_response')
+        # The service context knows nothing about the registration
+        _context = ServiceContext(config={'issuer': ISS})
+        _resp = RegistrationRead(_context).do_request(
+            self.op, registration_response=_response)
+        assert _resp['client_id'] == 'client_0'
+        assert _context.get('registration_response') is None
+
+    def test_no_verify(self):
+        self._register()
+        _context = self._register(conf={'verify_stored': False})
+        assert _context.get('client_id') == 'client_0'
+        assert [m for m, _ in self.op.requests] == ['POST']
+
+    def test_private_files(self):
+        _context = self._register()
+        _db = self.store.db
+        assert os.stat(_db.db_dir).st_mode & 0o077 == 0
+        _filename = _db._filename(self.store.key(_context))
+        assert os.stat(_filename).st_mode & 0o077 == 0
+
+    def test_corrupt(self):
+        _context = self._register()
+        self.store.db.set(self.store.key(_context), 'garbage')
+        assert self.store.lookup(_context) is None
+        assert self.store.db.get(self.store.key(_context)) is None
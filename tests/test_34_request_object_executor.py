@@ -0,0 +1,125 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from cryptojwt.jwe.jwe import factory as jwe_factory
+from cryptojwt.jws.jws import factory as jws_factory
+from cryptojwt.key_jar import build_keyjar
+
+from oidcservice.oidc.authorization import Authorization
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.org'
+
+KEYSPEC = [
+    {"type": "RSA", "use": ["sig", "enc"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+
+CLI_KEY = build_keyjar(KEYSPEC)
+OP_KEY = build_keyjar(KEYSPEC, issuer_id=ISS)
+
+CLI_KEY.import_jwks(OP_KEY.export_jwks(issuer_id=ISS), ISS)
+OP_KEY.import_jwks(CLI_KEY.export_jwks(), 'client_id')
+
+REQ_ARGS = {'response_type': 'code', 'state': 'state'}
+
+
+@pytest.fixture(scope='module')
+def thread_pool():
+    _pool = ThreadPoolExecutor(max_workers=2)
+    yield _pool
+    _pool.shutdown()
+
+
+@pytest.fixture(scope='module')
+def process_pool():
+    _pool = ProcessPoolExecutor(max_workers=1)
+    yield _pool
+    _pool.shutdown()
+
+
+def _service(executor):
+    service_context = ServiceContext(CLI_KEY, config={
+        'client_id': 'client_id', 'issuer': ISS,
+        'redirect_uris': ['https://rp.example.com/cb'],
+        'behaviour': {'response_types': ['code']}})
+    return Authorization(service_context,
+                         conf={'request_object_executor': executor})
+
+
+def _verify(request_object):
+    _jws = jws_factory(request_object)
+    assert _jws
+    _keys = OP_KEY.get_verify_key(key_type='RSA', issuer_id='client_id')
+    return _jws.verify_compact(request_object, keys=_keys)
+
+
+@pytest.mark.parametrize('pool', ['thread_pool', 'process_pool'])
+def test_construct_request(pool, request):
+    _srv = _service(request.getfixturevalue(pool))
+    _req = _srv.construct_request(REQ_ARGS, request_method='value')
+    _payload = _verify(_req['request'])
+    assert _payload['iss'] == 'client_id'
+    assert _payload['aud'] == [ISS]
+    assert _payload['state'] == _req['state']
+    assert _srv.get_item(type(_req), 'auth_request', _req['state'])[
+        'request'] == _req['request']
+
+
+@pytest.mark.parametrize('pool', ['thread_pool', 'process_pool'])
+def test_async_construct_request(pool, request):
+    _srv = _service(request.getfixturevalue(pool))
+    _req = asyncio.run(
+        _srv.async_construct_request(REQ_ARGS, request_method='value'))
+    assert _verify(_req['request'])['state'] == _req['state']
+    assert _srv.get_item(type(_req), 'auth_request', _req['state'])[
+        'request'] == _req['request']
+
+
+def test_async_construct_request_no_executor():
+    _srv = _service(None)
+    _req = asyncio.run(
+        _srv.async_construct_request(REQ_ARGS, request_method='value'))
+    assert _verify(_req['request'])['state'] == _req['state']
+
+
+def test_encrypted(process_pool):
+    _srv = _service(process_pool)
+    _srv.conf['post_construct'] = {
+        'request_object_encryption_alg': 'RSA-OAEP',
+        'request_object_encryption_enc': 'A128CBC-HS256',
+        'target': ISS}
+    _req = _srv.construct_request(REQ_ARGS, request_method='value')
+    _jwe = jwe_factory(_req['request'])
+    assert _jwe
+    _signed = _jwe.decrypt(keys=OP_KEY.get_encrypt_key(key_type='RSA',
+                                                       issuer_id=ISS))
+    assert _verify(_signed.decode('utf-8'))['state'] == _req['state']
+
+
+def test_async_single_write(process_pool, monkeypatch):
+    _srv = _service(process_pool)
+    _writes = []
+    _store_items = _srv.store_items
+
+    def store_items(items, key):
+        _writes.append(dict(items))
+        return _store_items(items, key)
+
+    monkeypatch.setattr(_srv, 'store_items', store_items)
+    monkeypatch.setattr(_srv, 'store_item', None)
+    _req = asyncio.run(
+        _srv.async_construct_request(REQ_ARGS, request_method='value'))
+    assert len(_writes) == 1
+    assert _writes[0]['auth_request']['request'] == _req['request']
+
+
+def test_signing_jwks():
+    _srv = _service(None)
+    _jwks = _srv._signing_jwks(CLI_KEY, 'client_id', 'ES256')
+    assert len(_jwks['keys']) == 1
+    assert _jwks['keys'][0]['kty'] == 'EC'
+    # Serialized once
+    assert _srv._signing_jwks(CLI_KEY, 'client_id', 'ES256')['keys'][0] is \
+        _jwks['keys'][0]
@@ -0,0 +1,104 @@
+import time
+from urllib.parse import urlsplit
+
+import pytest
+from cryptojwt.key_jar import build_keyjar
+
+from oidcservice.oidc.authorization import Authorization
+from oidcservice.request_object_store import (REQUEST_OBJECT_CONTENT_TYPE,
+                                              InMemoryRequestObjectStore)
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.org'
+BASE_URL = 'https://rp.example.com/requests/'
+
+
+class TestInMemoryRequestObjectStore(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.store = InMemoryRequestObjectStore(BASE_URL, lifetime=300,
+                                                max_size=3)
+
+    def test_add_get(self):
+        _uri = self.store.add('request object')
+        assert _uri.startswith(BASE_URL)
+        assert self.store.get(_uri) == 'request object'
+        assert self.store.get('/requests/{}'.format(
+            self.store.name(_uri))) == 'request object'
+
+        self.store.remove(_uri)
+        assert self.store.get(_uri) is None
+
+    def test_given_request_uri(self):
+        _uri = '{}registered#hash'.format(BASE_URL)
+        assert self.store.add('first', _uri) == _uri
+        assert self.store.add('second', _uri) == _uri
+        assert self.store.get(_uri) == 'second'
+        assert len(self.store) == 1
+
+    def test_expiry(self):
+        _now = time.time()
+        _uri = self.store.add('request object', now=_now)
+        assert self.store.get(_uri, now=_now + 299) == 'request object'
+        assert self.store.get(_uri, now=_now + 300) is None
+
+        self.store.add('request object', now=_now)
+        assert self.store.remove_expired(now=_now + 300) == 1
+        assert len(self.store) == 0
+
+    def test_max_size(self):
+        _uris = [self.store.add(str(i)) for i in range(4)]
+        assert len(self.store) == 3
+        assert self.store.get(_uris[0]) is None
+        assert self.store.get(_uris[3]) == '3'
+
+    def test_response(self):
+        _uri = self.store.add('request object')
+        _status, _headers, _body = self.store.response(
+            '/requests/{}'.format(self.store.name(_uri)))
+        assert _status == 200
+        assert _headers['Content-Type'] == REQUEST_OBJECT_CONTENT_TYPE
+        assert _body == 'request object'
+        assert self.store.response('/requests/unknown.jwt')[0] == 404
+
+
+def test_authorization_request_uri():
+    _store = InMemoryRequestObjectStore(BASE_URL)
+    service_context = ServiceContext(build_keyjar([{"type": "RSA",
+                                                     "use": ["sig"]}]),
+                                     config={
+                                         'client_id': 'client_id',
+                                         'issuer': ISS,
+                                         'redirect_uris': [
+                                             'https://rp.example.com/cb'],
+                                         'behaviour': {
+                                             'response_types': ['code']}})
+    _srv = Authorization(service_context,
+                         conf={'request_object_store': _store})
+    _req = _srv.construct_request({'response_type': 'code', 'state': 'state'},
+                                  request_method='reference')
+    assert _req['request_uri'].startswith(BASE_URL)
+    assert _store.get(_req['request_uri']).count('.') == 2
+
+
+def test_authorization_registered_request_uri():
+    _store = InMemoryRequestObjectStore(BASE_URL)
+    service_context = ServiceContext(build_keyjar([{"type": "RSA",
+                                                     "use": ["sig"]}]),
+                                     config={
+                                         'client_id': 'client_id',
+                                         'issuer': ISS,
+                                         'redirect_uris': [
+                                             'https://rp.example.com/cb'],
+                                         'behaviour': {
+                                             'response_types': ['code']}})
+    service_context.set('registration_response', {
+        'request_uris': ['{}registered#hash'.format(BASE_URL)]})
+    _srv = Authorization(service_context,
+                         conf={'request_object_store': _store})
+    _req = _srv.construct_request({'response_type': 'code', 'state': 'state'},
+                                  request_method='reference')
+    # Only the registered URI is used
+    assert _req['request_uri'] == '{}registered#hash'.format(BASE_URL)
+    assert _store.get(_req['request_uri']).count('.') == 2
+    assert _store.response(urlsplit(_req['request_uri']).path)[0] == 200
@@ -0,0 +1,206 @@
+import json
+import threading
+
+import pytest
+from cryptojwt.exception import BadSignature
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from MockOP import HTTPResponse
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oidc import OpenIDSchema
+
+from oidcservice.oidc.userinfo import ExpiringCache, UserInfo
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.org'
+CP = 'https://cp.example.org'
+
+KEYSPEC = [{"type": "EC", "crv": "P-256", "use": ["sig"]}]
+
+CP_KEY = build_keyjar(KEYSPEC, issuer_id=CP)
+CLI_KEY = build_keyjar(KEYSPEC)
+CLI_KEY.import_jwks(CP_KEY.export_jwks(issuer_id=CP), CP)
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class ClaimsProvider(object):
+    """Serves claims from a number of endpoints, some of them as JWTs"""
+
+    def __init__(self, barrier=None):
+        self.requests = []
+        self.barrier = barrier
+        self.claims = {
+            '{}/address'.format(CP): {'address': {'locality': 'Umea'}},
+            '{}/phone'.format(CP): {'phone_number': '+46 90 7865000'}
+        }
+
+    def __call__(self, method, url, headers=None, **kwargs):
+        self.requests.append((url, headers.get('Authorization')))
+        if self.barrier:
+            # Only passes if the requests are made concurrently
+            self.barrier.wait(timeout=5)
+        if url not in self.claims:
+            return HTTPResponse('Not found', 404,
+                                {'Content-Type': 'text/plain'})
+        if url.endswith('phone'):
+            _jwt = JWT(CP_KEY, iss=CP, sign_alg='ES256')
+            return HTTPResponse(_jwt.pack(payload=self.claims[url]),
+                                200, {'Content-Type': 'application/jwt'})
+        return HTTPResponse(json.dumps(self.claims[url]), 200, JSON_HEADERS)
+
+
+def claims_access_token(endpoint, state):
+    return 'token_for_{}'.format(endpoint.rsplit('/', 1)[-1])
+
+
+def _service(claims_provider, token_callback=claims_access_token):
+    service_context = ServiceContext(CLI_KEY, config={
+        'client_id': 'client_id', 'issuer': ISS,
+        'redirect_uris': ['https://rp.example.com/cb']})
+    _srv = UserInfo(service_context,
+                    conf={'httpc': claims_provider,
+                          'claims_access_token': token_callback})
+    _srv.store_item(AccessTokenResponse(access_token='access_token'),
+                    'token_response', 'state')
+    return _srv
+
+
+def _response(sources):
+    return OpenIDSchema(
+        sub='diana',
+        _claim_names={'address': 'src1', 'phone_number': 'src2'},
+        _claim_sources=sources)
+
+
+def test_fetch_concurrently():
+    _cp = ClaimsProvider(barrier=threading.Barrier(2))
+    _srv = _service(_cp)
+    _resp = _srv.post_parse_response(_response({
+        'src1': {'endpoint': '{}/address'.format(CP)},
+        'src2': {'endpoint': '{}/phone'.format(CP),
+                 'access_token': 'cp_token'}}), state='state')
+    assert _resp['address'].to_dict() == {'locality': 'Umea'}
+    assert _resp['phone_number'] == '+46 90 7865000'
+    assert set(_cp.requests) == {
+        ('{}/address'.format(CP), 'Bearer token_for_address'),
+        ('{}/phone'.format(CP), 'Bearer cp_token')}
+
+
+def test_no_access_token():
+    _cp = ClaimsProvider()
+    _srv = _service(_cp, token_callback=None)
+    _resp = _srv.post_parse_response(_response({
+        'src1': {'endpoint': '{}/address'.format(CP)},
+        'src2': {'endpoint': '{}/phone'.format(CP),
+                 'access_token': 'cp_token'}}), state='state')
+    assert 'address' not in _resp
+    assert _resp['phone_number'] == '+46 90 7865000'
+    # The OP issued access token never leaves for the claims provider
+    assert _cp.requests == [('{}/phone'.format(CP), 'Bearer cp_token')]
+
+
+def test_bad_signature():
+    _srv = _service(ClaimsProvider())
+    _header, _, _sig = JWT(CP_KEY, iss=CP, sign_alg='ES256').pack(
+        payload={'address': {'locality': 'Stockholm'}}).split('.')
+    _payload = JWT(CP_KEY, iss=CP, sign_alg='ES256').pack(
+        payload={'address': {'locality': 'Paris'}}).split('.')[1]
+    _jwt = '.'.join([_header, _payload, _sig])
+    with pytest.raises(BadSignature):
+        _srv.post_parse_response(_response({'src1': {'JWT': _jwt}}),
+                                 state='state')
+
+
+def test_aggregated_and_distributed():
+    _cp = ClaimsProvider()
+    _srv = _service(_cp)
+    _jwt = JWT(CP_KEY, iss=CP, sign_alg='ES256').pack(
+        payload={'address': {'locality': 'Stockholm'}})
+    _resp = _srv.post_parse_response(_response({
+        'src1': {'JWT': _jwt},
+        'src2': {'endpoint': '{}/phone'.format(CP)}}), state='state')
+    assert _resp['address'].to_dict() == {'locality': 'Stockholm'}
+    assert _resp['phone_number'] == '+46 90 7865000'
+
+
+def test_failing_source_skipped():
+    _cp = ClaimsProvider()
+    _srv = _service(_cp)
+    _resp = _srv.post_parse_response(_response({
+        'src1': {'endpoint': '{}/unknown'.format(CP)},
+        'src2': {'endpoint': '{}/phone'.format(CP)}}), state='state')
+    assert 'address' not in _resp
+    assert _resp['phone_number'] == '+46 90 7865000'
+
+
+def test_cached():
+    _cp = ClaimsProvider()
+    _srv = _service(_cp)
+    for _ in range(2):
+        _resp = _srv.post_parse_response(_response({
+            'src1': {'endpoint': '{}/address'.format(CP)}}), state='state')
+        assert _resp['address'].to_dict() == {'locality': 'Umea'}
+    assert len(_cp.requests) == 1
+
+
+class TestExpiringCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.cache = ExpiringCache(max_size=2)
+
+    def test_expiry(self):
+        self.cache.set('a', 1, 100)
+        assert self.cache.get('a', now=99) == 1
+        assert self.cache.get('a', now=100) is None
+        assert len(self.cache) == 0
+
+    def test_max_size(self):
+        for i, key in enumerate('abc'):
+            self.cache.set(key, i, 100)
+        assert self.cache.get('a', now=1) is None
+        assert self.cache.get('c', now=1) == 2
+        self.cache.remove('c')
+        assert len(self.cache) == 1
+
+
+class TestAggregatedClaimsCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.service = _service(ClaimsProvider())
+        self.verified = []
+        _from_jwt = OpenIDSchema.from_jwt
+
+        def from_jwt(msg, txt, keyjar, **kwargs):
+            self.verified.append(txt)
+            return _from_jwt(msg, txt, keyjar, **kwargs)
+
+        self.from_jwt = from_jwt
+
+    def _jwt(self, lifetime=0):
+        return JWT(CP_KEY, iss=CP, sign_alg='ES256',
+                   lifetime=lifetime).pack(payload={'phone_number': '12345'})
+
+    def _unpack(self, jwt, monkeypatch):
+        monkeypatch.setattr('oidcmsg.message.Message.from_jwt', self.from_jwt)
+        for _ in range(3):
+            _resp = self.service.post_parse_response(OpenIDSchema(
+                sub='diana', _claim_names={'phone_number': 'src1'},
+                _claim_sources={'src1': {'JWT': jwt}}), state='state')
+            assert _resp['phone_number'] == '12345'
+
+    def test_verified_once(self, monkeypatch):
+        self._unpack(self._jwt(), monkeypatch)
+        assert len(self.verified) == 1
+
+    def test_bounded_by_exp(self, monkeypatch):
+        _jwt = self._jwt(lifetime=60)
+        self._unpack(_jwt, monkeypatch)
+        _exp = int(JWT(CLI_KEY).unpack(_jwt)['exp'])
+        (_expires_at, _), = self.service.jwt_cache._entries.values()
+        assert _expires_at == _exp
+
+    def test_expired_not_cached(self, monkeypatch):
+        self.service.claims_max_age = 0
+        self._unpack(self._jwt(), monkeypatch)
+        assert len(self.verified) == 3
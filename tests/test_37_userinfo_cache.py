@@ -0,0 +1,76 @@
+import json
+
+import pytest
+from MockOP import HTTPResponse
+from oidcmsg.oauth2 import AccessTokenResponse
+from oidcmsg.oidc import OpenIDSchema
+
+from oidcservice.oidc.refresh_access_token import RefreshAccessToken
+from oidcservice.oidc.userinfo import UserInfo
+from oidcservice.service_context import ServiceContext
+
+ISS = 'https://op.example.org'
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+class FakeOP(object):
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, method, url, data=None, headers=None, **kwargs):
+        self.requests.append(headers['Authorization'])
+        if headers['Authorization'] == 'Bearer revoked':
+            return HTTPResponse(json.dumps({'error': 'invalid_token'}),
+                                401, JSON_HEADERS)
+        return HTTPResponse(json.dumps({'sub': 'diana', 'name': 'Diana'}),
+                            200, JSON_HEADERS)
+
+
+class TestUserInfoCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.op = FakeOP()
+        service_context = ServiceContext(config={
+            'client_id': 'client_id', 'issuer': ISS,
+            'redirect_uris': ['https://rp.example.com/cb']})
+        self.service = UserInfo(service_context,
+                                conf={'user_info_max_age': 60})
+        self.service.endpoint = '{}/userinfo'.format(ISS)
+        self.service.store_item(AccessTokenResponse(access_token='token'),
+                                'token_response', 'state')
+
+    def test_cached(self):
+        _first = self.service.do_request(self.op, state='state')
+        assert isinstance(_first, OpenIDSchema)
+        _second = self.service.do_request(self.op, state='state')
+        assert _second is _first
+        assert self.op.requests == ['Bearer token']
+
+    def test_refreshed_token(self):
+        self.service.do_request(self.op, state='state')
+        _refresh = RefreshAccessToken(self.service.service_context)
+        _refresh.update_service_context(
+            AccessTokenResponse(access_token='new'), key='state')
+        self.service.do_request(self.op, state='state')
+        self.service.do_request(self.op, state='state')
+        assert self.op.requests == ['Bearer token', 'Bearer new']
+
+    def test_invalidate(self):
+        self.service.do_request(self.op, state='state')
+        self.service.invalidate_user_info('state')
+        self.service.do_request(self.op, state='state')
+        assert len(self.op.requests) == 2
+
+    def test_error_not_cached(self):
+        for _ in range(2):
+            _resp = self.service.do_request(
+                self.op, request_args={'access_token': 'revoked'},
+                state='state')
+            assert 'error' in _resp
+        assert len(self.op.requests) == 2
+
+    def test_not_enabled(self):
+        self.service.user_info_max_age = 0
+        self.service.do_request(self.op, state='state')
+        self.service.do_request(self.op, state='state')
+        assert len(self.op.requests) == 2
@@ -0,0 +1,127 @@
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+import pytest
+from oidcmsg.oauth2 import AuthorizationResponse
+
+from oidcservice.async_service import (AsyncService, AsyncTransport,
+                                       HTTPResponse, ThreadedTransport,
+                                       async_services)
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+
+ISS = 'https://op.example.org'
+
+PROVIDER_INFO = {
+    'issuer': ISS,
+    'authorization_endpoint': '{}/authorization'.format(ISS),
+    'token_endpoint': '{}/token'.format(ISS),
+    'jwks_uri': '{}/jwks.json'.format(ISS),
+    'response_types_supported': ['code'],
+    'subject_types_supported': ['public'],
+    'id_token_signing_alg_values_supported': ['RS256']
+}
+
+
+class FakeOP(AsyncTransport):
+    """An in-process OP"""
+
+    def __init__(self):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def request(self, method, url, data=None, headers=None):
+        self.requests.append((method, url))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+
+        if url == '{}/.well-known/openid-configuration'.format(ISS):
+            return HTTPResponse(200, json.dumps(PROVIDER_INFO),
+                                {'Content-Type': 'application/json'})
+        if url == PROVIDER_INFO['token_endpoint']:
+            _req = parse_qs(data)
+            if _req['code'] != ['access_code']:
+                return HTTPResponse(400, json.dumps({'error': 'invalid_grant'}),
+                                    {'Content-Type': 'application/json'})
+            return HTTPResponse(200, json.dumps({
+                'access_token': 'token', 'token_type': 'Bearer'}),
+                                {'Content-Type': 'application/json'})
+        return HTTPResponse(404, 'Not found', {'Content-Type': 'text/plain'})
+
+
+def jwks(method, url, **kwargs):
+    return HTTPResponse(200, json.dumps({'keys': []}),
+                        {'Content-Type': 'application/json'})
+
+
+class TestAsyncService(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        self.op = FakeOP()
+        service_context = ServiceContext(config={
+            'client_id': 'client_id', 'client_secret': 'a longesh password',
+            'issuer': ISS, 'redirect_uris': ['https://rp.example.com/cb']})
+        service_context.keyjar.httpc = jwks
+        self.services = async_services({
+            'discovery': service_factory('ProviderInfoDiscovery', ['oidc'],
+                                         service_context=service_context),
+            'token': service_factory('AccessToken', ['oidc'],
+                                     service_context=service_context)
+        }, self.op)
+
+    def _flow(self, code='access_code'):
+        async def flow():
+            await self.services['discovery'].do_request()
+            _srv = self.services['token']
+            _srv.store_item(AuthorizationResponse(code=code, state='state'),
+                            'auth_response', 'state')
+            return await _srv.do_request(
+                request_args={'redirect_uri': 'https://rp.example.com/cb'},
+                state='state')
+        return asyncio.run(flow())
+
+    def test_flow(self):
+        _resp = self._flow()
+        assert _resp['access_token'] == 'token'
+        _context = self.services['token'].service_context
+        assert _context.get('provider_info')['issuer'] == ISS
+        assert self.services['token'].get_item(
+            type(_resp), 'token_response', 'state')['access_token'] == 'token'
+        assert [m for m, _ in self.op.requests] == ['GET', 'POST']
+
+    def test_error_response(self):
+        _resp = self._flow(code='wrong')
+        assert _resp['error'] == 'invalid_grant'
+
+    def test_concurrent(self):
+        async def discover():
+            await asyncio.gather(*[self.services['discovery'].do_request()
+                                   for _ in range(5)])
+        asyncio.run(discover())
+        assert self.op.max_in_flight == 5
+
+    def test_delegation(self):
+        assert self.services['token'].service_name == 'accesstoken'
+        assert self.services['token'].transport is self.op
+
+
+def test_threaded_transport():
+    def httpc(method, url, data=None, headers=None):
+        return HTTPResponse(200, json.dumps(PROVIDER_INFO),
+                            {'Content-Type': 'application/json'})
+
+    service_context = ServiceContext(config={'issuer': ISS})
+    service_context.keyjar.httpc = jwks
+    _srv = AsyncService(
+        service_factory('ProviderInfoDiscovery', ['oidc'],
+                        service_context=service_context),
+        ThreadedTransport(httpc))
+    asyncio.run(_srv.do_request())
+    assert service_context.get('provider_info')['token_endpoint'] == \
+        PROVIDER_INFO['token_endpoint']
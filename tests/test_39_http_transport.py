@@ -0,0 +1,136 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from oidcservice.batch_refresh import BatchRefresh
+from oidcservice.bootstrap import HostLimitedTransport
+from oidcservice.http_transport import HTTPTransport
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _respond(self):
+        self.server.requests.append((self.command, self.path))
+        if self.server.failures:
+            self.server.failures -= 1
+            _status, _body = 503, b'busy'
+        else:
+            _status, _body = 200, json.dumps(
+                self.server.body or {'path': self.path}).encode()
+        _length = int(self.headers.get('Content-Length', 0))
+        if _length:
+            self.rfile.read(_length)
+        self.send_response(_status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    do_GET = _respond
+    do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    _server.requests = []
+    _server.failures = 0
+    _server.body = None
+    _thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    _thread.start()
+    yield _server
+    _server.shutdown()
+    _server.server_close()
+
+
+def _url(server, path='/'):
+    return 'http://127.0.0.1:{}{}'.format(server.server_address[1], path)
+
+
+def test_keep_alive(server):
+    _transport = HTTPTransport()
+    for i in range(3):
+        _resp = _transport('GET', _url(server, '/{}'.format(i)))
+        assert _resp.status_code == 200
+    _metrics = _transport.metrics()
+    assert _metrics['requests'] == 3
+    assert _metrics['connections_opened'] == 1
+    assert _metrics['connections_reused'] == 2
+    _transport.close()
+
+
+def test_retry_idempotent(server):
+    server.failures = 2
+    _transport = HTTPTransport(retries=2, backoff=0)
+    assert _transport('GET', _url(server)).status_code == 200
+    assert len(server.requests) == 3
+    assert _transport.metrics()['retries'] == 2
+
+
+def test_no_retry_post(server):
+    server.failures = 1
+    _transport = HTTPTransport(retries=2, backoff=0)
+    assert _transport('POST', _url(server), data='a=b').status_code == 503
+    assert len(server.requests) == 1
+    assert _transport.metrics()['retries'] == 0
+
+
+def test_connection_error():
+    _transport = HTTPTransport(retries=0)
+    with pytest.raises(Exception):
+        _transport('GET', 'http://127.0.0.1:1/')
+    assert _transport.metrics()['errors'] == 1
+
+
+def test_httpc_params(server, monkeypatch):
+    _transport = HTTPTransport({'timeout': 3, 'verify': False})
+    _seen = {}
+    _request = type(_transport.session(_url(server))).request
+
+    def request(session, method, url, **kwargs):
+        _seen.update(kwargs)
+        return _request(session, method, url, **kwargs)
+
+    monkeypatch.setattr('requests.Session.request', request)
+    _transport('GET', _url(server), timeout=5)
+    assert _seen['verify'] is False
+    assert _seen['timeout'] == 5
+
+
+def test_service_default(server):
+    service_context = ServiceContext(config={
+        'issuer': _url(server, ''),
+        'httpc_params': {'timeout': 5}})
+    _srv = service_factory('ProviderInfoDiscovery', ['oauth2'],
+                           service_context=service_context)
+    _transport = service_context.get_http_transport()
+    assert _transport.httpc_params == {'timeout': 5}
+    assert service_context.get_http_transport() is _transport
+
+    server.body = {'issuer': _url(server, ''),
+                   'authorization_endpoint': _url(server, '/authorization'),
+                   'response_types_supported': ['code'],
+                   'grant_types_supported': ['authorization_code']}
+    _srv.endpoint = _url(server, '/.well-known/openid-configuration')
+    _srv.do_request()
+    assert server.requests == [('GET', '/.well-known/openid-configuration')]
+    assert _transport.metrics()['requests'] == 1
+
+
+def test_default_for_helpers():
+    service_context = ServiceContext(config={'issuer': 'https://op.example.org'})
+    _srv = service_factory('RefreshAccessToken', ['oauth2'],
+                           service_context=service_context)
+    assert BatchRefresh(_srv).httpc is service_context.get_http_transport()
+    _httpc = HostLimitedTransport().httpc
+    assert isinstance(_httpc, HTTPTransport)
+    # Bootstrap does the retrying
+    assert _httpc.retries == 0
@@ -0,0 +1,124 @@
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+from cryptojwt.jwt import JWT
+from cryptojwt.key_jar import build_keyjar
+from oidcmsg.oauth2 import AuthorizationRequest
+from oidcmsg.oidc import AccessTokenResponse, IdToken, verified_claim_name
+
+from oidcservice.service_context import ServiceContext
+from oidcservice.service_factory import service_factory
+
+ISS = 'https://op.example.org'
+
+KEYSPEC = [
+    {"type": "RSA", "use": ["sig", "enc"]},
+    {"type": "EC", "crv": "P-256", "use": ["sig"]},
+]
+
+CLI_KEY = build_keyjar(KEYSPEC)
+OP_KEY = build_keyjar(KEYSPEC, issuer_id=ISS)
+
+CLI_KEY.import_jwks(OP_KEY.export_jwks(issuer_id=ISS), ISS)
+OP_KEY.import_jwks(CLI_KEY.export_jwks(), 'client_id')
+
+
+@pytest.fixture(scope='module')
+def thread_pool():
+    _pool = ThreadPoolExecutor(max_workers=2)
+    yield _pool
+    _pool.shutdown()
+
+
+@pytest.fixture(scope='module')
+def process_pool():
+    _pool = ProcessPoolExecutor(max_workers=1)
+    yield _pool
+    _pool.shutdown()
+
+
+def _service(executor):
+    service_context = ServiceContext(CLI_KEY, config={
+        'client_id': 'client_id', 'issuer': ISS,
+        'redirect_uris': ['https://rp.example.com/cb']})
+    _srv = service_factory('AccessToken', ['oidc'],
+                           service_context=service_context,
+                           conf={'verify_executor': executor})
+    _srv.store_item(AuthorizationRequest(
+        redirect_uri='https://rp.example.com/cb', state='state',
+        response_type='code', nonce='nonce'), 'auth_request', 'state')
+    _srv.store_nonce2state('nonce', 'state')
+    return _srv
+
+
+def _id_token(keyjar=OP_KEY, **kwargs):
+    _jwt = JWT(keyjar, iss=ISS, lifetime=300, **kwargs)
+    return _jwt.pack(payload={'sub': 'diana', 'nonce': 'nonce'},
+                     recv='client_id')
+
+
+def _response(id_token):
+    return AccessTokenResponse(access_token='token', token_type='Bearer',
+                               id_token=id_token).to_json()
+
+
+@pytest.mark.parametrize('pool', [None, 'thread_pool', 'process_pool'])
+def test_verify(pool, request):
+    _srv = _service(request.getfixturevalue(pool) if pool else None)
+    _resp = _srv.parse_response(_response(_id_token(sign_alg='RS256')),
+                                state='state')
+    assert isinstance(_resp, AccessTokenResponse)
+    _idt = _resp[verified_claim_name('id_token')]
+    assert isinstance(_idt, IdToken)
+    assert _idt['sub'] == 'diana'
+    assert _idt['iss'] == ISS
+
+
+def test_encrypted_userinfo(process_pool):
+    # JWT.unpack looks for the decryption keys under the client ID
+    _keyjar = CLI_KEY.copy()
+    _keyjar.import_jwks(CLI_KEY.export_jwks(private=True), 'client_id')
+    service_context = ServiceContext(_keyjar, config={
+        'client_id': 'client_id', 'issuer': ISS,
+        'redirect_uris': ['https://rp.example.com/cb']})
+    service_context.set('behaviour', {
+        'userinfo_signed_response_alg': 'ES256',
+        'userinfo_encrypted_response_alg': 'RSA-OAEP',
+        'userinfo_encrypted_response_enc': 'A128CBC-HS256'})
+    _srv = service_factory('UserInfo', ['oidc'],
+                           service_context=service_context,
+                           conf={'verify_executor': process_pool})
+    _srv.store_item(AuthorizationRequest(state='state'), 'auth_request',
+                    'state')
+    _jwt = JWT(OP_KEY, iss=ISS, sign_alg='ES256', encrypt=True,
+               enc_alg='RSA-OAEP', enc_enc='A128CBC-HS256')
+    _token = _jwt.pack(payload={'sub': 'diana', 'name': 'Diana'},
+                       recv='client_id')
+    assert _token.count('.') == 4
+    _resp = _srv.parse_response(_token, state='state', sformat='jwt')
+    assert _resp['name'] == 'Diana'
+
+
+def test_wrong_key(process_pool):
+    _srv = _service(process_pool)
+    _other = build_keyjar(KEYSPEC, issuer_id=ISS)
+    with pytest.raises(Exception):
+        _srv.parse_response(
+            _response(_id_token(keyjar=_other, sign_alg='RS256')),
+            state='state')
+
+
+def test_verification_keys():
+    _srv = _service(None)
+    _keys = json.loads(_srv._verification_keys(_id_token(sign_alg='RS256')))
+    assert list(_keys.keys()) == [ISS]
+    assert all('d' not in k for k in _keys[ISS]['keys'])
+    # Reused as long as the keys are the same
+    assert _srv._jwks(ISS) is _srv._jwks(ISS)
+
+    _jwe = _id_token(sign_alg='ES256', encrypt=True, enc_alg='RSA-OAEP',
+                     enc_enc='A128CBC-HS256')
+    _keys = json.loads(_srv._verification_keys(_jwe))
+    assert set(_keys.keys()) == {ISS, '', 'client_id'}
+    assert any('d' in k for k in _keys['']['keys'])